@@ -1,10 +1,113 @@
+import argparse
 import asyncio
 import logging
 
-from src.setup import respond
+from src.batch import run_batch, run_batch_api
+from src.models.settings import LoggingSettings
+from src.setup import build_batch_backend, build_task_manager, respond
+from src.utils.log_config import configure_logging, shutdown_logging
+from src.utils.tracing import shutdown_tracing
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.INFO)
-log.addHandler(logging.FileHandler('app.log'))
 
-asyncio.run(respond())
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m src',
+        description='Generate multimodal responses (interactively by default)',
+    )
+    parser.add_argument(
+        '--full-payloads',
+        action='store_true',
+        help='log prompts, plans and completions in full in app.log',
+    )
+    parser.add_argument(
+        '--hedge',
+        action='store_true',
+        help='send a duplicate of text element calls that run unusually long',
+    )
+    commands = parser.add_subparsers(dest='command')
+
+    batch = commands.add_parser(
+        'batch', help='generate responses to every prompt of a JSONL file'
+    )
+    batch.add_argument('input', help='JSONL file of requests')
+    batch.add_argument(
+        '--output-dir',
+        default='batch_output',
+        help='directory for the responses and the journal',
+    )
+    batch.add_argument(
+        '--concurrency',
+        type=int,
+        default=4,
+        help='maximum number of responses generated at once',
+    )
+    batch.add_argument(
+        '--format', choices=['markdown', 'html'], default='markdown'
+    )
+    batch.add_argument(
+        '--batch-api',
+        choices=['anthropic', 'openai', 'local'],
+        help=(
+            'submit the calls through a provider batch API in waves (plan,'
+            ' refine, generate) instead of making them one by one'
+        ),
+    )
+    batch.add_argument(
+        '--wave-size',
+        type=int,
+        default=1000,
+        help='maximum number of prompts per batch API wave',
+    )
+    batch.add_argument(
+        '--poll-interval',
+        type=float,
+        default=60.0,
+        help='seconds between batch API status checks',
+    )
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    configure_logging(LoggingSettings(full_payloads=args.full_payloads))
+    try:
+        await run(args)
+    finally:
+        # flush the remaining spans and log records
+        shutdown_tracing()
+        shutdown_logging()
+
+
+async def run(args: argparse.Namespace) -> None:
+    if args.command != 'batch':
+        await respond(hedge=args.hedge)
+        return
+
+    task_manager = build_task_manager(hedge=args.hedge)
+    if args.batch_api:
+        counts = await run_batch_api(
+            task_manager,
+            build_batch_backend(args.batch_api, task_manager),
+            args.input,
+            output_dir=args.output_dir,
+            wave_size=args.wave_size,
+            poll_interval=args.poll_interval,
+            output_format=args.format,
+        )
+    else:
+        counts = await run_batch(
+            task_manager,
+            args.input,
+            output_dir=args.output_dir,
+            concurrency=args.concurrency,
+            output_format=args.format,
+        )
+    print(
+        f'{counts["done"]} done, {counts["failed"]} failed,'
+        f' {counts["skipped"]} already done'
+    )
+
+
+asyncio.run(main())
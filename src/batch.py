@@ -0,0 +1,338 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from collections.abc import Iterator
+from pathlib import Path
+
+from src.clients.batch_backends import BatchBackend
+from src.models.response import MultimodalResponse
+from src.orchestration.batch_engine import BatchEngine
+from src.orchestration.task_manager import TaskManager
+from src.utils.formatting import (
+    save_response_to_html,
+    save_response_to_markdown,
+)
+from src.utils.image_downloader import ImageDownloader
+
+log = logging.getLogger(__name__)
+
+
+def read_prompts(path: str) -> Iterator[tuple[str, str]]:
+    """
+    Lazily read prompts from a JSONL file.
+
+    Each line is a JSON object with the prompt under `prompt` (or `body`,
+    prefixed by `title` if there is one) and an optional identifier under
+    `id` or `request_id`. Lines without an identifier are named after their
+    line number.
+
+    Parameters
+    ----------
+    path : str
+        The JSONL file
+
+    Yields
+    ------
+    tuple[str, str]
+        Identifier and prompt of each request
+    """
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                log.error('Skipping invalid JSON on line %d', line_number)
+                continue
+
+            request_id = str(
+                request.get('id')
+                or request.get('request_id')
+                or f'line-{line_number}'
+            )
+            prompt = request.get('prompt')
+            if prompt is None and request.get('body'):
+                prompt = request['body']
+                if request.get('title'):
+                    prompt = f'{request["title"]}\n\n{prompt}'
+            if not prompt:
+                log.error('Skipping request without a prompt: %s', request_id)
+                continue
+            yield request_id, prompt
+
+
+def _directory_name(request_id: str) -> str:
+    return re.sub(r'[^\w.-]', '_', request_id)
+
+
+class BatchJournal:
+    """
+    Append-only record of finished requests in a batch output directory.
+
+    Each line is a JSON object with the request `id`, its `status` ('done'
+    or 'failed') and the `output` file or `error`. Requests are only
+    considered finished once they are marked as done, so failed and
+    interrupted ones are retried when the batch is run again.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open the journal, loading the requests already done.
+
+        Parameters
+        ----------
+        path : str
+            The journal file
+        """
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # partially written line of an interrupted run
+                        continue
+                    if entry.get('status') == 'done':
+                        self.done.add(entry['id'])
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, request_id: str, status: str, **fields: str) -> None:
+        """Append an entry and flush it to disk."""
+        entry = {'id': request_id, 'status': status, **fields}
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if status == 'done':
+            self.done.add(request_id)
+
+    def close(self) -> None:
+        """Close the journal file."""
+        self._file.close()
+
+
+async def _save_response(
+    response: MultimodalResponse,
+    request_id: str,
+    output_dir: Path,
+    output_format: str,
+    downloader: ImageDownloader,
+) -> Path:
+    """Save a response to its own directory, returning the output file."""
+    request_dir = output_dir / _directory_name(request_id)
+    os.makedirs(request_dir, exist_ok=True)
+    if output_format == 'html':
+        output_path = request_dir / 'response.html'
+        save = save_response_to_html
+    else:
+        output_path = request_dir / 'response.md'
+        save = save_response_to_markdown
+    failures = await save(
+        response, str(output_path), request_id, downloader=downloader
+    )
+    if failures:
+        log.warning(
+            'Request %s: %d images could not be downloaded and are linked',
+            request_id,
+            len(failures),
+        )
+    with open(request_dir / 'response.json', 'w', encoding='utf-8') as f:
+        f.write(response.model_dump_json(indent=2))
+    return output_path
+
+
+async def _run_request(
+    task_manager: TaskManager,
+    journal: BatchJournal,
+    request_id: str,
+    prompt: str,
+    output_dir: Path,
+    output_format: str,
+    downloader: ImageDownloader,
+) -> bool:
+    """Generate and save the response to one request, returning success."""
+    try:
+        response = await task_manager.generate_response(prompt)
+        output_path = await _save_response(
+            response, request_id, output_dir, output_format, downloader
+        )
+    except Exception as e:
+        log.exception('Request %s failed', request_id)
+        journal.record(request_id, 'failed', error=repr(e))
+        return False
+
+    log.info('Request %s saved to %s', request_id, output_path)
+    journal.record(request_id, 'done', output=str(output_path))
+    return True
+
+
+async def run_batch(
+    task_manager: TaskManager,
+    input_path: str,
+    output_dir: str = 'batch_output',
+    concurrency: int = 4,
+    output_format: str = 'markdown',
+) -> dict[str, int]:
+    """
+    Generate responses to every request of a JSONL file.
+
+    Requests are read lazily and at most `concurrency` responses are
+    generated at a time. Each response is saved to its own directory under
+    `output_dir`, and recorded in `output_dir/journal.jsonl`; requests
+    already recorded as done there are skipped, so an interrupted batch can
+    be resumed by running it again.
+
+    Parameters
+    ----------
+    task_manager : TaskManager
+        Task manager generating the responses
+    input_path : str
+        JSONL file of requests (see `read_prompts`)
+    output_dir : str, optional
+        Directory for the responses and the journal, by default
+        'batch_output'
+    concurrency : int, optional
+        Maximum number of responses generated at once, by default 4
+    output_format : str, optional
+        'markdown' or 'html', by default 'markdown'
+
+    Returns
+    -------
+    dict[str, int]
+        Number of requests done, failed and skipped
+    """
+    output_dir = Path(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    journal = BatchJournal(str(output_dir / 'journal.jsonl'))
+    semaphore = asyncio.Semaphore(concurrency)
+    # one connection pool for the images of every response
+    downloader = ImageDownloader()
+    tasks = set()
+    counts = {'done': 0, 'failed': 0, 'skipped': 0}
+
+    async def run(request_id: str, prompt: str) -> None:
+        try:
+            succeeded = await _run_request(
+                task_manager,
+                journal,
+                request_id,
+                prompt,
+                output_dir,
+                output_format,
+                downloader,
+            )
+            counts['done' if succeeded else 'failed'] += 1
+        finally:
+            semaphore.release()
+
+    try:
+        for request_id, prompt in read_prompts(input_path):
+            if request_id in journal.done:
+                counts['skipped'] += 1
+                continue
+            # wait for a free slot before reading further
+            await semaphore.acquire()
+            task = asyncio.create_task(run(request_id, prompt))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await downloader.close()
+        journal.close()
+
+    log.info('Batch finished: %s', counts)
+    return counts
+
+
+async def run_batch_api(
+    task_manager: TaskManager,
+    backend: BatchBackend,
+    input_path: str,
+    output_dir: str = 'batch_output',
+    wave_size: int = 1000,
+    poll_interval: float = 60.0,
+    output_format: str = 'markdown',
+) -> dict[str, int]:
+    """
+    Generate responses to every request of a JSONL file through a provider
+    batch API.
+
+    Requests are read lazily in groups of `wave_size`, and each group goes
+    through the pipeline in batched waves (see `BatchEngine`). Responses
+    and the journal are written as in `run_batch`, so the two modes can
+    resume each other's runs.
+
+    Parameters
+    ----------
+    task_manager : TaskManager
+        Task manager providing the planner, clients and settings
+    backend : BatchBackend
+        Batch API to submit the calls to
+    input_path : str
+        JSONL file of requests (see `read_prompts`)
+    output_dir : str, optional
+        Directory for the responses and the journal, by default
+        'batch_output'
+    wave_size : int, optional
+        Maximum number of prompts per group of waves, by default 1000
+    poll_interval : float, optional
+        Seconds between batch status checks, by default 60
+    output_format : str, optional
+        'markdown' or 'html', by default 'markdown'
+
+    Returns
+    -------
+    dict[str, int]
+        Number of requests done, failed and skipped
+    """
+    output_dir = Path(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    journal = BatchJournal(str(output_dir / 'journal.jsonl'))
+    engine = BatchEngine(task_manager, backend, poll_interval=poll_interval)
+    downloader = ImageDownloader()
+    counts = {'done': 0, 'failed': 0, 'skipped': 0}
+
+    async def run_group(group: list[tuple[str, str]]) -> None:
+        responses = await engine.generate_responses(
+            [prompt for _, prompt in group]
+        )
+        for (request_id, _), response in zip(group, responses, strict=True):
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                output_path = await _save_response(
+                    response, request_id, output_dir, output_format, downloader
+                )
+            except Exception as e:
+                log.error('Request %s failed: %r', request_id, e)
+                journal.record(request_id, 'failed', error=repr(e))
+                counts['failed'] += 1
+                continue
+            journal.record(request_id, 'done', output=str(output_path))
+            counts['done'] += 1
+
+    try:
+        group = []
+        for request_id, prompt in read_prompts(input_path):
+            if request_id in journal.done:
+                counts['skipped'] += 1
+                continue
+            group.append((request_id, prompt))
+            if len(group) == wave_size:
+                await run_group(group)
+                group = []
+        if group:
+            await run_group(group)
+    finally:
+        await downloader.close()
+        journal.close()
+
+    log.info('Batch finished: %s', counts)
+    return counts
@@ -0,0 +1,370 @@
+"""
+Benchmark the response pipeline end to end: planning, refinement and
+generation against mock clients with simulated latency, TikZ compilation
+and rendering to Markdown and HTML.
+
+Run with `python -m src.benchmarks.pipeline`. Without pdflatex, the TikZ
+subtasks and the compile stage are left out. Pass `--output` to save the
+results as JSON and `--baseline` to compare them against an earlier run;
+the exit status is 1 if a stage regressed by more than `--threshold`.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+from src.benchmarks.tikz_format import sample_figures
+from src.clients.mock_client import MockClient, MockLatency, default_plan
+from src.models.provider import ModelProvider
+from src.orchestration.task_manager import TaskManager
+from src.orchestration.task_planner import TaskPlanner
+from src.utils.formatting import (
+    save_response_to_html,
+    save_response_to_markdown,
+)
+from src.utils.tikz_compiler import (
+    TikzCompiler,
+    _pdflatex_command,
+    compile_tikz,
+)
+
+# Median latency of each mock call in seconds, before scaling
+latencies = {'plan': 8.0, 'text': 4.0, 'image': 10.0, 'tikz': 6.0}
+
+percentiles = (50, 95, 99)
+
+
+def summarize(timings: list[float]) -> dict[str, float]:
+    """Mean, percentiles and extremes of a stage's timings."""
+    summary = {'mean': statistics.mean(timings)}
+    if len(timings) > 1:
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+        for p in percentiles:
+            summary[f'p{p}'] = cuts[p - 1]
+    else:
+        for p in percentiles:
+            summary[f'p{p}'] = timings[0]
+    summary['min'] = min(timings)
+    summary['max'] = max(timings)
+    summary['samples'] = len(timings)
+    return summary
+
+
+class PipelineBenchmark:
+    """
+    Runs each stage of the pipeline once per repetition.
+
+    The stages are 'respond' (`TaskManager.generate_response`, i.e. plan,
+    refine, generate and compile), 'first_element' (the time until
+    `TaskManager.stream_response` yields its first element),
+    'compile_tikz' (one sample figure, without cache), 'to_markdown',
+    'save_markdown' and 'save_html'.
+    """
+
+    def __init__(
+        self,
+        work_dir: Path,
+        latency_scale: float = 0.05,
+        sigma: float = 0.25,
+        tail_probability: float = 0.02,
+        tex: bool = True,
+        seed: int = 0,
+    ) -> None:
+        self.work_dir = work_dir
+        self.tex = tex
+        plan = default_plan
+        if not tex:
+            plan = {
+                'subtasks': [
+                    task
+                    for task in default_plan['subtasks']
+                    if task['type'] != 'tikz'
+                ]
+            }
+        latency = {
+            method: MockLatency(
+                median=median * latency_scale,
+                sigma=sigma,
+                tail_probability=tail_probability,
+            )
+            for method, median in latencies.items()
+        }
+        self.clients = {
+            kind: MockClient(latency=latency, plan=plan, seed=seed + i)
+            for i, kind in enumerate(('planner', 'text', 'image', 'tikz'))
+        }
+        planner = TaskPlanner(ModelProvider.MOCK, api_key=None, model='mock')
+        planner.client = self.clients['planner']
+        self.task_manager = TaskManager(
+            self.clients['text'],
+            self.clients['image'],
+            self.clients['tikz'],
+            planner,
+            refine_tasks=True,
+            stream_plan=True,
+            tikz_compiler=TikzCompiler(output_dir=str(work_dir / 'tikz')),
+        )
+        self.figure = sample_figures()[0]
+        self.response = None
+        self._runs = 0
+
+    def stages(self) -> dict[str, Callable[[], Awaitable[Any]]]:
+        """The stages to run, in order."""
+        stages = {'respond': self.respond, 'first_element': self.first_element}
+        if self.tex:
+            stages['compile_tikz'] = self.compile_tikz
+        stages['to_markdown'] = self.to_markdown
+        stages['save_markdown'] = self.save_markdown
+        stages['save_html'] = self.save_html
+        return stages
+
+    async def respond(self) -> None:
+        self.response = await self.task_manager.generate_response(
+            'Explain how a rainbow forms.'
+        )
+
+    async def first_element(self) -> None:
+        stream = self.task_manager.stream_response(
+            'Explain how a rainbow forms.'
+        )
+        async for _ in stream:
+            break
+        # cancels the rest of the response
+        await stream.aclose()
+
+    async def compile_tikz(self) -> None:
+        output_dir = self.work_dir / f'compile-{self._runs}'
+        await asyncio.to_thread(compile_tikz, self.figure, str(output_dir))
+
+    async def to_markdown(self) -> None:
+        self.response.to_markdown()
+
+    async def save_markdown(self) -> None:
+        output_dir = self.work_dir / f'markdown-{self._runs}'
+        output_dir.mkdir()
+        await save_response_to_markdown(
+            self.response, str(output_dir / 'response.md'), 'Benchmark'
+        )
+
+    async def save_html(self) -> None:
+        output_dir = self.work_dir / f'html-{self._runs}'
+        output_dir.mkdir()
+        await save_response_to_html(
+            self.response, str(output_dir / 'response.html'), 'Benchmark'
+        )
+
+    async def run_once(self, trace_memory: bool = False) -> dict[str, float]:
+        """
+        Run every stage once.
+
+        Returns
+        -------
+        dict[str, float]
+            Wall time of each stage in seconds, or its peak traced memory
+            in bytes if `trace_memory` is set
+        """
+        self._runs += 1
+        results = {}
+        for name, stage in self.stages().items():
+            if trace_memory:
+                tracemalloc.start()
+                await stage()
+                results[name] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                start = time.perf_counter()
+                await stage()
+                results[name] = time.perf_counter() - start
+        return results
+
+    async def run(self, repetitions: int, warmup: int = 1) -> dict[str, Any]:
+        """
+        Run the benchmark.
+
+        Memory is measured in one extra, untimed repetition, so that tracing
+        allocations doesn't slow down the timed ones.
+
+        Parameters
+        ----------
+        repetitions : int
+            Number of timed repetitions
+        warmup : int, optional
+            Number of untimed repetitions first, by default 1
+
+        Returns
+        -------
+        dict[str, Any]
+            Timing summary of each stage and of the total, peak memory of
+            each stage, and the mock clients' call counts
+        """
+        for _ in range(warmup):
+            await self.run_once()
+        for client in self.clients.values():
+            client.reset()
+
+        timings = {}
+        totals = []
+        for _ in range(repetitions):
+            run = await self.run_once()
+            for name, duration in run.items():
+                timings.setdefault(name, []).append(duration)
+            totals.append(sum(run.values()))
+        clients = {kind: client.stats for kind, client in self.clients.items()}
+
+        memory = await self.run_once(trace_memory=True)
+        return {
+            'stages': {
+                name: summarize(values) for name, values in timings.items()
+            },
+            'total': summarize(totals),
+            'peak_memory': memory,
+            'clients': clients,
+        }
+
+
+def compare(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    metric: str = 'p50',
+    threshold: float = 0.1,
+    min_delta: float = 0.001,
+) -> list[str]:
+    """
+    Find the stages that got slower than in a baseline run.
+
+    Parameters
+    ----------
+    results : dict[str, Any]
+        Results of the current run
+    baseline : dict[str, Any]
+        Results of the baseline run
+    metric : str, optional
+        Timing statistic to compare, by default 'p50'
+    threshold : float, optional
+        Relative slowdown tolerated, by default 0.1 (10%)
+    min_delta : float, optional
+        Absolute slowdown in seconds tolerated regardless of the threshold,
+        so that very fast stages don't fail on noise, by default 0.001
+
+    Returns
+    -------
+    list[str]
+        A description of each regression
+    """
+    current = {**results['stages'], 'total': results['total']}
+    previous = {**baseline['stages'], 'total': baseline['total']}
+    regressions = []
+    for name, summary in current.items():
+        if name not in previous:
+            continue
+        new, old = summary[metric], previous[name][metric]
+        if new > old * (1 + threshold) and new - old > min_delta:
+            regressions.append(
+                f'{name}: {metric} {old:.4f}s -> {new:.4f}s'
+                f' (+{(new / old - 1) * 100:.0f}%)'
+            )
+    return regressions
+
+
+def print_results(results: dict[str, Any]) -> None:
+    header = f'{"stage":<14}' + ''.join(
+        f' {column:>9}' for column in ('mean', 'p50', 'p95', 'p99')
+    )
+    print(f'{header} {"peak mem":>10}')
+    rows = {**results['stages'], 'total': results['total']}
+    for name, summary in rows.items():
+        memory = results['peak_memory'].get(name)
+        memory = f'{memory / 1024:>8.0f}KB' if memory is not None else ''
+        print(
+            f'{name:<14}'
+            + ''.join(
+                f' {summary[column]:>8.4f}s'
+                for column in ('mean', 'p50', 'p95', 'p99')
+            )
+            + f' {memory:>10}'
+        )
+
+
+async def main(args: argparse.Namespace) -> int:
+    tex = shutil.which(_pdflatex_command()) is not None and not args.no_tex
+    if not tex:
+        print('Running without TikZ (pdflatex not found or --no-tex)')
+
+    work_dir = Path(tempfile.mkdtemp(prefix='pipeline_bench_'))
+    try:
+        benchmark = PipelineBenchmark(
+            work_dir,
+            latency_scale=args.latency_scale,
+            tex=tex,
+            seed=args.seed,
+        )
+        results = await benchmark.run(args.repetitions, args.warmup)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results['settings'] = {
+        'repetitions': args.repetitions,
+        'latency_scale': args.latency_scale,
+        'seed': args.seed,
+        'tex': tex,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.metric, args.threshold)
+        if regressions:
+            print('Regressions against the baseline:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print('No regressions against the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repetitions', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument(
+        '--latency-scale',
+        type=float,
+        default=0.05,
+        help='factor applied to the simulated call latencies',
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-tex', action='store_true', help='leave out TikZ figures'
+    )
+    parser.add_argument('--output', help='JSON file to save the results to')
+    parser.add_argument(
+        '--baseline', help='JSON results of an earlier run to compare to'
+    )
+    parser.add_argument(
+        '--metric', choices=['mean', 'p50', 'p95', 'p99'], default='p50'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.1,
+        help='relative slowdown tolerated before failing',
+    )
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,90 @@
+"""
+Benchmark the TikZ rasterizer backends: time and output size per figure.
+
+Run with `python -m src.benchmarks.rasterizers` (requires pdflatex and the
+backends' executables; missing backends are skipped).
+"""
+
+import argparse
+import asyncio
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from src.benchmarks.tikz_format import sample_figures
+from src.utils.rasterizers import (
+    DvisvgmRasterizer,
+    ImageMagickRasterizer,
+    PdftocairoRasterizer,
+    Rasterizer,
+)
+from src.utils.tikz_compiler import TikzCompiler, _pdflatex_args, _prepare_job
+
+backends = {
+    'imagemagick-300': ImageMagickRasterizer(density=300),
+    'pdftocairo-300': PdftocairoRasterizer(density=300),
+    'pdftocairo-150': PdftocairoRasterizer(density=150),
+    'pdftoppm-150': PdftocairoRasterizer(density=150, executable='pdftoppm'),
+    'dvisvgm-svg': DvisvgmRasterizer(),
+}
+
+
+async def compile_pdfs(compiler: TikzCompiler, work_dir: Path) -> list[Path]:
+    """Compile the sample figures to PDF once, for all backends to share."""
+    pdfs = []
+    for figure in sample_figures():
+        tex_path, pdf_path, _ = _prepare_job(figure, str(work_dir))
+        await compiler._run(_pdflatex_args(tex_path, str(work_dir)))
+        pdfs.append(pdf_path)
+    return pdfs
+
+
+async def time_backend(
+    compiler: TikzCompiler,
+    rasterizer: Rasterizer,
+    pdfs: list[Path],
+    repetitions: int,
+) -> tuple[list[float], list[int]]:
+    timings, sizes = [], []
+    for _ in range(repetitions):
+        for i, pdf_path in enumerate(pdfs):
+            output_path = pdf_path.with_name(
+                f'{pdf_path.stem}-{i}{rasterizer.extension}'
+            )
+            start = time.perf_counter()
+            await compiler._run(rasterizer.command(pdf_path, output_path))
+            timings.append(time.perf_counter() - start)
+            sizes.append(output_path.stat().st_size)
+    return timings, sizes
+
+
+async def main(repetitions: int) -> None:
+    work_dir = Path(tempfile.mkdtemp(prefix='rasterizer_bench_'))
+    compiler = TikzCompiler(output_dir=str(work_dir))
+
+    try:
+        pdfs = await compile_pdfs(compiler, work_dir)
+
+        print(f'{"backend":<16} {"mean time":>10} {"mean bytes":>12}')
+        for name, rasterizer in backends.items():
+            if shutil.which(rasterizer.command(Path(), Path())[0]) is None:
+                print(f'{name:<16} {"skipped (not installed)":>23}')
+                continue
+            timings, sizes = await time_backend(
+                compiler, rasterizer, pdfs, repetitions
+            )
+            print(
+                f'{name:<16} {statistics.mean(timings):>9.3f}s'
+                f' {statistics.mean(sizes):>12,.0f}'
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repetitions', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.repetitions))
@@ -0,0 +1,82 @@
+"""
+Benchmark per-figure TikZ compile time with and without the precompiled
+preamble format.
+
+Run with `python -m src.benchmarks.tikz_format` (requires pdflatex and
+ImageMagick).
+"""
+
+import argparse
+import asyncio
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from src.orchestration.prompts.tikz_prompt import tikz_examples
+from src.utils.tikz_compiler import TikzCompiler
+
+
+def sample_figures() -> list[str]:
+    """TikZ figures from the prompt examples, with format escapes removed."""
+    return [
+        example['response'].replace('{{', '{').replace('}}', '}')
+        for example in tikz_examples
+    ]
+
+
+async def time_compiles(
+    compiler: TikzCompiler, figures: list[str], repetitions: int
+) -> list[float]:
+    """Compile each figure `repetitions` times, one at a time."""
+    timings = []
+    for _ in range(repetitions):
+        for figure in figures:
+            start = time.perf_counter()
+            await compiler.compile(figure)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def main(repetitions: int) -> None:
+    figures = sample_figures()
+    work_dir = Path(tempfile.mkdtemp(prefix='tikz_format_bench_'))
+
+    try:
+        baseline = TikzCompiler(output_dir=str(work_dir / 'baseline'))
+        formatted = TikzCompiler(
+            output_dir=str(work_dir / 'formatted'),
+            format_dir=str(work_dir / 'format'),
+        )
+
+        # the first compile with a format dir also dumps the format
+        start = time.perf_counter()
+        await formatted.compile(figures[0])
+        build_time = time.perf_counter() - start
+
+        results = {
+            'preamble': await time_compiles(baseline, figures, repetitions),
+            'format': await time_compiles(formatted, figures, repetitions),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f'First compile incl. format dump: {build_time:.3f}s')
+    print(f'{"mode":<10} {"mean":>8} {"median":>8} {"min":>8}')
+    for mode, timings in results.items():
+        print(
+            f'{mode:<10} {statistics.mean(timings):>7.3f}s'
+            f' {statistics.median(timings):>7.3f}s {min(timings):>7.3f}s'
+        )
+    speedup = statistics.mean(results['preamble']) / statistics.mean(
+        results['format']
+    )
+    print(f'Per-figure speedup: {speedup:.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repetitions', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.repetitions))
@@ -1,14 +1,24 @@
 import json
+from collections.abc import AsyncIterator
 from typing import Any
 
 import anthropic
 
-from src.models.provider import ModelClient
+from src.clients.rate_limiter import (
+    RateLimiter,
+    Reservation,
+    estimate_tokens,
+    get_rate_limiter,
+    parse_retry_after,
+)
+from src.models.provider import ModelClient, ModelProvider, StreamTimer
 
 
 class AnthropicClient(ModelClient):
     """Wrapper class to access Anthropic models."""
 
+    provider = ModelProvider.ANTHROPIC
+
     def __init__(self, model: str, api_key: str) -> None:
         """
         Initialize the client.
@@ -20,29 +30,169 @@ class AnthropicClient(ModelClient):
         api_key : str
             Anthropic API key
         """
-        self.client = anthropic.Anthropic(api_key=api_key)
+        # retries are left to the shared rate limiter
+        self.client = anthropic.AsyncAnthropic(api_key=api_key, max_retries=0)
         self.model = model
+        self.prompt_cache_usage = {
+            'input_tokens': 0,
+            'cached_tokens': 0,
+            'cache_write_tokens': 0,
+        }
 
-    async def generate_text(
+    @staticmethod
+    def _messages(prompt: str, prefix: str | None) -> list[dict[str, Any]]:
+        """
+        Build the user message, with the static prefix as a separate content
+        block marked as a cache breakpoint.
+        """
+        if prefix is None:
+            return [{'role': 'user', 'content': prompt}]
+
+        content = [
+            {
+                'type': 'text',
+                'text': prefix,
+                'cache_control': {'type': 'ephemeral'},
+            },
+            {'type': 'text', 'text': prompt},
+        ]
+        return [{'role': 'user', 'content': content}]
+
+    def _record_usage(self, model: str, message: Any) -> int:
+        """Record the usage of a message, returning the rate-limited tokens."""
+        usage = message.usage
+        cache_read = usage.cache_read_input_tokens or 0
+        cache_write = usage.cache_creation_input_tokens or 0
+        # output_tokens includes thinking, which isn't counted on its own:
+        # estimate it from the thinking text
+        thinking_tokens = sum(
+            len(block.thinking) // 4
+            for block in message.content
+            if block.type == 'thinking'
+        )
+        self._record_tokens(
+            model,
+            # input_tokens only counts the tokens after the last breakpoint
+            input_tokens=usage.input_tokens + cache_read + cache_write,
+            output_tokens=usage.output_tokens,
+            cached_tokens=cache_read,
+            cache_write_tokens=cache_write,
+            thinking_tokens=min(thinking_tokens, usage.output_tokens),
+        )
+        # cache reads don't count towards the input tokens per minute
+        return usage.input_tokens + cache_write + usage.output_tokens
+
+    @staticmethod
+    def _limiter(model: str) -> RateLimiter:
+        return get_rate_limiter(ModelProvider.ANTHROPIC, model)
+
+    @staticmethod
+    def _retry_after(error: BaseException) -> float | None:
+        if isinstance(error, anthropic.RateLimitError):
+            return parse_retry_after(error.response.headers)
+        if isinstance(
+            error,
+            (anthropic.APIConnectionError, anthropic.InternalServerError),
+        ):
+            # transient (including 529 overloaded): plain backoff
+            return 0.0
+        return None
+
+    async def _create(
+        self,
+        model: str,
+        prompt: str,
+        prefix: str | None,
+        max_tokens: int,
+        **kwargs: Any,
+    ) -> Any:
+        """Create a message, subject to the model's rate limit."""
+
+        async def call(reservation: Reservation) -> Any:
+            response = await self.client.messages.create(
+                model=model,
+                max_tokens=max_tokens,
+                messages=self._messages(prompt, prefix),
+                **kwargs,
+            )
+            reservation.used = self._record_usage(model, response)
+            return response
+
+        return await self._limiter(model).run(
+            call,
+            estimate_tokens(prompt, prefix, max_tokens),
+            self._retry_after,
+        )
+
+    async def _stream(
+        self,
+        model: str,
+        prompt: str,
+        prefix: str | None,
+        max_tokens: int,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """Stream the text of a message, subject to the model's rate limit."""
+
+        async def call(reservation: Reservation) -> AsyncIterator[str]:
+            timer = StreamTimer()
+            async with self.client.messages.stream(
+                model=model,
+                max_tokens=max_tokens,
+                messages=self._messages(prompt, prefix),
+                **kwargs,
+            ) as stream:
+                # text_stream skips thinking deltas
+                async for text in stream.text_stream:
+                    timer.chunk()
+                    yield text
+                message = await stream.get_final_message()
+            reservation.used = self._record_usage(model, message)
+            self._record_stream(model, timer, message.usage.output_tokens)
+
+        async for text in self._limiter(model).stream(
+            call,
+            estimate_tokens(prompt, prefix, max_tokens),
+            self._retry_after,
+        ):
+            yield text
+
+    async def stream_text(
         self,
         prompt: str,
         model: str | None = None,
         max_tokens: int = 2000,
         temperature: float = 0.5,
-    ) -> str:
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
         """
-        Generate text element with Claude.
+        Stream text element from Claude.
         """
         model = model or self.model
 
-        response = self.client.messages.create(
-            model=model,
-            messages=[{'role': 'user', 'content': prompt}],
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
+        async for text in self._stream(
+            model, prompt, prefix, max_tokens, temperature=temperature
+        ):
+            yield text
 
-        return response.content[0].text
+    async def generate_text(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> str:
+        """
+        Generate text element with Claude.
+        """
+        chunks = [
+            text
+            async for text in self.stream_text(
+                prompt, model, max_tokens, temperature, prefix
+            )
+        ]
+        return ''.join(chunks)
 
     async def generate_image(
         self,
@@ -55,34 +205,42 @@ class AnthropicClient(ModelClient):
             'Anthropic/Claude does not support image generation.'
         )
 
-    async def generate_tikz(
+    async def stream_tikz(
         self,
         prompt: str,
         model: str | None = None,
         max_tokens: int = 2000,
         temperature: float = 0.5,
-    ) -> str:
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
         """
-        Generate TikZ code with Claude.
+        Stream TikZ completion from Claude.
         """
         model = model or self.model
 
-        response = self.client.messages.create(
-            model=model,
-            messages=[{'role': 'user', 'content': prompt}],
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
-
-        tikz_code = response.content[0].text
-
-        # Clean up the response to extract just the TikZ code
-        if '\\begin{tikzpicture}' in tikz_code:
-            tikz_code = tikz_code.split('\\begin{tikzpicture}')[1]
-        if '\\end{tikzpicture}' in tikz_code:
-            tikz_code = tikz_code.split('\\end{tikzpicture}')[0]
+        async for text in self._stream(
+            model, prompt, prefix, max_tokens, temperature=temperature
+        ):
+            yield text
 
-        return f'\\begin{{tikzpicture}}\n{tikz_code.strip()}\n\\end{{tikzpicture}}'
+    async def generate_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> str:
+        """
+        Generate TikZ code with Claude.
+        """
+        chunks = [
+            text
+            async for text in self.stream_tikz(
+                prompt, model, max_tokens, temperature, prefix
+            )
+        ]
+        return self._extract_tikz(''.join(chunks))
 
     async def generate_plan(
         self,
@@ -91,25 +249,47 @@ class AnthropicClient(ModelClient):
         max_tokens: int = 4000,
         temperature: float = 0.5,
         use_extended_thinking: bool = False,
+        prefix: str | None = None,
     ) -> dict[str, Any]:
         """
         Generate structured plan with Claude.
         """
         model = model or self.model
 
+        kwargs = {'temperature': temperature}
         if use_extended_thinking and model == 'claude-3-7-sonnet-20250219':
-            response = self.client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                thinking={'type': 'enabled', 'budget_tokens': 2048},
-                messages=[{'role': 'user', 'content': prompt}],
-                temperature=temperature,
-            )
-        else:
-            response = self.client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                messages=[{'role': 'user', 'content': prompt}],
-                temperature=temperature,
-            )
-        return json.loads(response.content[0].text)
+            # extended thinking only accepts the default temperature
+            kwargs = {'thinking': {'type': 'enabled', 'budget_tokens': 2048}}
+
+        response = await self._create(
+            model, prompt, prefix, max_tokens, **kwargs
+        )
+        # with extended thinking, the text follows the thinking blocks
+        text = next(
+            block.text for block in response.content if block.type == 'text'
+        )
+        return json.loads(text)
+
+    async def stream_plan(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 4000,
+        temperature: float = 0.5,
+        use_extended_thinking: bool = False,
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream structured plan text from Claude.
+        """
+        model = model or self.model
+
+        kwargs = {'temperature': temperature}
+        if use_extended_thinking and model == 'claude-3-7-sonnet-20250219':
+            # extended thinking only accepts the default temperature
+            kwargs = {'thinking': {'type': 'enabled', 'budget_tokens': 2048}}
+
+        async for text in self._stream(
+            model, prompt, prefix, max_tokens, **kwargs
+        ):
+            yield text
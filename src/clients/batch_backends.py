@@ -0,0 +1,320 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any
+
+import anthropic
+import openai
+from pydantic import BaseModel
+
+from src.clients.anthropic import AnthropicClient
+from src.models.provider import ModelClient
+
+log = logging.getLogger(__name__)
+
+
+class BatchRequest(BaseModel):
+    """One text completion in a batch."""
+
+    # letters, digits, '-' and '_' only (required by the Anthropic API)
+    custom_id: str
+    prompt: str
+    model: str
+    max_tokens: int = 2000
+    temperature: float = 0.5
+    # static start of the prompt (see `ModelClient.generate_text`)
+    prefix: str | None = None
+
+
+class BatchResult(BaseModel):
+    """Outcome of one request of a batch."""
+
+    custom_id: str
+    text: str | None = None
+    error: str | None = None
+
+
+class BatchBackend(ABC):
+    """
+    Base class for submitting text completions as an offline batch.
+
+    Batches trade latency (results may take up to a day) for throughput and
+    a lower price per token.
+    """
+
+    @abstractmethod
+    async def submit(self, requests: list[BatchRequest]) -> str:
+        """
+        Submit a batch of requests.
+
+        Parameters
+        ----------
+        requests : list[BatchRequest]
+            The requests, with unique `custom_id`s
+
+        Returns
+        -------
+        str
+            Identifier of the batch
+        """
+        pass
+
+    @abstractmethod
+    async def is_done(self, batch_id: str) -> bool:
+        """Whether the batch has finished processing."""
+        pass
+
+    @abstractmethod
+    async def results(self, batch_id: str) -> list[BatchResult]:
+        """Results of a finished batch (in any order)."""
+        pass
+
+    async def run(
+        self, requests: list[BatchRequest], poll_interval: float = 60.0
+    ) -> dict[str, BatchResult]:
+        """
+        Submit a batch and wait for its results.
+
+        Parameters
+        ----------
+        requests : list[BatchRequest]
+            The requests, with unique `custom_id`s
+        poll_interval : float, optional
+            Seconds between status checks, by default 60
+
+        Returns
+        -------
+        dict[str, BatchResult]
+            Result of every request, by `custom_id` (requests without a
+            result are reported as errors)
+        """
+        if not requests:
+            return {}
+
+        batch_id = await self.submit(requests)
+        log.info('Submitted batch %s of %d requests', batch_id, len(requests))
+        while not await self.is_done(batch_id):
+            await asyncio.sleep(poll_interval)
+
+        results = {
+            result.custom_id: result for result in await self.results(batch_id)
+        }
+        for request in requests:
+            if request.custom_id not in results:
+                results[request.custom_id] = BatchResult(
+                    custom_id=request.custom_id, error='missing result'
+                )
+        log.info('Batch %s finished', batch_id)
+        return results
+
+
+class AnthropicBatchBackend(BatchBackend):
+    """Batches through the Anthropic Message Batches API."""
+
+    def __init__(self, api_key: str) -> None:
+        self.client = anthropic.AsyncAnthropic(api_key=api_key)
+
+    async def submit(self, requests: list[BatchRequest]) -> str:
+        batch = await self.client.messages.batches.create(
+            requests=[
+                {
+                    'custom_id': request.custom_id,
+                    'params': {
+                        'model': request.model,
+                        'max_tokens': request.max_tokens,
+                        'temperature': request.temperature,
+                        'messages': self._messages(request),
+                    },
+                }
+                for request in requests
+            ]
+        )
+        return batch.id
+
+    @staticmethod
+    def _messages(request: BatchRequest) -> list[dict[str, Any]]:
+        # the prefix is cached across the requests of the batch as well
+        return AnthropicClient._messages(request.prompt, request.prefix)
+
+    async def is_done(self, batch_id: str) -> bool:
+        batch = await self.client.messages.batches.retrieve(batch_id)
+        return batch.processing_status == 'ended'
+
+    async def results(self, batch_id: str) -> list[BatchResult]:
+        results = []
+        async for entry in await self.client.messages.batches.results(
+            batch_id
+        ):
+            if entry.result.type == 'succeeded':
+                results.append(
+                    BatchResult(
+                        custom_id=entry.custom_id,
+                        text=entry.result.message.content[0].text,
+                    )
+                )
+            else:
+                # errored, canceled or expired
+                results.append(
+                    BatchResult(
+                        custom_id=entry.custom_id, error=entry.result.type
+                    )
+                )
+        return results
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Batches of chat completions through the OpenAI Batch API."""
+
+    def __init__(self, api_key: str) -> None:
+        self.client = openai.AsyncOpenAI(api_key=api_key)
+
+    async def submit(self, requests: list[BatchRequest]) -> str:
+        lines = [
+            json.dumps(
+                {
+                    'custom_id': request.custom_id,
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': {
+                        'model': request.model,
+                        'max_tokens': request.max_tokens,
+                        'temperature': request.temperature,
+                        'messages': [
+                            {
+                                'role': 'user',
+                                'content': ModelClient._with_prefix(
+                                    request.prompt, request.prefix
+                                ),
+                            }
+                        ],
+                    },
+                }
+            )
+            for request in requests
+        ]
+        input_file = await self.client.files.create(
+            file=('batch.jsonl', '\n'.join(lines).encode('utf-8')),
+            purpose='batch',
+        )
+        batch = await self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+        )
+        return batch.id
+
+    async def is_done(self, batch_id: str) -> bool:
+        batch = await self.client.batches.retrieve(batch_id)
+        return batch.status in ('completed', 'failed', 'expired', 'cancelled')
+
+    async def results(self, batch_id: str) -> list[BatchResult]:
+        batch = await self.client.batches.retrieve(batch_id)
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            content = await self.client.files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get('response') or {}
+                if entry.get('error') or response.get('status_code') != 200:
+                    results.append(
+                        BatchResult(
+                            custom_id=entry['custom_id'],
+                            error=json.dumps(
+                                entry.get('error') or response.get('body')
+                            ),
+                        )
+                    )
+                    continue
+                choice = response['body']['choices'][0]
+                results.append(
+                    BatchResult(
+                        custom_id=entry['custom_id'],
+                        text=choice['message']['content'],
+                    )
+                )
+        return results
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for a provider batch API.
+
+    A submitted batch is written to `<batch_dir>/<id>/requests.jsonl` and
+    processed in the background with a regular client (through its rate
+    limiter); the batch is done once `results.jsonl` has been written next
+    to it. Useful for testing batch runs offline or with mock clients.
+    """
+
+    def __init__(
+        self, client: ModelClient, batch_dir: str = 'local_batches'
+    ) -> None:
+        """
+        Initialize the backend.
+
+        Parameters
+        ----------
+        client : ModelClient
+            Client processing the requests
+        batch_dir : str, optional
+            Directory holding the batches, by default 'local_batches'
+        """
+        self.client = client
+        self.batch_dir = Path(batch_dir)
+        self._tasks = set()
+
+    async def submit(self, requests: list[BatchRequest]) -> str:
+        batch_id = f'batch_{uuid.uuid4().hex[:12]}'
+        directory = self.batch_dir / batch_id
+        os.makedirs(directory)
+        with open(directory / 'requests.jsonl', 'w', encoding='utf-8') as f:
+            for request in requests:
+                f.write(request.model_dump_json() + '\n')
+
+        task = asyncio.create_task(self._process(directory))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return batch_id
+
+    async def _complete(self, request: BatchRequest) -> BatchResult:
+        try:
+            text = await self.client.generate_text(
+                prompt=request.prompt,
+                model=request.model,
+                max_tokens=request.max_tokens,
+                temperature=request.temperature,
+                prefix=request.prefix,
+            )
+        except Exception as e:
+            return BatchResult(custom_id=request.custom_id, error=repr(e))
+        return BatchResult(custom_id=request.custom_id, text=text)
+
+    async def _process(self, directory: Path) -> None:
+        with open(directory / 'requests.jsonl', encoding='utf-8') as f:
+            requests = [BatchRequest.model_validate_json(line) for line in f]
+
+        results = await asyncio.gather(
+            *(self._complete(request) for request in requests)
+        )
+
+        # written under a temporary name so that it appears complete
+        partial_path = directory / 'results.jsonl.part'
+        with open(partial_path, 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(result.model_dump_json() + '\n')
+        os.replace(partial_path, directory / 'results.jsonl')
+
+    async def is_done(self, batch_id: str) -> bool:
+        return (self.batch_dir / batch_id / 'results.jsonl').exists()
+
+    async def results(self, batch_id: str) -> list[BatchResult]:
+        path = self.batch_dir / batch_id / 'results.jsonl'
+        with open(path, encoding='utf-8') as f:
+            return [BatchResult.model_validate_json(line) for line in f]
@@ -0,0 +1,441 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections.abc import AsyncIterator, Callable
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlparse
+
+from src.models.provider import ModelClient
+from src.utils.image_cache import ImageCache, image_extensions
+from src.utils.image_downloader import ImageDownloader
+from src.utils.tracing import add_counts
+
+
+class CompletionCache:
+    """
+    Persistent SQLite store of model completions.
+
+    Entries expire after `ttl` seconds, and once more than `max_entries` are
+    stored the least recently used ones are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = 'completion_cache.sqlite',
+        ttl: float | None = 7 * 24 * 3600,
+        max_entries: int = 10_000,
+    ) -> None:
+        """
+        Initialize the cache.
+
+        Parameters
+        ----------
+        path : str, optional
+            SQLite database file, by default 'completion_cache.sqlite'
+        ttl : float | None, optional
+            Seconds an entry stays valid, by default one week. None keeps
+            entries until they are evicted.
+        max_entries : int, optional
+            Maximum number of stored completions, by default 10000
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS completions ('
+            ' key TEXT PRIMARY KEY,'
+            ' value TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS completions_accessed_at'
+            ' ON completions (accessed_at)'
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def key(**fields: Any) -> str:
+        """Hash the fields identifying a completion into a cache key."""
+        payload = json.dumps(fields, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value, created_at FROM completions WHERE key = ?',
+                (key,),
+            ).fetchone()
+            if row is not None and (
+                self.ttl is None or now - row[1] <= self.ttl
+            ):
+                self._connection.execute(
+                    'UPDATE completions SET accessed_at = ? WHERE key = ?',
+                    (now, key),
+                )
+                self._connection.commit()
+                self.hits += 1
+                return row[0]
+
+            if row is not None:
+                # expired
+                self._connection.execute(
+                    'DELETE FROM completions WHERE key = ?', (key,)
+                )
+                self._connection.commit()
+            self.misses += 1
+            return None
+
+    def _put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)',
+                (key, value, now, now),
+            )
+            if self.ttl is not None:
+                self._connection.execute(
+                    'DELETE FROM completions WHERE created_at < ?',
+                    (now - self.ttl,),
+                )
+            self._connection.execute(
+                'DELETE FROM completions WHERE key IN ('
+                ' SELECT key FROM completions'
+                ' ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            )
+            self._connection.commit()
+
+    async def get(self, key: str) -> str | None:
+        """
+        Look up a completion.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from `key`
+
+        Returns
+        -------
+        str | None
+            The stored completion, or None on a miss
+        """
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, key: str, value: str) -> None:
+        """
+        Store a completion.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from `key`
+        value : str
+            The completion
+        """
+        await asyncio.to_thread(self._put, key, value)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Hit and miss counters of the cache."""
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+
+class CachedModelClient(ModelClient):
+    """
+    Client wrapper serving repeated text, TikZ and plan requests from a
+    `CompletionCache`, and generated images from an `ImageCache`.
+
+    Every generation method accepts `use_cache=False` to bypass the cache
+    for a single call. Requests of a kind without a configured cache are
+    passed through unchanged.
+    """
+
+    def __init__(
+        self,
+        client: ModelClient,
+        provider: str,
+        cache: CompletionCache | None = None,
+        image_cache: ImageCache | None = None,
+        downloader: ImageDownloader | None = None,
+    ) -> None:
+        """
+        Initialize the wrapper.
+
+        Parameters
+        ----------
+        client : ModelClient
+            The client to wrap
+        provider : str
+            Provider of the wrapped client (part of the cache key)
+        cache : CompletionCache | None, optional
+            The completion store, by default None
+        image_cache : ImageCache | None, optional
+            The generated image store, by default None
+        downloader : ImageDownloader | None, optional
+            Downloader to fetch generated images into the image cache with,
+            by default one for this client
+        """
+        self.client = client
+        self.provider = provider
+        self.cache = cache
+        self.image_cache = image_cache
+        self.downloader = downloader or ImageDownloader()
+        self.model = client.model
+        self.prompt_cache_usage = client.prompt_cache_usage
+
+    def _key(self, method: str, model: str | None, **fields: Any) -> str:
+        return CompletionCache.key(
+            method=method,
+            provider=self.provider,
+            model=model or self.model,
+            **fields,
+        )
+
+    async def generate_text(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        use_cache: bool = True,
+    ) -> str:
+        """
+        Generate text, reusing a stored completion if there is one.
+        """
+        kwargs = dict(
+            prompt=prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            prefix=prefix,
+        )
+        if not use_cache or self.cache is None:
+            return await self.client.generate_text(**kwargs)
+
+        key = self._key('text', **kwargs)
+        if (text := await self.cache.get(key)) is not None:
+            add_counts(cache_hits=1)
+            return text
+        text = await self.client.generate_text(**kwargs)
+        await self.cache.put(key, text)
+        return text
+
+    async def generate_image(
+        self,
+        prompt: str,
+        model: str | None = None,
+        size: str = '1024x1024',
+        quality: str = 'standard',
+        use_cache: bool = True,
+    ) -> str:
+        """
+        Generate an image, reusing a stored copy if there is one.
+
+        With an image cache, the generated image is downloaded into the
+        cache and the path of the local copy is returned instead of the
+        (expiring) provider URL.
+        """
+        kwargs = dict(prompt=prompt, model=model, size=size, quality=quality)
+        if not use_cache or self.image_cache is None:
+            return await self.client.generate_image(**kwargs)
+
+        key = self.image_cache.key(model or self.model, size, quality, prompt)
+        image_path = await asyncio.to_thread(self.image_cache.get, key)
+        if image_path is not None:
+            add_counts(image_cache_hits=1)
+            return image_path
+
+        image = await self.client.generate_image(**kwargs)
+        if not isinstance(image, str):
+            # e.g. an in-memory image, nothing to download
+            return image
+
+        extension = Path(urlparse(image).path).suffix.lower()
+        if extension not in image_extensions:
+            extension = '.png'
+        staging_path = self.image_cache.staging_path(extension)
+        if os.path.exists(image):
+            # already a local file (e.g. from the mock client)
+            await asyncio.to_thread(shutil.copyfile, image, staging_path)
+        else:
+            await self.downloader.download(image, staging_path)
+        return await asyncio.to_thread(self.image_cache.put, key, staging_path)
+
+    async def generate_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        use_cache: bool = True,
+    ) -> str:
+        """
+        Generate TikZ code, reusing a stored completion if there is one.
+        """
+        kwargs = dict(
+            prompt=prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            prefix=prefix,
+        )
+        if not use_cache or self.cache is None:
+            return await self.client.generate_tikz(**kwargs)
+
+        key = self._key('tikz', **kwargs)
+        if (tikz_code := await self.cache.get(key)) is not None:
+            add_counts(cache_hits=1)
+            return tikz_code
+        tikz_code = await self.client.generate_tikz(**kwargs)
+        await self.cache.put(key, tikz_code)
+        return tikz_code
+
+    async def generate_plan(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 4000,
+        temperature: float = 0.5,
+        use_cache: bool = True,
+        **kwargs: Any,
+    ) -> dict[str, Any]:
+        """
+        Generate a structured plan, reusing a stored one if there is one.
+        """
+        kwargs.update(
+            prompt=prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        if not use_cache or self.cache is None:
+            return await self.client.generate_plan(**kwargs)
+
+        key = self._key('plan', **kwargs)
+        if (plan := await self.cache.get(key)) is not None:
+            add_counts(cache_hits=1)
+            return json.loads(plan)
+        plan = await self.client.generate_plan(**kwargs)
+        await self.cache.put(key, json.dumps(plan))
+        return plan
+
+    async def _stream(
+        self,
+        method: str,
+        stream: Callable[..., AsyncIterator[str]],
+        use_cache: bool,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Stream a completion from `stream`, replaying a stored one in a
+        single chunk if there is one.
+        """
+        if not use_cache or self.cache is None:
+            async for chunk in stream(**kwargs):
+                yield chunk
+            return
+
+        key = self._key(method, **kwargs)
+        if (completion := await self.cache.get(key)) is not None:
+            add_counts(cache_hits=1)
+            yield completion
+            return
+
+        chunks = []
+        async for chunk in stream(**kwargs):
+            chunks.append(chunk)
+            yield chunk
+        await self.cache.put(key, ''.join(chunks))
+
+    async def stream_text(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        use_cache: bool = True,
+    ) -> AsyncIterator[str]:
+        """
+        Stream text, replaying a stored completion in a single chunk if
+        there is one.
+        """
+        async for chunk in self._stream(
+            'stream_text',
+            self.client.stream_text,
+            use_cache,
+            prompt=prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            prefix=prefix,
+        ):
+            yield chunk
+
+    async def stream_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        use_cache: bool = True,
+    ) -> AsyncIterator[str]:
+        """
+        Stream a TikZ completion, replaying a stored one in a single chunk
+        if there is one.
+        """
+        async for chunk in self._stream(
+            'stream_tikz',
+            self.client.stream_tikz,
+            use_cache,
+            prompt=prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            prefix=prefix,
+        ):
+            yield chunk
+
+    async def stream_plan(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 4000,
+        temperature: float = 0.5,
+        use_cache: bool = True,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Stream a structured plan, replaying a stored one in a single chunk
+        if there is one.
+        """
+        kwargs.update(
+            prompt=prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        async for chunk in self._stream(
+            'stream_plan', self.client.stream_plan, use_cache, **kwargs
+        ):
+            yield chunk
@@ -1,17 +1,27 @@
 import json
+from collections.abc import AsyncIterator
 from typing import Any
 from io import BytesIO
 
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from PIL import Image
 
-from src.models.provider import ModelClient
+from src.clients.rate_limiter import (
+    RateLimiter,
+    Reservation,
+    estimate_tokens,
+    get_rate_limiter,
+    parse_retry_after,
+)
+from src.models.provider import ModelClient, ModelProvider, StreamTimer
 
 
 class GoogleClient(ModelClient):
     """Wrapper class to access Google models."""
 
+    provider = ModelProvider.GOOGLE
+
     def __init__(self, model: str, api_key: str) -> None:
         """
         Initialize the client.
@@ -25,29 +35,151 @@ class GoogleClient(ModelClient):
         """
         self.client = genai.Client(api_key=api_key)
         self.model = model
+        self.prompt_cache_usage = {
+            'input_tokens': 0,
+            'cached_tokens': 0,
+            'cache_write_tokens': 0,
+        }
 
-    async def generate_text(
+    def _record_usage(self, model: str, usage: Any) -> int:
+        """Record the usage of a call, returning the rate-limited tokens."""
+        # implicit caching reuses shared prompt prefixes automatically
+        # thinking tokens are reported apart from the candidates' (and only
+        # by recent SDK versions)
+        thinking_tokens = getattr(usage, 'thoughts_token_count', None) or 0
+        self._record_tokens(
+            model,
+            input_tokens=usage.prompt_token_count or 0,
+            output_tokens=(usage.candidates_token_count or 0)
+            + thinking_tokens,
+            cached_tokens=usage.cached_content_token_count or 0,
+            thinking_tokens=thinking_tokens,
+        )
+        return usage.total_token_count or 0
+
+    @staticmethod
+    def _limiter(model: str) -> RateLimiter:
+        return get_rate_limiter(ModelProvider.GOOGLE, model)
+
+    @staticmethod
+    def _retry_after(error: BaseException) -> float | None:
+        if isinstance(error, errors.ClientError) and error.code == 429:
+            headers = getattr(error.response, 'headers', None)
+            return parse_retry_after(headers)
+        if isinstance(error, errors.ServerError):
+            # transient: plain backoff
+            return 0.0
+        return None
+
+    async def _generate(
+        self,
+        model: str,
+        prompt: str,
+        prefix: str | None,
+        max_tokens: int,
+        temperature: float,
+    ) -> Any:
+        """Generate content, subject to the model's rate limit."""
+
+        async def call(reservation: Reservation) -> Any:
+            response = await self.client.aio.models.generate_content(
+                model=model,
+                contents=[self._with_prefix(prompt, prefix)],
+                config=types.GenerateContentConfig(
+                    max_output_tokens=max_tokens,
+                    temperature=temperature,
+                ),
+            )
+            reservation.used = self._record_usage(
+                model, response.usage_metadata
+            )
+            return response
+
+        return await self._limiter(model).run(
+            call,
+            estimate_tokens(prompt, prefix, max_tokens),
+            self._retry_after,
+        )
+
+    async def _stream(
+        self,
+        model: str,
+        prompt: str,
+        prefix: str | None,
+        max_tokens: int,
+        temperature: float,
+    ) -> AsyncIterator[str]:
+        """Stream generated content, subject to the model's rate limit."""
+
+        async def call(reservation: Reservation) -> AsyncIterator[str]:
+            timer = StreamTimer()
+            stream = await self.client.aio.models.generate_content_stream(
+                model=model,
+                contents=[self._with_prefix(prompt, prefix)],
+                config=types.GenerateContentConfig(
+                    max_output_tokens=max_tokens,
+                    temperature=temperature,
+                ),
+            )
+            usage = None
+            async for chunk in stream:
+                if chunk.text:
+                    timer.chunk()
+                    yield chunk.text
+                # every chunk reports the usage so far
+                usage = chunk.usage_metadata or usage
+            if usage is not None:
+                reservation.used = self._record_usage(model, usage)
+                self._record_stream(
+                    model,
+                    timer,
+                    (usage.candidates_token_count or 0)
+                    + (getattr(usage, 'thoughts_token_count', None) or 0),
+                )
+
+        async for text in self._limiter(model).stream(
+            call,
+            estimate_tokens(prompt, prefix, max_tokens),
+            self._retry_after,
+        ):
+            yield text
+
+    async def stream_text(
         self,
         prompt: str,
         model: str | None = None,
         max_tokens: int = 1024,
         temperature: float = 0.5,
-    ) -> str:
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
         """
-        Generate text.
+        Stream text.
         """
         model = model or self.model
 
-        response = self.client.models.generate_content(
-            model=model,
-            contents=[prompt],
-            config=types.GenerateContentConfig(
-                max_output_tokens=max_tokens,
-                temperature=temperature,
-            ),
-        )
+        async for text in self._stream(
+            model, prompt, prefix, max_tokens, temperature
+        ):
+            yield text
 
-        return response.text
+    async def generate_text(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 1024,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> str:
+        """
+        Generate text.
+        """
+        chunks = [
+            text
+            async for text in self.stream_text(
+                prompt, model, max_tokens, temperature, prefix
+            )
+        ]
+        return ''.join(chunks)
 
     async def generate_image(
         self,
@@ -58,38 +190,95 @@ class GoogleClient(ModelClient):
         """
         Generate an image using Imagen.
         """
-        response = self.client.models.generate_images(
-            model=model,
-            prompt=prompt,
-            config=types.GenerateImagesConfig(
-                number_of_images=1,
-            ),
-        )
+
+        async def call(reservation: Reservation) -> Any:
+            # images are limited per request only
+            reservation.used = 0
+            return await self.client.aio.models.generate_images(
+                model=model,
+                prompt=prompt,
+                config=types.GenerateImagesConfig(
+                    number_of_images=1,
+                ),
+            )
+
+        response = await self._limiter(model).run(call, 0, self._retry_after)
+        self._record_images(model, len(response.generated_images))
 
         image = Image.open(
             BytesIO(response.generated_images[0].image.image_bytes)
         )
         return image
 
+    async def stream_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream TikZ completion from Gemini.
+        """
+        model = model or self.model
+
+        async for text in self._stream(
+            model, prompt, prefix, max_tokens, temperature
+        ):
+            yield text
+
+    async def generate_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> str:
+        """
+        Generate TikZ code with Gemini.
+        """
+        chunks = [
+            text
+            async for text in self.stream_tikz(
+                prompt, model, max_tokens, temperature, prefix
+            )
+        ]
+        return self._extract_tikz(''.join(chunks))
+
     async def generate_plan(
         self,
         prompt: str,
         model: str | None = None,
         max_tokens: int = 4000,
         temperature: float = 0.5,
+        prefix: str | None = None,
     ) -> dict[str, Any]:
         """
         Generate structured plan with Gemini.
         """
         model = model or self.model
 
-        response = self.client.models.generate_content(
-            model=model,
-            contents=[prompt],
-            config=types.GenerateContentConfig(
-                max_output_tokens=max_tokens,
-                temperature=temperature,
-            ),
+        response = await self._generate(
+            model, prompt, prefix, max_tokens, temperature
         )
-
         return json.loads(response.text)
+
+    async def stream_plan(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 4000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream structured plan text from Gemini.
+        """
+        model = model or self.model
+
+        async for text in self._stream(
+            model, prompt, prefix, max_tokens, temperature
+        ):
+            yield text
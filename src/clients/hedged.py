@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+from src.clients.rate_limiter import estimate_tokens
+from src.models.provider import ModelClient
+from src.models.settings import HedgingSettings
+from src.models.usage import record_usage
+from src.utils.tracing import add_counts
+
+log = logging.getLogger(__name__)
+
+
+class HedgedModelClient(ModelClient):
+    """
+    Client wrapper hedging slow text and TikZ requests.
+
+    If a call hasn't finished by a percentile of the recently observed
+    latencies, a duplicate request is sent and whichever finishes first is
+    used; the other one is cancelled (its prompt is still counted in the
+    usage, since the provider bills it). At most `max_hedge_ratio` of the calls
+    are hedged. Image, plan and streamed requests are passed through
+    unchanged.
+    """
+
+    def __init__(
+        self, client: ModelClient, settings: HedgingSettings | None = None
+    ) -> None:
+        """
+        Initialize the wrapper.
+
+        Parameters
+        ----------
+        client : ModelClient
+            The client to wrap
+        settings : HedgingSettings | None, optional
+            Hedging policy, by default `HedgingSettings()`
+        """
+        self.client = client
+        self.provider = client.provider
+        self.settings = settings or HedgingSettings()
+        self.model = client.model
+        self.prompt_cache_usage = client.prompt_cache_usage
+        self.latencies = {
+            'text': deque(maxlen=self.settings.window),
+            'tikz': deque(maxlen=self.settings.window),
+        }
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedge_losses = 0
+
+    def hedge_delay(self, kind: str) -> float | None:
+        """
+        Delay after which a call of `kind` ('text' or 'tikz') is hedged.
+
+        Returns None while fewer than `min_samples` latencies have been
+        observed.
+        """
+        latencies = self.latencies[kind]
+        if len(latencies) < self.settings.min_samples:
+            return None
+        ordered = sorted(latencies)
+        index = int(len(ordered) * self.settings.percentile / 100)
+        return ordered[min(index, len(ordered) - 1)]
+
+    def _may_hedge(self) -> bool:
+        return self.hedges + 1 <= self.settings.max_hedge_ratio * self.calls
+
+    def _record_loser(
+        self, model: str | None, prompt: str, prefix: str | None
+    ) -> None:
+        """Count a request cancelled because the other one finished first."""
+        self.hedge_losses += 1
+        add_counts(hedge_losses=1)
+        # the wrapped client never sees its usage, estimate the prompt
+        record_usage(
+            model or self.model,
+            input_tokens=estimate_tokens(prompt, prefix, 0),
+        )
+
+    async def _hedged(
+        self,
+        kind: str,
+        call: Callable[[], Awaitable[str]],
+        model: str | None,
+        prompt: str,
+        prefix: str | None,
+    ) -> str:
+        """Run `call`, hedging it once if it is slow."""
+        self.calls += 1
+        delay = self.hedge_delay(kind)
+        starts = {}
+
+        def launch() -> asyncio.Task:
+            task = asyncio.create_task(call())
+            starts[task] = time.monotonic()
+            return task
+
+        primary = launch()
+        pending = {primary}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self._may_hedge():
+                    self.hedges += 1
+                    add_counts(hedges=1)
+                    log.info('Hedging %s request after %.2fs', kind, delay)
+                    pending.add(launch())
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        # the other request may still succeed
+                        error = task.exception()
+                        continue
+                    # as seen by the caller, including the hedge delay
+                    self.latencies[kind].append(
+                        time.monotonic() - starts[primary]
+                    )
+                    if task is not primary:
+                        self.hedge_wins += 1
+                    for _ in pending:
+                        self._record_loser(model, prompt, prefix)
+                    return task.result()
+            raise error
+        finally:
+            for task in starts:
+                task.cancel()
+
+    async def generate_text(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Generate text, hedging the request if it is slow.
+        """
+        return await self._hedged(
+            'text',
+            lambda: self.client.generate_text(
+                prompt=prompt,
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                prefix=prefix,
+                **kwargs,
+            ),
+            model,
+            prompt,
+            prefix,
+        )
+
+    async def generate_image(
+        self,
+        prompt: str,
+        model: str | None = None,
+        size: str = '1024x1024',
+        quality: str = 'standard',
+        **kwargs: Any,
+    ) -> str:
+        return await self.client.generate_image(
+            prompt=prompt, model=model, size=size, quality=quality, **kwargs
+        )
+
+    async def generate_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Generate TikZ code, hedging the request if it is slow.
+        """
+        return await self._hedged(
+            'tikz',
+            lambda: self.client.generate_tikz(
+                prompt=prompt,
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                prefix=prefix,
+                **kwargs,
+            ),
+            model,
+            prompt,
+            prefix,
+        )
+
+    async def generate_plan(
+        self, prompt: str, **kwargs: Any
+    ) -> dict[str, Any]:
+        return await self.client.generate_plan(prompt=prompt, **kwargs)
+
+    async def stream_text(
+        self, prompt: str, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        """
+        Stream text without hedging (a duplicate request would arrive after
+        the chunks already yielded).
+        """
+        async for chunk in self.client.stream_text(prompt=prompt, **kwargs):
+            yield chunk
+
+    async def stream_tikz(
+        self, prompt: str, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        """
+        Stream a TikZ completion without hedging.
+        """
+        async for chunk in self.client.stream_tikz(prompt=prompt, **kwargs):
+            yield chunk
+
+    async def stream_plan(
+        self, prompt: str, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        async for chunk in self.client.stream_plan(prompt=prompt, **kwargs):
+            yield chunk
+
+    @property
+    def stats(self) -> dict[str, float]:
+        """Call, hedge, hedge-win and hedge-loss counters of the wrapper."""
+        return {
+            'calls': self.calls,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'hedge_losses': self.hedge_losses,
+            'hedge_ratio': self.hedges / self.calls if self.calls else 0.0,
+        }
@@ -0,0 +1,471 @@
+import asyncio
+import itertools
+import json
+import math
+import random
+from collections import Counter
+from collections.abc import AsyncIterator
+from pathlib import Path
+from typing import Any
+
+from pydantic import BaseModel
+
+from src.clients.rate_limiter import (
+    RateLimiter,
+    Reservation,
+    get_rate_limiter,
+)
+from src.models.provider import ModelClient, ModelProvider, StreamTimer
+
+# Share of a streamed call's latency spent before its first chunk
+first_chunk_share = 0.25
+
+# Images returned by `generate_image`
+example_images_dir = Path(__file__).resolve().parents[2] / 'example-images'
+
+default_plan = {
+    'subtasks': [
+        {
+            'type': 'text',
+            'description': 'Introduction',
+            'prompt': 'Introduce the topic.',
+            'order': 1,
+        },
+        {
+            'type': 'image',
+            'description': 'Illustration of the topic',
+            'prompt': 'An illustration of the topic.',
+            'alt_text': 'Illustration',
+            'caption': 'Figure 1: Illustration',
+            'order': 2,
+        },
+        {
+            'type': 'text',
+            'description': 'Explanation',
+            'prompt': 'Explain the topic in detail.',
+            'order': 3,
+        },
+        {
+            'type': 'tikz',
+            'description': 'Diagram of the topic',
+            'prompt': 'A diagram of the topic.',
+            'alt_text': 'Diagram',
+            'caption': 'Figure 2: Diagram',
+            'order': 4,
+        },
+        {
+            'type': 'text',
+            'description': 'Conclusion',
+            'prompt': 'Conclude.',
+            'order': 5,
+        },
+    ]
+}
+
+default_text = (
+    'This is a mock response. Lorem ipsum dolor sit amet, consectetur'
+    ' adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore'
+    ' magna aliqua.'
+)
+
+default_tikz = (
+    '\\begin{tikzpicture}\n'
+    '\\draw[thick, ->] (0,0) -- (2,0) node[right] {$x$};\n'
+    '\\draw[thick, ->] (0,0) -- (0,2) node[above] {$y$};\n'
+    '\\draw[blue] (0,0) circle (1);\n'
+    '\\end{tikzpicture}'
+)
+
+
+class MockLatency(BaseModel):
+    """
+    Latency distribution of a mock call.
+
+    The latency is `median` seconds, or lognormally distributed around it if
+    `sigma` is set. With probability `tail_probability`, it is multiplied by
+    `tail_multiplier` to simulate a slow tail.
+    """
+
+    median: float = 0.0
+    sigma: float = 0.0
+    tail_probability: float = 0.0
+    tail_multiplier: float = 10.0
+
+    def sample(self, rng: random.Random) -> float:
+        latency = self.median
+        if self.sigma > 0 and self.median > 0:
+            latency = rng.lognormvariate(math.log(self.median), self.sigma)
+        if rng.random() < self.tail_probability:
+            latency *= self.tail_multiplier
+        return latency
+
+
+class MockError(Exception):
+    """Injected failure of a mock call."""
+
+
+class MockRateLimitError(MockError):
+    """Injected rate-limit (429) failure of a mock call."""
+
+    status_code = 429
+
+    def __init__(self, retry_after: float = 0.0) -> None:
+        super().__init__(f'429 Too Many Requests (retry after {retry_after}s)')
+        self.retry_after = retry_after
+
+
+class MockClient(ModelClient):
+    """
+    Offline client returning canned responses after a programmable delay.
+
+    Useful to exercise the pipeline and benchmark it without API keys. Each
+    method's latency can be fixed or drawn from a distribution, errors and
+    rate-limit errors can be injected, and the calls are counted (including
+    how many ran at the same time).
+    """
+
+    provider = ModelProvider.MOCK
+
+    def __init__(
+        self,
+        model: str = 'mock',
+        api_key: str | None = None,
+        latency: dict[str, MockLatency | float] | MockLatency | float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.0,
+        plan: dict[str, Any] | None = None,
+        text: str = default_text,
+        tikz_code: str = default_tikz,
+        seed: int | None = None,
+    ) -> None:
+        """
+        Initialize the client.
+
+        Parameters
+        ----------
+        model : str, optional
+            Model name (the rate limiter is shared per name), by default
+            'mock'
+        api_key : str | None, optional
+            Ignored, by default None
+        latency : dict[str, MockLatency | float] | MockLatency | float
+            Latency of every call, or by method name ('text', 'image',
+            'tikz', 'plan'), in seconds or as a distribution, by default 0
+        error_rate : float, optional
+            Probability of a call failing with `MockError`, by default 0
+        rate_limit_rate : float, optional
+            Probability of a call failing with `MockRateLimitError`, by
+            default 0
+        retry_after : float, optional
+            Delay requested by the injected rate-limit errors, by default 0
+        plan : dict[str, Any] | None, optional
+            Plan returned by `generate_plan`, by default a five-element plan
+            with text, an image and a TikZ diagram
+        text : str, optional
+            Text returned by `generate_text`, by default a lorem ipsum
+        tikz_code : str, optional
+            Code returned by `generate_tikz`, by default a small diagram
+        seed : int | None, optional
+            Seed for the latencies and injected failures, by default None
+        """
+        self.model = model
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.plan = plan or default_plan
+        self.text = text
+        self.tikz_code = tikz_code
+        self.prompt_cache_usage = {
+            'input_tokens': 0,
+            'cached_tokens': 0,
+            'cache_write_tokens': 0,
+        }
+        self._rng = random.Random(seed)
+        self._images = itertools.cycle(
+            sorted(str(path) for path in example_images_dir.glob('*.png'))
+        )
+        self.reset()
+
+    def reset(self) -> None:
+        """Reset the call counters."""
+        self.calls = Counter()
+        self.errors = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.method_in_flight = Counter()
+        self.method_max_in_flight = Counter()
+
+    def _latency(self, method: str) -> float:
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(method, 0.0)
+        if isinstance(latency, MockLatency):
+            return latency.sample(self._rng)
+        return latency
+
+    @staticmethod
+    def _limiter(model: str) -> RateLimiter:
+        return get_rate_limiter(ModelProvider.MOCK, model)
+
+    @staticmethod
+    def _retry_after(error: BaseException) -> float | None:
+        if isinstance(error, MockRateLimitError):
+            return error.retry_after
+        return None
+
+    async def _call(
+        self,
+        method: str,
+        model: str,
+        reservation: Reservation,
+        input_tokens: int,
+        result: str,
+        output_tokens: int | None = None,
+        latency: float | None = None,
+    ) -> str:
+        """
+        Simulate one call of `method` returning `result`, after `latency`
+        seconds (by default drawn for the method).
+        """
+        self.calls[method] += 1
+        self.in_flight += 1
+        self.method_in_flight[method] += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.method_max_in_flight[method] = max(
+            self.method_max_in_flight[method], self.method_in_flight[method]
+        )
+        try:
+            if latency is None:
+                latency = self._latency(method)
+            await asyncio.sleep(latency)
+            draw = self._rng.random()
+            if draw < self.rate_limit_rate:
+                self.errors['rate_limit'] += 1
+                raise MockRateLimitError(self.retry_after)
+            if draw < self.rate_limit_rate + self.error_rate:
+                self.errors['error'] += 1
+                raise MockError(f'Injected {method} failure')
+        finally:
+            self.in_flight -= 1
+            self.method_in_flight[method] -= 1
+
+        reservation.used = reservation.tokens
+        if method == 'image':
+            self._record_images(model)
+        else:
+            # about four characters per token
+            if output_tokens is None:
+                output_tokens = len(result) // 4
+            self._record_tokens(model, input_tokens, output_tokens)
+        return result
+
+    async def _run(
+        self,
+        method: str,
+        model: str | None,
+        prompt: str,
+        prefix: str | None,
+        max_tokens: int,
+        result: str,
+    ) -> str:
+        model = model or self.model
+        input_tokens = (len(prompt) + len(prefix or '')) // 4
+        return await self._limiter(model).run(
+            lambda reservation: self._call(
+                method, model, reservation, input_tokens, result
+            ),
+            input_tokens + max_tokens,
+            self._retry_after,
+        )
+
+    async def generate_text(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> str:
+        """
+        Return the canned text.
+        """
+        return await self._run(
+            'text', model, prompt, prefix, max_tokens, self.text
+        )
+
+    async def generate_image(
+        self,
+        prompt: str,
+        model: str | None = None,
+        size: str = '1024x1024',
+        quality: str = 'standard',
+    ) -> str:
+        """
+        Return the path of one of the example images.
+        """
+        return await self._run(
+            'image', model, prompt, None, 0, next(self._images)
+        )
+
+    async def generate_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> str:
+        """
+        Return the canned TikZ code.
+        """
+        tikz_code = await self._run(
+            'tikz', model, prompt, prefix, max_tokens, self.tikz_code
+        )
+        return self._extract_tikz(tikz_code)
+
+    async def generate_plan(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 4000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        **kwargs: Any,
+    ) -> dict[str, Any]:
+        """
+        Return the canned plan.
+        """
+        plan = await self._run(
+            'plan', model, prompt, prefix, max_tokens, json.dumps(self.plan)
+        )
+        return json.loads(plan)
+
+    async def _stream(
+        self,
+        method: str,
+        model: str | None,
+        prompt: str,
+        prefix: str | None,
+        max_tokens: int,
+        result: str,
+        chunk_size: int,
+    ) -> AsyncIterator[str]:
+        """
+        Simulate a streamed call of `method`: `first_chunk_share` of its
+        latency passes before the first chunk, and the rest is spread over
+        the other chunks.
+        """
+        # an empty result is still streamed as one (empty) chunk
+        chunks = [
+            result[i : i + chunk_size]
+            for i in range(0, len(result), chunk_size)
+        ] or ['']
+        model = model or self.model
+        input_tokens = (len(prompt) + len(prefix or '')) // 4
+
+        async def call(reservation: Reservation) -> AsyncIterator[str]:
+            timer = StreamTimer()
+            latency = self._latency(method)
+            if len(chunks) > 1:
+                first_latency = latency * first_chunk_share
+                delay = (latency - first_latency) / (len(chunks) - 1)
+            else:
+                first_latency = latency
+            # the first chunk fails like a whole call would (the usage of
+            # the whole result is recorded with it)
+            yield await self._call(
+                method,
+                model,
+                reservation,
+                input_tokens,
+                chunks[0],
+                output_tokens=len(result) // 4,
+                latency=first_latency,
+            )
+            timer.chunk()
+            for chunk in chunks[1:]:
+                await asyncio.sleep(delay)
+                yield chunk
+            self._record_stream(model, timer, len(result) // 4)
+
+        async for chunk in self._limiter(model).stream(
+            call, input_tokens + max_tokens, self._retry_after
+        ):
+            yield chunk
+
+    async def stream_text(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        chunk_size: int = 16,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the canned text, spreading the text latency over the chunks.
+        """
+        async for chunk in self._stream(
+            'text', model, prompt, prefix, max_tokens, self.text, chunk_size
+        ):
+            yield chunk
+
+    async def stream_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        chunk_size: int = 16,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the canned TikZ code, spreading the TikZ latency over the
+        chunks.
+        """
+        async for chunk in self._stream(
+            'tikz',
+            model,
+            prompt,
+            prefix,
+            max_tokens,
+            self.tikz_code,
+            chunk_size,
+        ):
+            yield chunk
+
+    async def stream_plan(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 4000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+        chunk_size: int = 64,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the canned plan, spreading the plan latency over the chunks.
+        """
+        async for chunk in self._stream(
+            'plan',
+            model,
+            prompt,
+            prefix,
+            max_tokens,
+            json.dumps(self.plan),
+            chunk_size,
+        ):
+            yield chunk
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """Call, error and concurrency counters of the client."""
+        return {
+            'calls': dict(self.calls),
+            'errors': dict(self.errors),
+            'max_in_flight': self.max_in_flight,
+            'method_max_in_flight': dict(self.method_max_in_flight),
+        }
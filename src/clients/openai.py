@@ -1,14 +1,24 @@
 import json
+from collections.abc import AsyncIterator
 from typing import Any
 
 import openai
 
-from src.models.provider import ModelClient
+from src.clients.rate_limiter import (
+    RateLimiter,
+    Reservation,
+    estimate_tokens,
+    get_rate_limiter,
+    parse_retry_after,
+)
+from src.models.provider import ModelClient, ModelProvider, StreamTimer
 
 
 class OpenAIClient(ModelClient):
     """Wrapper class to access OpenAI models."""
 
+    provider = ModelProvider.OPENAI
+
     def __init__(self, model: str, api_key: str) -> None:
         """
         Initialize the OpenAI client.
@@ -20,29 +30,164 @@ class OpenAIClient(ModelClient):
         api_key : str
             OpenAI API key
         """
-        self.client = openai.OpenAI(api_key=api_key)
+        # retries are left to the shared rate limiter
+        self.client = openai.AsyncOpenAI(api_key=api_key, max_retries=0)
         self.model = model
+        self.prompt_cache_usage = {
+            'input_tokens': 0,
+            'cached_tokens': 0,
+            'cache_write_tokens': 0,
+        }
 
-    async def generate_text(
+    def _record_usage(self, model: str, usage: Any) -> int:
+        """Record the usage of a call, returning the rate-limited tokens."""
+        # prompts sharing a prefix of 1024+ tokens are cached automatically
+        details = usage.prompt_tokens_details
+        completion_details = usage.completion_tokens_details
+        self._record_tokens(
+            model,
+            input_tokens=usage.prompt_tokens,
+            output_tokens=usage.completion_tokens,
+            cached_tokens=(details.cached_tokens or 0) if details else 0,
+            thinking_tokens=(
+                (completion_details.reasoning_tokens or 0)
+                if completion_details
+                else 0
+            ),
+        )
+        return usage.total_tokens
+
+    @staticmethod
+    def _limiter(model: str) -> RateLimiter:
+        return get_rate_limiter(ModelProvider.OPENAI, model)
+
+    @staticmethod
+    def _retry_after(error: BaseException) -> float | None:
+        if isinstance(error, openai.RateLimitError):
+            if error.code == 'insufficient_quota':
+                # billing, not throughput: retrying won't help
+                return None
+            return parse_retry_after(error.response.headers)
+        if isinstance(
+            error, (openai.APIConnectionError, openai.InternalServerError)
+        ):
+            # transient: plain backoff
+            return 0.0
+        return None
+
+    async def _create(
+        self,
+        model: str,
+        prompt: str,
+        prefix: str | None,
+        max_tokens: int,
+        **kwargs: Any,
+    ) -> Any:
+        """Create a chat completion, subject to the model's rate limit."""
+
+        async def call(reservation: Reservation) -> Any:
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        'role': 'user',
+                        'content': self._with_prefix(prompt, prefix),
+                    }
+                ],
+                max_tokens=max_tokens,
+                **kwargs,
+            )
+            reservation.used = self._record_usage(model, response.usage)
+            return response
+
+        return await self._limiter(model).run(
+            call,
+            estimate_tokens(prompt, prefix, max_tokens),
+            self._retry_after,
+        )
+
+    async def _stream(
+        self,
+        model: str,
+        prompt: str,
+        prefix: str | None,
+        max_tokens: int,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the text of a chat completion, subject to the model's rate
+        limit.
+        """
+
+        async def call(reservation: Reservation) -> AsyncIterator[str]:
+            timer = StreamTimer()
+            stream = await self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        'role': 'user',
+                        'content': self._with_prefix(prompt, prefix),
+                    }
+                ],
+                max_tokens=max_tokens,
+                stream=True,
+                # the final chunk carries the usage, with no choices
+                stream_options={'include_usage': True},
+                **kwargs,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    timer.chunk()
+                    yield chunk.choices[0].delta.content
+                if chunk.usage is not None:
+                    reservation.used = self._record_usage(model, chunk.usage)
+                    self._record_stream(
+                        model, timer, chunk.usage.completion_tokens
+                    )
+
+        async for text in self._limiter(model).stream(
+            call,
+            estimate_tokens(prompt, prefix, max_tokens),
+            self._retry_after,
+        ):
+            yield text
+
+    async def stream_text(
         self,
         prompt: str,
         model: str | None = None,
         max_tokens: int = 2000,
         temperature: float = 0.5,
-    ) -> str:
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
         """
-        Generate text using OpenAI model.
+        Stream text from OpenAI model.
         """
         model = model or self.model
 
-        response = self.client.chat.completions.create(
-            model=model,
-            messages=[{'role': 'user', 'content': prompt}],
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
+        async for text in self._stream(
+            model, prompt, prefix, max_tokens, temperature=temperature
+        ):
+            yield text
 
-        return response.choices[0].message.content.strip()
+    async def generate_text(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> str:
+        """
+        Generate text using OpenAI model.
+        """
+        chunks = [
+            text
+            async for text in self.stream_text(
+                prompt, model, max_tokens, temperature, prefix
+            )
+        ]
+        return ''.join(chunks).strip()
 
     async def generate_image(
         self,
@@ -56,33 +201,91 @@ class OpenAIClient(ModelClient):
         """
         model = model or self.model
 
-        response = self.client.images.generate(
-            model=model,
-            prompt=prompt,
-            size=size,
-            quality=quality,
-            n=1,
-        )
+        async def call(reservation: Reservation) -> Any:
+            # images are limited per request only
+            reservation.used = 0
+            return await self.client.images.generate(
+                model=model,
+                prompt=prompt,
+                size=size,
+                quality=quality,
+                n=1,
+            )
+
+        response = await self._limiter(model).run(call, 0, self._retry_after)
+        self._record_images(model, len(response.data))
 
         return response.data[0].url
 
+    async def stream_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream TikZ completion from OpenAI model.
+        """
+        model = model or self.model
+
+        async for text in self._stream(
+            model, prompt, prefix, max_tokens, temperature=temperature
+        ):
+            yield text
+
+    async def generate_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> str:
+        """
+        Generate TikZ code using OpenAI model.
+        """
+        chunks = [
+            text
+            async for text in self.stream_tikz(
+                prompt, model, max_tokens, temperature, prefix
+            )
+        ]
+        return self._extract_tikz(''.join(chunks))
+
     async def generate_plan(
         self,
         prompt: str,
         model: str | None = None,
         max_tokens: int = 4000,
         temperature: float = 0.5,
+        prefix: str | None = None,
     ) -> dict[str, Any]:
         """
         Generate structured plan with OpenAI.
         """
         model = model or self.model
 
-        response = self.client.chat.completions.create(
-            model=model,
-            messages=[{'role': 'user', 'content': prompt}],
-            max_tokens=max_tokens,
-            temperature=temperature,
+        response = await self._create(
+            model, prompt, prefix, max_tokens, temperature=temperature
         )
-
         return json.loads(response.choices[0].message.content)
+
+    async def stream_plan(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 4000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream structured plan text from OpenAI.
+        """
+        model = model or self.model
+
+        async for text in self._stream(
+            model, prompt, prefix, max_tokens, temperature=temperature
+        ):
+            yield text
@@ -0,0 +1,374 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Mapping
+from typing import TypeVar
+
+from src.models.settings import RateLimitSettings
+from src.utils.tracing import add_counts
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Classifies an exception: None if it is not a rate-limit error, otherwise
+# the delay requested by the provider in seconds (0 if it gave none)
+type RetryAfter = Callable[[BaseException], float | None]
+
+
+def _rejected(error: BaseException) -> bool:
+    """
+    Whether the provider turned a call away with a 429 before processing
+    it, unlike server and connection errors, which may have consumed tokens.
+    """
+    # the SDKs' status errors, and the Gemini SDK's API errors
+    status = getattr(error, 'status_code', None) or getattr(
+        error, 'code', None
+    )
+    return status == 429
+
+
+class _Bucket:
+    """Token bucket refilled continuously at `per_minute` per minute."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(
+            self.capacity, self.level + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (after a refill)."""
+        # a request larger than the bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        # may go negative: overdrawn tokens are paid back before the next
+        # request is admitted
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    """
+    Budget reserved for one call.
+
+    The call sets `used` to the actual number of tokens reported by the
+    provider, and the difference is returned to (or taken from) the bucket.
+    """
+
+    def __init__(self, tokens: int) -> None:
+        self.tokens = tokens
+        self.used: int | None = None
+
+
+class RateLimiter:
+    """
+    Client-side rate limiter for one provider and model.
+
+    Calls are admitted in FIFO order once both the requests-per-minute and
+    the tokens-per-minute buckets allow them. A call reserves its estimated
+    tokens up front and is reconciled with the provider's reported usage
+    afterwards. Rate-limit errors are retried with jittered exponential
+    backoff (or after the provider's Retry-After delay), and pause every
+    caller of the limiter until the backoff has passed.
+    """
+
+    def __init__(self, settings: RateLimitSettings | None = None) -> None:
+        """
+        Initialize the limiter.
+
+        Parameters
+        ----------
+        settings : RateLimitSettings | None, optional
+            Limits and retry policy, by default no limits (only retries)
+        """
+        self.settings = settings or RateLimitSettings()
+        self._requests = (
+            _Bucket(self.settings.requests_per_minute)
+            if self.settings.requests_per_minute
+            else None
+        )
+        self._tokens = (
+            _Bucket(self.settings.tokens_per_minute)
+            if self.settings.tokens_per_minute
+            else None
+        )
+        self._lock = asyncio.Lock()
+        self._blocked_until = 0.0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.requests = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _delay(self, tokens: int) -> float:
+        now = time.monotonic()
+        delay = self._blocked_until - now
+        for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                delay = max(delay, bucket.delay(amount))
+        return delay
+
+    async def acquire(self, tokens: int) -> Reservation:
+        """
+        Wait until a call estimated at `tokens` tokens may be made.
+
+        Parameters
+        ----------
+        tokens : int
+            Estimated prompt and completion tokens of the call
+
+        Returns
+        -------
+        Reservation
+            The reserved budget, to be passed to `release`
+        """
+        start = time.monotonic()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            async with self._lock:
+                while (delay := self._delay(tokens)) > 0:
+                    await asyncio.sleep(delay)
+                if self._requests is not None:
+                    self._requests.adjust(-1)
+                if self._tokens is not None:
+                    self._tokens.adjust(-tokens)
+        finally:
+            self.queue_depth -= 1
+
+        wait = time.monotonic() - start
+        self.requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait >= 0.001:
+            add_counts(rate_limit_wait=wait)
+        return Reservation(tokens)
+
+    def release(
+        self, reservation: Reservation, rejected: bool = False
+    ) -> None:
+        """
+        Reconcile a reservation with the tokens the call actually used.
+
+        Parameters
+        ----------
+        reservation : Reservation
+            The reservation from `acquire`
+        rejected : bool, optional
+            Whether the provider rejected the call (with a 429) without
+            processing it, in which case all reserved tokens are returned,
+            by default False
+        """
+        if self._tokens is None:
+            return
+        if rejected:
+            self._tokens.adjust(reservation.tokens)
+        elif reservation.used is not None:
+            self._tokens.adjust(reservation.tokens - reservation.used)
+
+    async def _backoff(self, attempt: int, retry_after: float) -> None:
+        settings = self.settings
+        if retry_after > 0:
+            delay = retry_after + random.uniform(0, settings.base_delay)
+        else:
+            # full jitter
+            delay = random.uniform(
+                0, min(settings.max_delay, settings.base_delay * 2**attempt)
+            )
+        self.retries += 1
+        add_counts(retries=1)
+        self._blocked_until = max(
+            self._blocked_until, time.monotonic() + delay
+        )
+        log.info('Rate limited, retrying in %.1fs', delay)
+        await asyncio.sleep(delay)
+
+    async def run(
+        self,
+        call: Callable[[Reservation], Awaitable[T]],
+        tokens: int,
+        retry_after: RetryAfter,
+    ) -> T:
+        """
+        Make a rate-limited call, retrying it when rate limited.
+
+        Parameters
+        ----------
+        call : Callable[[Reservation], Awaitable[T]]
+            Makes the request, setting `Reservation.used` from the reported
+            usage
+        tokens : int
+            Estimated prompt and completion tokens of the call
+        retry_after : RetryAfter
+            Recognizes the provider's rate-limit errors
+
+        Returns
+        -------
+        T
+            The result of `call`
+        """
+        for attempt in range(self.settings.max_retries + 1):
+            reservation = await self.acquire(tokens)
+            try:
+                result = await call(reservation)
+            except Exception as e:
+                delay = retry_after(e)
+                self.release(reservation, rejected=_rejected(e))
+                if delay is None or attempt == self.settings.max_retries:
+                    raise
+                await self._backoff(attempt, delay)
+            else:
+                self.release(reservation)
+                return result
+
+    async def stream(
+        self,
+        call: Callable[[Reservation], AsyncIterator[T]],
+        tokens: int,
+        retry_after: RetryAfter,
+    ) -> AsyncIterator[T]:
+        """
+        Make a rate-limited streaming call.
+
+        Like `run`, but a rate-limit error is only retried if no chunk has
+        been yielded yet.
+        """
+        for attempt in range(self.settings.max_retries + 1):
+            reservation = await self.acquire(tokens)
+            started = False
+            try:
+                async for chunk in call(reservation):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                delay = retry_after(e)
+                # once output was streamed, the tokens were consumed
+                self.release(
+                    reservation, rejected=not started and _rejected(e)
+                )
+                if (
+                    started
+                    or delay is None
+                    or attempt == self.settings.max_retries
+                ):
+                    raise
+                await self._backoff(attempt, delay)
+            else:
+                self.release(reservation)
+                return
+
+    @property
+    def stats(self) -> dict[str, float]:
+        """Queueing, waiting and retry counters of the limiter."""
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'total_wait': self.total_wait,
+            'mean_wait': self.total_wait / self.requests
+            if self.requests
+            else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+# Limiters shared by all clients, by provider and model
+_limiters: dict[tuple[str, str], RateLimiter] = {}
+
+
+def set_rate_limit(
+    provider: str, model: str, settings: RateLimitSettings
+) -> RateLimiter:
+    """
+    Configure the limits of a provider's model.
+
+    Parameters
+    ----------
+    provider : str
+        The provider
+    model : str
+        The model (provider-specific)
+    settings : RateLimitSettings
+        Limits and retry policy
+
+    Returns
+    -------
+    RateLimiter
+        The limiter now shared by all clients of the model
+    """
+    limiter = RateLimiter(settings)
+    _limiters[(provider, model)] = limiter
+    return limiter
+
+
+def get_rate_limiter(provider: str, model: str) -> RateLimiter:
+    """Get the shared limiter of a model (unlimited if not configured)."""
+    if (provider, model) not in _limiters:
+        _limiters[(provider, model)] = RateLimiter()
+    return _limiters[(provider, model)]
+
+
+def rate_limit_stats() -> dict[str, dict[str, float]]:
+    """Stats of every limiter, by `<provider>/<model>`."""
+    return {
+        f'{provider}/{model}': limiter.stats
+        for (provider, model), limiter in _limiters.items()
+    }
+
+
+def estimate_tokens(prompt: str, prefix: str | None, max_tokens: int) -> int:
+    """
+    Estimate the tokens a call counts against the limit before it is made.
+
+    Uses about four characters per prompt token, plus the full completion
+    budget (which is what providers reserve as well).
+    """
+    return (len(prompt) + len(prefix or '')) // 4 + max_tokens
+
+
+def parse_retry_after(headers: Mapping[str, str] | None) -> float:
+    """
+    Read the delay requested by a rate-limit response.
+
+    Parameters
+    ----------
+    headers : Mapping[str, str] | None
+        Response headers
+
+    Returns
+    -------
+    float
+        Seconds to wait, or 0 if the response does not say
+    """
+    if not headers:
+        return 0.0
+    if (value := headers.get('retry-after-ms')) is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    if (value := headers.get('retry-after')) is not None:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            # HTTP date
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return 0.0
+        return max(0.0, date.timestamp() - time.time())
+    return 0.0
@@ -1,19 +1,51 @@
+import json
+import logging
+import time
 from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator
 from enum import StrEnum
-from typing import Any
+from typing import TYPE_CHECKING, Any
+
+from src.models.usage import record_usage
+from src.utils.tracing import add_counts, set_attributes
+
+if TYPE_CHECKING:
+    from src.clients.cached import CompletionCache
+    from src.models.settings import HedgingSettings
+    from src.utils.image_cache import ImageCache
+    from src.utils.image_downloader import ImageDownloader
 
 # from pydantic import BaseModel
 
+log = logging.getLogger(__name__)
+
 
 class ModelProvider(StrEnum):
     OPENAI = 'openai'
     ANTHROPIC = 'anthropic'
     GOOGLE = 'google'
+    MOCK = 'mock'
+
+
+class StreamTimer:
+    """Times a streamed call, from the request to the first and last chunk."""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.first_chunk: float | None = None
+
+    def chunk(self) -> None:
+        """Note the arrival of a chunk."""
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter()
 
 
 class ModelClient(ABC):
     """Base class for model client calls."""
 
+    # provider the calls are sent to
+    provider: ModelProvider
+
     @abstractmethod
     async def generate_text(
         self,
@@ -21,6 +53,7 @@ class ModelClient(ABC):
         model: str | None = None,
         max_tokens: int = 2000,
         temperature: float = 0.5,
+        prefix: str | None = None,
     ) -> str:
         """
         Generate text from a prompt.
@@ -35,6 +68,9 @@ class ModelClient(ABC):
             Maximum number of tokens to generate, by default 2000
         temperature : float, optional
             Sampling temperature, by default 0.5
+        prefix : str | None, optional
+            Static start of the prompt, sent ahead of `prompt` and marked
+            for provider-side prompt caching, by default None
 
         Returns
         -------
@@ -79,6 +115,7 @@ class ModelClient(ABC):
         model: str | None = None,
         max_tokens: int = 2000,
         temperature: float = 0.5,
+        prefix: str | None = None,
     ) -> str:
         """
         Generate TikZ code from a prompt.
@@ -93,6 +130,9 @@ class ModelClient(ABC):
             Maximum number of tokens to generate, by default 2000
         temperature : float, optional
             Sampling temperature, by default 0.5
+        prefix : str | None, optional
+            Static start of the prompt, sent ahead of `prompt` and marked
+            for provider-side prompt caching, by default None
 
         Returns
         -------
@@ -108,6 +148,7 @@ class ModelClient(ABC):
         model: str | None = None,
         max_tokens: int = 4000,
         temperature: float = 0.5,
+        prefix: str | None = None,
     ) -> dict[str, Any]:
         """
         Generate structured plan.
@@ -122,6 +163,9 @@ class ModelClient(ABC):
             Maximum number of tokens to generate, by default 2000
         temperature : float, optional
             Sampling temperature, by default 0.5
+        prefix : str | None, optional
+            Static start of the prompt, sent ahead of `prompt` and marked
+            for provider-side prompt caching, by default None
 
         Returns
         -------
@@ -130,12 +174,282 @@ class ModelClient(ABC):
         """
         pass
 
+    async def stream_plan(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 4000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the text of a structured plan as it is generated.
+
+        Clients without a streaming endpoint fall back to yielding the
+        complete plan from `generate_plan` in one chunk.
+
+        Parameters
+        ----------
+        prompt : str
+            Planning prompt
+        model : str | None, optional
+            Model name to use (provider-specific), by default None
+        max_tokens : int, optional
+            Maximum number of tokens to generate, by default 4000
+        temperature : float, optional
+            Sampling temperature, by default 0.5
+        prefix : str | None, optional
+            Static start of the prompt, sent ahead of `prompt` and marked
+            for provider-side prompt caching, by default None
+
+        Yields
+        ------
+        str
+            Successive chunks of the plan (in JSON format)
+        """
+        plan = await self.generate_plan(
+            prompt=prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            prefix=prefix,
+        )
+        yield json.dumps(plan)
+
+    async def stream_text(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream generated text as it is written.
+
+        Clients without a streaming endpoint fall back to yielding the
+        complete text from `generate_text` in one chunk.
+
+        Parameters
+        ----------
+        prompt : str
+            The text prompt
+        model : str | None, optional
+            Model name to use (provider-specific), by default None
+        max_tokens : int, optional
+            Maximum number of tokens to generate, by default 2000
+        temperature : float, optional
+            Sampling temperature, by default 0.5
+        prefix : str | None, optional
+            Static start of the prompt, sent ahead of `prompt` and marked
+            for provider-side prompt caching, by default None
+
+        Yields
+        ------
+        str
+            Successive chunks of the text
+        """
+        yield await self.generate_text(
+            prompt=prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            prefix=prefix,
+        )
+
+    async def stream_tikz(
+        self,
+        prompt: str,
+        model: str | None = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        prefix: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the completion of a TikZ request as it is written.
+
+        The chunks are the raw completion, which `generate_tikz` extracts
+        the code from. Clients without a streaming endpoint fall back to
+        yielding the code from `generate_tikz` in one chunk.
+
+        Parameters
+        ----------
+        prompt : str
+            Description of the diagram to generate
+        model : str | None, optional
+            Model name to use (provider-specific), by default None
+        max_tokens : int, optional
+            Maximum number of tokens to generate, by default 2000
+        temperature : float, optional
+            Sampling temperature, by default 0.5
+        prefix : str | None, optional
+            Static start of the prompt, sent ahead of `prompt` and marked
+            for provider-side prompt caching, by default None
+
+        Yields
+        ------
+        str
+            Successive chunks of the completion
+        """
+        yield await self.generate_tikz(
+            prompt=prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            prefix=prefix,
+        )
+
+    @staticmethod
+    def _with_prefix(prompt: str, prefix: str | None) -> str:
+        """
+        Join a static prefix and a prompt into a single message.
+
+        Providers with automatic prefix caching (OpenAI, Gemini) reuse the
+        cached prefix as long as it is byte-for-byte identical across calls.
+        """
+        return prompt if prefix is None else f'{prefix}{prompt}'
+
+    def _record_prompt_cache(
+        self,
+        model: str,
+        input_tokens: int,
+        cached_tokens: int,
+        cache_write_tokens: int = 0,
+    ) -> None:
+        """
+        Accumulate and log the prompt-cache usage of a call into
+        `prompt_cache_usage`.
+
+        Parameters
+        ----------
+        model : str
+            Model the call was made with
+        input_tokens : int
+            Total number of prompt tokens
+        cached_tokens : int
+            Prompt tokens read from the provider's cache
+        cache_write_tokens : int, optional
+            Prompt tokens written to the provider's cache, by default 0
+        """
+        usage = self.prompt_cache_usage
+        usage['input_tokens'] += input_tokens
+        usage['cached_tokens'] += cached_tokens
+        usage['cache_write_tokens'] += cache_write_tokens
+        add_counts(
+            input_tokens=input_tokens,
+            cached_tokens=cached_tokens,
+            cache_write_tokens=cache_write_tokens,
+        )
+        log.info(
+            'Prompt cache (%s): %d/%d input tokens cached, %d written',
+            model,
+            cached_tokens,
+            input_tokens,
+            cache_write_tokens,
+        )
+
+    def _record_tokens(
+        self,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        cached_tokens: int = 0,
+        cache_write_tokens: int = 0,
+        thinking_tokens: int = 0,
+    ) -> None:
+        """
+        Record the token usage of a call, for prompt caching (see
+        `_record_prompt_cache`), the current trace span and the usage of the
+        response being generated.
+
+        Parameters
+        ----------
+        model : str
+            Model the call was made with
+        input_tokens : int
+            Total number of prompt tokens
+        output_tokens : int
+            Total number of completion tokens, including thinking
+        cached_tokens : int, optional
+            Prompt tokens read from the provider's cache, by default 0
+        cache_write_tokens : int, optional
+            Prompt tokens written to the provider's cache, by default 0
+        thinking_tokens : int, optional
+            Completion tokens spent thinking, by default 0
+        """
+        self._record_prompt_cache(
+            model, input_tokens, cached_tokens, cache_write_tokens
+        )
+        add_counts(
+            output_tokens=output_tokens, thinking_tokens=thinking_tokens
+        )
+        record_usage(
+            model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cached_tokens=cached_tokens,
+            cache_write_tokens=cache_write_tokens,
+            thinking_tokens=thinking_tokens,
+        )
+
+    def _record_stream(
+        self, model: str, timer: StreamTimer, output_tokens: int
+    ) -> None:
+        """
+        Record the time to first token and the generation speed of a
+        streamed call on the current trace span, and log them.
+
+        Parameters
+        ----------
+        model : str
+            Model the call was made with
+        timer : StreamTimer
+            Timer of the call
+        output_tokens : int
+            Total number of completion tokens
+        """
+        if timer.first_chunk is None:
+            return
+        time_to_first_token = timer.first_chunk - timer.start
+        generation_time = time.perf_counter() - timer.first_chunk
+        tokens_per_second = (
+            output_tokens / generation_time if generation_time > 0 else None
+        )
+        set_attributes(time_to_first_token=time_to_first_token)
+        if tokens_per_second is not None:
+            set_attributes(tokens_per_second=tokens_per_second)
+        log.info(
+            'Stream (%s): first token after %.3fs, %s tokens/s',
+            model,
+            time_to_first_token,
+            f'{tokens_per_second:.1f}' if tokens_per_second else 'n/a',
+        )
+
+    def _record_images(self, model: str, images: int = 1) -> None:
+        """Record the images generated by a call."""
+        add_counts(images=images)
+        record_usage(model, images=images)
+
+    @staticmethod
+    def _extract_tikz(text: str) -> str:
+        """Clean up a model response to extract just the TikZ code."""
+        if '\\begin{tikzpicture}' in text:
+            text = text.split('\\begin{tikzpicture}')[1]
+        if '\\end{tikzpicture}' in text:
+            text = text.split('\\end{tikzpicture}')[0]
+
+        return f'\\begin{{tikzpicture}}\n{text.strip()}\n\\end{{tikzpicture}}'
+
     @classmethod
     def create_client(
         cls,
         provider: ModelProvider,
         model: str,
         api_key: str,
+        cache: 'CompletionCache | None' = None,
+        image_cache: 'ImageCache | None' = None,
+        hedging: 'HedgingSettings | None' = None,
+        downloader: 'ImageDownloader | None' = None,
     ) -> 'ModelClient':
         """
         Factory method to create a client instance.
@@ -148,6 +462,18 @@ class ModelClient(ABC):
             Model to use (provider-specific)
         api_key : str
             API key for the provider
+        cache : CompletionCache | None, optional
+            Store to serve repeated text, TikZ and plan requests from, by
+            default None (no caching)
+        image_cache : ImageCache | None, optional
+            Store to serve repeated image requests from, by default None (no
+            caching)
+        hedging : HedgingSettings | None, optional
+            Policy for hedging slow text and TikZ requests, by default None
+            (no hedging)
+        downloader : ImageDownloader | None, optional
+            Downloader to fetch generated images into the image cache with,
+            to share its connections, by default one for the client
 
         Returns
         -------
@@ -162,14 +488,35 @@ class ModelClient(ABC):
         if provider == ModelProvider.OPENAI:
             from src.clients.openai import OpenAIClient
 
-            return OpenAIClient(model=model, api_key=api_key)
+            client = OpenAIClient(model=model, api_key=api_key)
         elif provider == ModelProvider.ANTHROPIC:
             from src.clients.anthropic import AnthropicClient
 
-            return AnthropicClient(model=model, api_key=api_key)
-        # elif provider_type == ModelProvider.GOOGLE:
-        #     from .google import GoogleProvider
+            client = AnthropicClient(model=model, api_key=api_key)
+        elif provider == ModelProvider.GOOGLE:
+            from src.clients.google import GoogleClient
+
+            client = GoogleClient(model=model, api_key=api_key)
+        elif provider == ModelProvider.MOCK:
+            from src.clients.mock_client import MockClient
 
-        #     return GoogleProvider(api_key=api_key)
+            client = MockClient(model=model, api_key=api_key)
         else:
             raise ValueError(f'Unknown provider: {provider}')
+
+        if hedging is not None:
+            from src.clients.hedged import HedgedModelClient
+
+            # inside the cache, so that hits don't count as latencies
+            client = HedgedModelClient(client, settings=hedging)
+        if cache is not None or image_cache is not None:
+            from src.clients.cached import CachedModelClient
+
+            client = CachedModelClient(
+                client,
+                provider=provider,
+                cache=cache,
+                image_cache=image_cache,
+                downloader=downloader,
+            )
+        return client
@@ -3,6 +3,8 @@ from enum import StrEnum
 
 from pydantic import BaseModel, Field
 
+from src.models.usage import ResponseMetadata
+
 
 class ElementType(StrEnum):
     TEXT = 'text'
@@ -14,6 +16,10 @@ class TextElement(BaseModel):
     type: ElementType = ElementType.TEXT
     content: str
 
+    def to_markdown(self) -> str:
+        """Convert the element to markdown format."""
+        return self.content
+
 
 class ImageElement(BaseModel):
     type: ElementType = ElementType.IMAGE
@@ -21,20 +27,41 @@ class ImageElement(BaseModel):
     alt_text: str | None = None
     caption: str | None = None
 
+    def to_markdown(self) -> str:
+        """Convert the element to markdown format."""
+        alt = self.alt_text or 'Generated image'
+        md = f'![{alt}]({self.url})'
+        if self.caption:
+            md += f'\n*{self.caption}*'
+        return md
+
 
 class TikzElement(BaseModel):
     type: ElementType = ElementType.TIKZ
     code: str
-    image_path: str
+    image_path: str | None
     alt_text: str | None = None
     caption: str | None = None
 
+    def to_markdown(self) -> str:
+        """Convert the element to markdown format."""
+        alt = self.alt_text or 'Generated diagram'
+        if self.image_path:
+            md = f'![{alt}]({self.image_path})'
+        else:
+            md = f'```latex\n{self.code}\n```'
+        if self.caption:
+            md += f'\n*{self.caption}*'
+        return md
+
 
 type ResponseElement = TextElement | ImageElement | TikzElement
 
 
 class MultimodalResponse(BaseModel):
     elements: list[ResponseElement] = Field(default_factory=list)
+    # usage and cost of generating the response
+    metadata: ResponseMetadata | None = None
 
     def add_text(self, text: str) -> None:
         """Add a text element to the response."""
@@ -56,11 +83,13 @@ class MultimodalResponse(BaseModel):
             self.add_text(content)
         elif type == 'image':
             self.add_image(**content)
+        elif type == 'tikz':
+            self.add_tikz(**content)
 
     def add_tikz(
         self,
         code: str,
-        image_path: str,
+        image_path: str | None,
         alt_text: str | None = None,
         caption: str | None = None,
     ) -> None:
@@ -76,14 +105,5 @@ class MultimodalResponse(BaseModel):
 
     def to_markdown(self) -> str:
         """Convert the multimodal response to markdown format."""
-        md = ''
-        for element in self.elements:
-            if element.type == ElementType.TEXT:
-                md += f'{element.content}\n\n'
-            elif element.type == ElementType.IMAGE:
-                alt = element.alt_text or 'Generated image'
-                md += f'![{alt}]({element.url})\n'
-                if element.caption:
-                    md += f'*{element.caption}*\n'
-                md += '\n'
+        md = '\n\n'.join(element.to_markdown() for element in self.elements)
         return md.strip()
@@ -15,3 +15,65 @@ class TextModelSettings(ModelSettings):
 class ImageModelSettings(ModelSettings):
     size: str = '1024x1024'
     quality: str = 'standard'
+
+
+class RateLimitSettings(BaseModel):
+    """Client-side limits and retry policy of a provider's model."""
+
+    requests_per_minute: float | None = None
+    tokens_per_minute: float | None = None
+    max_retries: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+
+class HedgingSettings(BaseModel):
+    """Request hedging policy of a client."""
+
+    # hedge a call still running at this percentile of recent latencies
+    percentile: float = 95.0
+    # at most this fraction of calls is hedged
+    max_hedge_ratio: float = 0.1
+    # number of recent latencies the percentile is computed over
+    window: int = 100
+    # latencies to observe before hedging starts
+    min_samples: int = 20
+
+
+class TracingSettings(BaseModel):
+    """Where the spans of each response are exported."""
+
+    # JSON lines file, one span per line, e.g. 'traces.jsonl'
+    jsonl_path: str | None = None
+    # OTLP/HTTP traces endpoint of a collector, e.g.
+    # 'http://localhost:4318/v1/traces'
+    otlp_endpoint: str | None = None
+    service_name: str = 'multimodal-response'
+
+
+class ModelPrice(BaseModel):
+    """Price of a model's usage, in dollars."""
+
+    # per million tokens
+    input: float = 0.0
+    output: float = 0.0
+    # per million prompt tokens read from / written to the provider's cache
+    # (billed at the input price if None)
+    cached_input: float | None = None
+    cache_write: float | None = None
+    # per generated image
+    image: float = 0.0
+
+
+class LoggingSettings(BaseModel):
+    """Where and how much the application logs."""
+
+    path: str = 'app.log'
+    level: str = 'INFO'
+    format: str = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+    # prompts, plans and completions are cut to this many characters
+    payload_limit: int = 500
+    # fraction of payloads logged at all (the others only by their size)
+    payload_sample_rate: float = 1.0
+    # log payloads in full, ignoring the limit and sampling
+    full_payloads: bool = False
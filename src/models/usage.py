@@ -0,0 +1,166 @@
+import contextvars
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel, Field
+
+if TYPE_CHECKING:
+    from src.models.settings import ModelPrice
+
+
+class Usage(BaseModel):
+    """Usage of a model over one or more calls."""
+
+    calls: int = 0
+    # all prompt tokens, including the cached ones
+    input_tokens: int = 0
+    # all completion tokens, including the thinking ones
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    cache_write_tokens: int = 0
+    thinking_tokens: int = 0
+    images: int = 0
+
+    def add(self, other: 'Usage') -> None:
+        """Add the counts of another usage to this one."""
+        for field in Usage.model_fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def cost(self, price: 'ModelPrice') -> float:
+        """Cost of the usage at the given price."""
+        cached_price = (
+            price.input if price.cached_input is None else price.cached_input
+        )
+        write_price = (
+            price.input if price.cache_write is None else price.cache_write
+        )
+        uncached_tokens = (
+            self.input_tokens - self.cached_tokens - self.cache_write_tokens
+        )
+        return (
+            uncached_tokens * price.input
+            + self.cached_tokens * cached_price
+            + self.cache_write_tokens * write_price
+            + self.output_tokens * price.output
+        ) / 1e6 + self.images * price.image
+
+
+class UsageReport(BaseModel):
+    """Usage by model, with its cost if prices were given."""
+
+    by_model: dict[str, Usage] = Field(default_factory=dict)
+    cost: float | None = None
+
+    def record(self, model: str, usage: Usage) -> None:
+        """Add the usage of a model."""
+        self.by_model.setdefault(model, Usage()).add(usage)
+
+    @property
+    def total(self) -> Usage:
+        """Usage summed over all models."""
+        total = Usage()
+        for usage in self.by_model.values():
+            total.add(usage)
+        return total
+
+    def minus(self, others: list['UsageReport']) -> 'UsageReport':
+        """The usage not accounted for by `others`."""
+        report = UsageReport()
+        for model, usage in self.by_model.items():
+            remaining = usage.model_copy()
+            for other in others:
+                if model in other.by_model:
+                    for field, value in other.by_model[model]:
+                        setattr(
+                            remaining, field, getattr(remaining, field) - value
+                        )
+            if any(remaining.model_dump().values()):
+                report.by_model[model] = remaining
+        return report
+
+    def price(self, prices: dict[str, 'ModelPrice']) -> float | None:
+        """
+        Compute and store the cost of the usage.
+
+        Parameters
+        ----------
+        prices : dict[str, ModelPrice]
+            Price of each model
+
+        Returns
+        -------
+        float | None
+            The cost in dollars, or None if a model has no price
+        """
+        if any(model not in prices for model in self.by_model):
+            self.cost = None
+        else:
+            self.cost = sum(
+                usage.cost(prices[model])
+                for model, usage in self.by_model.items()
+            )
+        return self.cost
+
+
+class SubtaskUsage(BaseModel):
+    """Usage of one subtask (its refinement and generation)."""
+
+    order: int | None = None
+    type: str | None = None
+    usage: UsageReport
+
+
+class ResponseMetadata(BaseModel):
+    """Usage of a response, in total and by part."""
+
+    usage: UsageReport
+    # planning, and anything else not attributed to a subtask
+    planning: UsageReport
+    subtasks: list[SubtaskUsage] = Field(default_factory=list)
+
+
+# Reports that the calls of the current task are added to
+_scopes: contextvars.ContextVar[tuple[UsageReport, ...]] = (
+    contextvars.ContextVar('usage_scopes', default=())
+)
+
+
+@contextmanager
+def usage_scope() -> Iterator[UsageReport]:
+    """
+    Collect the usage of the calls made inside the block, including in
+    tasks started from it.
+
+    Scopes nest: a call counts towards every enclosing scope.
+
+    Yields
+    ------
+    UsageReport
+        The collected usage, complete once the block exits
+    """
+    report = UsageReport()
+    token = _scopes.set((*_scopes.get(), report))
+    try:
+        yield report
+    finally:
+        _scopes.reset(token)
+
+
+def record_usage(model: str, **counts: int) -> None:
+    """
+    Count a call towards the enclosing usage scopes.
+
+    Parameters
+    ----------
+    model : str
+        Model of the call
+    **counts : int
+        Counts of the call, by `Usage` field
+    """
+    scopes = _scopes.get()
+    if not scopes:
+        return
+    usage = Usage(calls=1, **counts)
+    for report in scopes:
+        report.record(model, usage)
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+from typing import Any
+
+from src.clients.batch_backends import BatchBackend, BatchRequest, BatchResult
+from src.models.provider import ModelClient
+from src.models.response import MultimodalResponse
+from src.orchestration.prompts.tikz_prompt import (
+    tikz_prefix,
+    tikz_suffix_template,
+)
+from src.orchestration.task_manager import TaskManager
+
+log = logging.getLogger(__name__)
+
+
+class BatchFailure(Exception):
+    """A prompt whose response could not be generated in a batch run."""
+
+
+class BatchEngine:
+    """
+    Runs the `TaskManager` pipeline for many prompts through a provider's
+    batch API.
+
+    Instead of chaining the calls of each prompt, the pipeline proceeds in
+    waves over all prompts: one batch of plans, one batch of refinements
+    (if enabled) and one batch of text and TikZ generations. Images, which
+    batch APIs don't support, are generated with the image client during
+    the last wave, and TikZ figures are compiled once their code arrives.
+    All batched calls go to the backend's provider, with the models of the
+    task manager's planner and clients.
+    """
+
+    def __init__(
+        self,
+        task_manager: TaskManager,
+        backend: BatchBackend,
+        poll_interval: float = 60.0,
+    ) -> None:
+        """
+        Initialize the engine.
+
+        Parameters
+        ----------
+        task_manager : TaskManager
+            Task manager providing the planner, clients and settings
+        backend : BatchBackend
+            Batch API to submit the calls to
+        poll_interval : float, optional
+            Seconds between batch status checks, by default 60
+        """
+        self.task_manager = task_manager
+        self.backend = backend
+        self.poll_interval = poll_interval
+
+    async def _wave(
+        self, name: str, requests: list[BatchRequest]
+    ) -> dict[str, BatchResult]:
+        log.info('Starting %s wave of %d requests', name, len(requests))
+        return await self.backend.run(requests, self.poll_interval)
+
+    async def _plan_wave(
+        self, prompts: list[str], failures: dict[int, Exception]
+    ) -> dict[int, list[dict[str, Any]]]:
+        planner = self.task_manager.planner
+        results = await self._wave(
+            'plan',
+            [
+                BatchRequest(
+                    custom_id=f'plan-{i}',
+                    prompt=planner.build_planning_prompt(prompt),
+                    prefix=planner.planning_prefix,
+                    model=planner.model,
+                    max_tokens=planner.max_tokens,
+                    temperature=planner.temperature,
+                )
+                for i, prompt in enumerate(prompts)
+            ],
+        )
+
+        plans = {}
+        for i in range(len(prompts)):
+            result = results[f'plan-{i}']
+            try:
+                if result.error is not None:
+                    raise BatchFailure(f'planning failed: {result.error}')
+                subtasks = json.loads(result.text)['subtasks']
+            except (BatchFailure, ValueError, KeyError, TypeError) as e:
+                failures[i] = e
+                continue
+            subtasks.sort(key=lambda x: x.get('order', 0))
+            plans[i] = subtasks
+        return plans
+
+    async def _refine_wave(
+        self, prompts: list[str], plans: dict[int, list[dict[str, Any]]]
+    ) -> None:
+        task_manager = self.task_manager
+        results = await self._wave(
+            'refine',
+            [
+                BatchRequest(
+                    custom_id=f'refine-{i}-{j}',
+                    prompt=task_manager.build_refinement_prompt(
+                        prompts[i], task.get('type'), task.get('prompt')
+                    ),
+                    model=task_manager.text_client.model,
+                )
+                for i, subtasks in plans.items()
+                for j, task in enumerate(subtasks)
+            ],
+        )
+
+        for i, subtasks in plans.items():
+            for j, task in enumerate(subtasks):
+                result = results[f'refine-{i}-{j}']
+                if result.text is None:
+                    # a refinement is an improvement, not a requirement
+                    log.warning(
+                        'Keeping unrefined subtask %d/%d: %s',
+                        i,
+                        j,
+                        result.error,
+                    )
+                    continue
+                task['prompt'] = result.text
+
+    async def _generate_images(
+        self, plans: dict[int, list[dict[str, Any]]]
+    ) -> dict[tuple[int, int], tuple[int, str, Any] | Exception]:
+        jobs = {
+            (i, j): self.task_manager.generate_response_element(task)
+            for i, subtasks in plans.items()
+            for j, task in enumerate(subtasks)
+            if task.get('type') == 'image'
+        }
+        elements = await asyncio.gather(*jobs.values(), return_exceptions=True)
+        return dict(zip(jobs, elements, strict=True))
+
+    async def _generation_wave(
+        self,
+        plans: dict[int, list[dict[str, Any]]],
+        failures: dict[int, Exception],
+    ) -> dict[int, list[tuple[int, str, Any]]]:
+        task_manager = self.task_manager
+        requests = []
+        for i, subtasks in plans.items():
+            for j, task in enumerate(subtasks):
+                if task.get('type') == 'text':
+                    requests.append(
+                        BatchRequest(
+                            custom_id=f'text-{i}-{j}',
+                            prompt=task.get('prompt'),
+                            model=task_manager.text_client.model,
+                        )
+                    )
+                elif task.get('type') == 'tikz':
+                    requests.append(
+                        BatchRequest(
+                            custom_id=f'tikz-{i}-{j}',
+                            prompt=tikz_suffix_template.format(
+                                prompt=task.get('prompt')
+                            ),
+                            prefix=tikz_prefix,
+                            model=task_manager.tikz_client.model,
+                        )
+                    )
+
+        results, images = await asyncio.gather(
+            self._wave('generation', requests), self._generate_images(plans)
+        )
+
+        elements = {}
+        tikz_jobs = {}
+        for i, subtasks in plans.items():
+            try:
+                prompt_elements = []
+                tikz_tasks = []
+                for j, task in enumerate(subtasks):
+                    task_type = task.get('type')
+                    order = task.get('order')
+                    if task_type == 'image':
+                        element = images[(i, j)]
+                        if isinstance(element, Exception):
+                            raise BatchFailure(
+                                f'image {j} failed: {element!r}'
+                            )
+                        prompt_elements.append(element)
+                        continue
+                    if task_type not in ('text', 'tikz'):
+                        continue
+
+                    result = results[f'{task_type}-{i}-{j}']
+                    if result.error is not None:
+                        raise BatchFailure(f'{task_type} {j}: {result.error}')
+                    if task_type == 'text':
+                        prompt_elements.append((order, 'text', result.text))
+                    else:
+                        tikz_tasks.append(
+                            (task, ModelClient._extract_tikz(result.text))
+                        )
+            except BatchFailure as e:
+                failures[i] = e
+                continue
+            elements[i] = prompt_elements
+            if tikz_tasks:
+                tikz_jobs[i] = tikz_tasks
+
+        # compile the figures of each response together
+        compiled = await asyncio.gather(
+            *(
+                task_manager.tikz_compiler.compile_many(
+                    [code for _, code in tikz_tasks]
+                )
+                for tikz_tasks in tikz_jobs.values()
+            )
+        )
+        for (i, tikz_tasks), image_paths in zip(
+            tikz_jobs.items(), compiled, strict=True
+        ):
+            for (task, code), image_path in zip(
+                tikz_tasks, image_paths, strict=True
+            ):
+                elements[i].append(
+                    (
+                        task.get('order'),
+                        'tikz',
+                        {
+                            'code': code,
+                            'image_path': image_path,
+                            'alt_text': task.get('alt_text'),
+                            'caption': task.get('caption'),
+                        },
+                    )
+                )
+        return elements
+
+    async def generate_responses(
+        self, prompts: list[str]
+    ) -> list[MultimodalResponse | Exception]:
+        """
+        Generate the responses to many prompts in batched waves.
+
+        Parameters
+        ----------
+        prompts : list[str]
+            The user prompts
+
+        Returns
+        -------
+        list[MultimodalResponse | Exception]
+            The response to each prompt, or the reason it failed
+        """
+        failures = {}
+        plans = await self._plan_wave(prompts, failures)
+        if self.task_manager.refine_tasks:
+            await self._refine_wave(prompts, plans)
+        elements = await self._generation_wave(plans, failures)
+
+        responses = []
+        for i in range(len(prompts)):
+            if i in failures:
+                responses.append(failures[i])
+                continue
+            response = MultimodalResponse()
+            for element in sorted(elements[i], key=lambda x: x[0]):
+                response.add_element(type=element[1], content=element[2])
+            responses.append(response)
+        return responses
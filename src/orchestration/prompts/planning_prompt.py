@@ -1,4 +1,6 @@
-planning_prompt_template = (
+# Static instructions and few-shot example, identical across requests so
+# that providers can cache them
+planning_prefix_template = (
     '**Task:**'
     '\n\n'
     'You are an AI assistant that plans multimodal responses including'
@@ -40,6 +42,10 @@ planning_prompt_template = (
     '**Example Response:**'
     '\n\n'
     '{task_response_example}'
+)
+
+# Request-specific remainder of the planning prompt
+planning_suffix_template = (
     '\n\n'
     '**User Query:**'
     '\n\n'
@@ -54,6 +60,8 @@ planning_prompt_template = (
     ' for my automated pipeline.'
 )
 
+planning_prompt_template = planning_prefix_template + planning_suffix_template
+
 
 if __name__ == '__main__':
     print(planning_prompt_template, '\n\n')
@@ -330,6 +330,32 @@ tikz_examples = [
 ]
 
 
+def _unescape(text: str) -> str:
+    """Undo the `str.format` brace escapes of the example responses."""
+    return text.replace('{{', '{').replace('}}', '}')
+
+
+# Static instructions and few-shot examples, identical across requests so
+# that providers can cache them
+tikz_prefix = (
+    'Create precise TikZ code for LaTeX that generates a figure based on the'
+    ' description at the end of this message.'
+    '\n\n'
+    'Return only the complete TikZ code that would go between'
+    ' \\begin{tikzpicture} and \\end{tikzpicture}.\n'
+    'Include proper \\usetikzlibrary commands for any libraries needed.\n'
+    'The code should be compilable with pdflatex and should not require any'
+    ' special packages other than TikZ.'
+) + ''.join(
+    f'\n\n**Example Description:**\n\n{example["prompt"]}'
+    f'\n\n**Example Response:**\n\n{_unescape(example["response"])}'
+    for example in tikz_examples
+)
+
+# Request-specific remainder of the TikZ prompt
+tikz_suffix_template = '\n\n**Figure Description:**\n\n{prompt}'
+
+
 if __name__ == '__main__':
     # test compiling the responses
 
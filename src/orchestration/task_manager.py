@@ -1,19 +1,33 @@
 import asyncio
+import heapq
 import logging
+from collections.abc import AsyncIterator
 from typing import Any
 
 from src.orchestration.task_planner import TaskPlanner
-from src.models.response import MultimodalResponse
+from src.models.response import MultimodalResponse, ResponseElement
+from src.models.settings import ModelPrice
+from src.models.usage import (
+    ResponseMetadata,
+    SubtaskUsage,
+    UsageReport,
+    usage_scope,
+)
 from src.models.provider import ModelClient
 from src.orchestration.prompts.refinement_prompt import (
     refine_image_task_template,
     refine_text_task_template,
+    refine_tikz_task_template,
+)
+from src.orchestration.prompts.tikz_prompt import (
+    tikz_prefix,
+    tikz_suffix_template,
 )
-from src.utils.tikz_compiler import compile_tikz
+from src.utils.tikz_compiler import TikzBatch, TikzCompiler
+from src.utils.log_config import payload
+from src.utils.tracing import span
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.INFO)
-log.addHandler(logging.FileHandler('app.log'))
 
 
 class TaskManager:
@@ -26,6 +40,9 @@ class TaskManager:
         tikz_element_client: ModelClient,
         task_planner: TaskPlanner,
         refine_tasks: bool = False,
+        stream_plan: bool = False,
+        tikz_compiler: TikzCompiler | None = None,
+        prices: dict[str, ModelPrice] | None = None,
     ) -> None:
         """
         Initialize the orchestrator with necessary 'tools'.
@@ -40,15 +57,35 @@ class TaskManager:
             Task planner for generating subtasks
         refine_tasks : bool
             Whether to refine the tasks generated by the planner
+        stream_plan : bool
+            Whether to start each subtask as soon as the planner emits it,
+            rather than waiting for the complete plan
+        tikz_compiler : TikzCompiler | None
+            Compilation service for TikZ elements, by default one with a
+            worker per CPU core
+        prices : dict[str, ModelPrice] | None
+            Price of each model, to compute the cost of the responses. By
+            default None, which only counts the usage.
         """
         self.text_client = text_element_client
         self.image_client = image_element_client
         self.tikz_client = tikz_element_client
         self.planner = task_planner
         self.refine_tasks = refine_tasks
+        self.stream_plan = stream_plan
+        self.tikz_compiler = tikz_compiler or TikzCompiler()
+        self.prices = prices
+        self.refinement_prompt = {
+            'text': refine_text_task_template,
+            'image': refine_image_task_template,
+            'tikz': refine_tikz_task_template,
+        }
 
     async def generate_response_element(
-        self, task: dict[str, str]
+        self,
+        task: dict[str, str],
+        tikz_batch: TikzBatch | None = None,
+        tikz_slot: int | None = None,
     ) -> tuple[int, str, Any]:
         """
         Generate a response element (text or image) to the given prompt.
@@ -57,6 +94,11 @@ class TaskManager:
         ----------
         task : dict[str, str]
             _description_
+        tikz_batch : TikzBatch | None
+            Batch to compile a TikZ element with, instead of compiling it on
+            its own
+        tikz_slot : int | None
+            Slot of the element in `tikz_batch`
 
         Returns
         -------
@@ -67,51 +109,71 @@ class TaskManager:
         task_type = task.get('type')
         task_prompt = task.get('prompt')
 
-        if task_type == 'text':
-            content = await self.text_client.generate_text(task_prompt)
+        with span('generate_element', type=task_type, order=element_order):
+            if task_type == 'text':
+                content = await self.text_client.generate_text(task_prompt)
 
-        elif task_type == 'image':
-            content = {}
-            content['url'] = await self.image_client.generate_image(
-                prompt=task_prompt
-            )
-            content['alt_text'] = task.get('alt_text')
-            content['caption'] = task.get('caption')
+            elif task_type == 'image':
+                content = {}
+                content['url'] = await self.image_client.generate_image(
+                    prompt=task_prompt
+                )
+                content['alt_text'] = task.get('alt_text')
+                content['caption'] = task.get('caption')
 
-        elif task_type == 'tikz':
-            content = {}
-            tikz_code = await self.tikz_client.generate_tikz(
-                prompt=task_prompt
-            )
+            elif task_type == 'tikz':
+                content = {}
+                tikz_code = await self.tikz_client.generate_tikz(
+                    prompt=tikz_suffix_template.format(prompt=task_prompt),
+                    prefix=tikz_prefix,
+                )
 
-            tikz_image_path = compile_tikz(tikz_code)
+                if tikz_batch is not None:
+                    tikz_image_path = await tikz_batch.compile(
+                        tikz_slot, tikz_code
+                    )
+                else:
+                    tikz_image_path = await self.tikz_compiler.compile(
+                        tikz_code
+                    )
 
-            content['code'] = tikz_code
-            content['image_path'] = tikz_image_path
-            content['alt_text'] = task.get('alt_text')
-            content['caption'] = task.get('caption')
+                content['code'] = tikz_code
+                content['image_path'] = tikz_image_path
+                content['alt_text'] = task.get('alt_text')
+                content['caption'] = task.get('caption')
 
         return element_order, task_type, content
 
+    def build_refinement_prompt(
+        self, user_prompt: str, task_type: str, task_prompt: str
+    ) -> str:
+        """Build the prompt asking to refine a subtask's prompt."""
+        return self.refinement_prompt[task_type].format(
+            user_prompt=user_prompt,
+            task_prompt=task_prompt,
+            # before_context=before_context,
+            # after_context=after_context,
+        )
+
     async def _refine_subtask_prompts(
         self,
         user_prompt: str,
         task_type: str,
         task_description: str,
         task_prompt: str,
-        before_context: str,
-        after_context: str,
+        before_context: str | None,
+        after_context: str | None,
         order: int,
         alt_text: str | None = None,
         caption: str | None = None,
     ) -> dict[str, Any]:
-        refine_prompt = self.refinement_prompt[task_type].format(
-            user_prompt=user_prompt,
-            task_prompt=task_prompt,
-            # before_context=before_context,
-            # after_context=after_context,
+        refine_prompt = self.build_refinement_prompt(
+            user_prompt, task_type, task_prompt
         )
-        response = await self.text_client.generate_text(prompt=refine_prompt)
+        with span('refine_subtask', type=task_type, order=order):
+            response = await self.text_client.generate_text(
+                prompt=refine_prompt
+            )
 
         # reconstruct subtask with refined prompt
         subtask = {
@@ -124,20 +186,120 @@ class TaskManager:
         }
         return subtask
 
-    async def _refine_subtasks(
+    async def _run_subtask(
         self,
         user_prompt: str,
-        subtasks: list[dict[str, Any]],
-    ) -> list[dict[str, Any]]:
+        task: dict[str, Any],
+        before_context: str | None = None,
+        after_context: str | None = None,
+        tikz_batch: TikzBatch | None = None,
+        tikz_slot: int | None = None,
+        subtask_usage: list[SubtaskUsage] | None = None,
+    ) -> tuple[int, str, Any]:
+        """
+        Run the chain for one subtask: refine (if enabled), then generate.
+
+        Each subtask proceeds independently of the others, so a slow
+        refinement only delays its own element. Its usage is appended to
+        `subtask_usage`.
+        """
+        with (
+            span('subtask', type=task.get('type'), order=task.get('order')),
+            usage_scope() as usage,
+        ):
+            if subtask_usage is not None:
+                subtask_usage.append(
+                    SubtaskUsage(
+                        order=task.get('order'),
+                        type=task.get('type'),
+                        usage=usage,
+                    )
+                )
+            try:
+                if self.refine_tasks:
+                    task = await self._refine_subtask_prompts(
+                        user_prompt=user_prompt,
+                        task_type=task.get('type'),
+                        task_description=task.get('description'),
+                        task_prompt=task.get('prompt'),
+                        before_context=before_context,
+                        after_context=after_context,
+                        order=task.get('order', 0),
+                        alt_text=task.get('alt_text'),
+                        caption=task.get('caption'),
+                    )
+                    log.info('Refined subtask: %s', payload(task))
+                return await self.generate_response_element(
+                    task, tikz_batch, tikz_slot
+                )
+            finally:
+                if tikz_batch is not None:
+                    # no-op if the code was submitted to the batch
+                    tikz_batch.release(tikz_slot)
+
+    async def _stream_plan_tasks(
+        self,
+        prompt: str,
+        subtask_usage: list[SubtaskUsage],
+        element_tasks: list[asyncio.Task],
+        ready: asyncio.Queue,
+    ) -> None:
+        """Start each subtask as soon as the planner streams it."""
+        before_context = None
+        # the number of TikZ elements is only known once the plan is done,
+        # so their compilation is batched until then
+        tikz_batch = TikzBatch(self.tikz_compiler)
+        async for subtask in self.planner.stream_plan(prompt):
+            tikz_slot = None
+            if subtask.get('type') == 'tikz':
+                tikz_slot = tikz_batch.reserve()
+            element_task = asyncio.create_task(
+                self._run_subtask(
+                    user_prompt=prompt,
+                    task=subtask,
+                    before_context=before_context,
+                    tikz_batch=tikz_batch if tikz_slot is not None else None,
+                    tikz_slot=tikz_slot,
+                    subtask_usage=subtask_usage,
+                )
+            )
+            element_tasks.append(element_task)
+            ready.put_nowait((subtask.get('order', 0), element_task))
+            before_context = subtask.get('description')
+        tikz_batch.seal()
+
+    async def _plan_tasks(
+        self,
+        prompt: str,
+        subtask_usage: list[SubtaskUsage],
+        element_tasks: list[asyncio.Task],
+        ready: asyncio.Queue,
+    ) -> None:
+        """Plan the response, then start every subtask."""
+        # Plan the response
+        subtasks = await self.planner.generate_plan(prompt)
+        log.info('Planned subtasks: %s', payload(subtasks))
+
+        # Sort subtasks by order
+        subtasks.sort(key=lambda x: x.get('order', 0))
         num_subtasks = len(subtasks)
 
-        refinement_tasks = [
-            asyncio.create_task(
-                self._refine_subtask_prompts(
-                    user_prompt=user_prompt,
-                    task_type=task.get('type'),
-                    task_description=task.get('description'),
-                    task_prompt=task.get('prompt'),
+        # Compile TikZ elements together if there are several
+        tikz_batch = None
+        tikz_slots = [None] * num_subtasks
+        if sum(task.get('type') == 'tikz' for task in subtasks) > 1:
+            tikz_batch = TikzBatch(self.tikz_compiler)
+            for i, task in enumerate(subtasks):
+                if task.get('type') == 'tikz':
+                    tikz_slots[i] = tikz_batch.reserve()
+            tikz_batch.seal()
+
+        # Refine (if needed) and generate each subtask as its own chain
+        for i, task in enumerate(subtasks):
+            element_task = asyncio.create_task(
+                self._run_subtask(
+                    user_prompt=prompt,
+                    task=task,
                     before_context=(
                         subtasks[i - 1].get('description')
                         if i > 0
@@ -148,17 +310,116 @@ class TaskManager:
                         if i < num_subtasks - 1
                         else 'is the end of the response'
                     ),
-                    order=i,
-                    alt_text=task.get('alt_text'),
-                    caption=task.get('caption'),
+                    tikz_batch=(
+                        tikz_batch if tikz_slots[i] is not None else None
+                    ),
+                    tikz_slot=tikz_slots[i],
+                    subtask_usage=subtask_usage,
                 )
             )
-            for i, task in enumerate(subtasks)
-        ]
+            element_tasks.append(element_task)
+            ready.put_nowait((task.get('order', 0), element_task))
 
-        refined_subtasks = await asyncio.gather(*refinement_tasks)
-        refined_subtasks.sort(key=lambda x: x.get('order', 0))
-        return refined_subtasks
+    async def _produce_elements(
+        self, prompt: str, response: MultimodalResponse, ready: asyncio.Queue
+    ) -> None:
+        """
+        Plan the response and start its subtasks, queuing each with its
+        order (then None once the plan is complete), and set the response's
+        metadata once they are done.
+
+        This runs as its own task, so that the span and usage scope of the
+        response cover its subtasks but not the consumer of the stream.
+        """
+        subtask_usage = []
+        element_tasks = []
+        with (
+            span('generate_response', stream_plan=self.stream_plan),
+            usage_scope() as usage,
+        ):
+            try:
+                if self.stream_plan:
+                    # Plan, refine and generate each subtask as it is streamed
+                    await self._stream_plan_tasks(
+                        prompt, subtask_usage, element_tasks, ready
+                    )
+                else:
+                    await self._plan_tasks(
+                        prompt, subtask_usage, element_tasks, ready
+                    )
+                ready.put_nowait(None)
+                await asyncio.gather(*element_tasks)
+            except BaseException:
+                for element_task in element_tasks:
+                    element_task.cancel()
+                raise
+            finally:
+                # the stream stops reading at the first None
+                ready.put_nowait(None)
+
+        response.metadata = self._usage_metadata(usage, subtask_usage)
+        log.info('Response usage: %s', response.metadata.usage)
+
+    async def stream_response(
+        self, prompt: str, response: MultimodalResponse | None = None
+    ) -> AsyncIterator[ResponseElement]:
+        """
+        Generate a multimodal response, yielding its elements in order as
+        soon as they are ready.
+
+        Every subtask runs concurrently, and elements are yielded by their
+        `order` in the plan: an element is yielded once it is done and the
+        elements before it have been yielded, so elements that finish (or
+        are planned) early are held back. Subtasks start while the plan
+        is streamed, but elements are released from the smallest planned
+        order once the whole plan is known.
+
+        Parameters
+        ----------
+        prompt : str
+            User's input prompt
+        response : MultimodalResponse | None, optional
+            Response to add the elements to as they are yielded; its
+            metadata is set once the stream ends. By default a new one.
+
+        Yields
+        ------
+        ResponseElement
+            The next element of the response
+        """
+        if response is None:
+            response = MultimodalResponse()
+        ready = asyncio.Queue()
+        producer = asyncio.create_task(
+            self._produce_elements(prompt, response, ready)
+        )
+
+        async def result(element_task: asyncio.Task) -> tuple[int, str, Any]:
+            await asyncio.wait([element_task])
+            if element_task.cancelled():
+                # cancelled by the producer: raise the response's error
+                await producer
+            return element_task.result()
+
+        try:
+            # started subtasks by (order, arrival): the planner may list them
+            # in any order, so the smallest planned order is only known once
+            # the plan is complete
+            pending = []
+            while (item := await ready.get()) is not None:
+                heapq.heappush(pending, (item[0], len(pending), item[1]))
+            while pending:
+                _, _, element_task = heapq.heappop(pending)
+                _, task_type, content = await result(element_task)
+                response.add_element(type=task_type, content=content)
+                yield response.elements[-1]
+            # raises any planning error, and waits for the metadata
+            await producer
+        finally:
+            # no-op if it finished; also retrieves its error if the stream
+            # was ended by a failed element
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
 
     async def generate_response(self, prompt: str) -> MultimodalResponse:
         """Generate a multimodal response to the given prompt.
@@ -169,32 +430,28 @@ class TaskManager:
         Returns:
             A MultimodalResponse containing the interleaved text and image elements
         """
-        # Plan the response
-        subtasks = await self.planner.generate_plan(prompt)
-        log.info(f'Planned subtasks: {subtasks}')
-
-        # Sort subtasks by order
-        subtasks.sort(key=lambda x: x.get('order', 0))
-
-        # Refine the tasks if needed
-        if self.refine_tasks:
-            # Refine the tasks
-            self.refinement_prompt = {
-                'text': refine_text_task_template,
-                'image': refine_image_task_template,
-            }
-            subtasks = await self._refine_subtasks(prompt, subtasks)
-            log.info(f'Refined subtasks: {subtasks}')
-
-        # Execute each subtask
         response = MultimodalResponse()
-
-        response_tasks = [
-            self.generate_response_element(task) for task in subtasks
-        ]
-        elements = await asyncio.gather(*response_tasks)
-        sorted_elements = sorted(elements, key=lambda x: x[0])
-        for element in sorted_elements:
-            response.add_element(type=element[1], content=element[2])
-
+        async for _ in self.stream_response(prompt, response):
+            pass
         return response
+
+    def _usage_metadata(
+        self, usage: UsageReport, subtask_usage: list[SubtaskUsage]
+    ) -> ResponseMetadata:
+        """Break down the usage of a response, pricing it if possible."""
+        metadata = ResponseMetadata(
+            usage=usage,
+            # whatever no subtask made: the plan
+            planning=usage.minus([subtask.usage for subtask in subtask_usage]),
+            subtasks=sorted(
+                subtask_usage, key=lambda subtask: subtask.order or 0
+            ),
+        )
+        if self.prices is not None:
+            for report in (
+                metadata.usage,
+                metadata.planning,
+                *(subtask.usage for subtask in metadata.subtasks),
+            ):
+                report.price(self.prices)
+        return metadata
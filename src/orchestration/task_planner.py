@@ -1,16 +1,23 @@
 import logging
+import time
+from collections.abc import AsyncIterator
 from typing import Any
 
-from src.orchestration.prompts.planning_prompt import planning_prompt_template
+from src.orchestration.prompts.planning_prompt import (
+    planning_prefix_template,
+    planning_suffix_template,
+)
 from src.orchestration.prompts.planning_examples import (
     query_example,
     task_response_example,
 )
+from src.clients.cached import CompletionCache
 from src.models.provider import ModelProvider, ModelClient
+from src.utils.plan_parser import SubtaskStreamParser
+from src.utils.log_config import payload
+from src.utils.tracing import set_attributes, span
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.INFO)
-log.addHandler(logging.FileHandler('app.log'))
 
 
 class TaskPlanner:
@@ -24,6 +31,7 @@ class TaskPlanner:
         use_extended_thinking: bool = False,
         max_tokens: int = 4000,
         temperature: float = 0.5,
+        cache: CompletionCache | None = None,
     ) -> None:
         """
         Initialize the task planner.
@@ -36,15 +44,28 @@ class TaskPlanner:
             Provider API key
         model : str
             The model to use (provider-specific)
+        cache : CompletionCache | None
+            Store to serve repeated plans from, by default None
         """
         self.provider = provider
         self.model = model
         self.client = ModelClient.create_client(
-            self.provider, model=self.model, api_key=api_key
+            self.provider, model=self.model, api_key=api_key, cache=cache
         )
         self.max_tokens = max_tokens
         self.temperature = temperature
         self.use_extended_thinking = use_extended_thinking
+        # sent as a separate, cacheable block ahead of each planning prompt
+        self.planning_prefix = planning_prefix_template.format(
+            query_example=query_example,
+            task_response_example=task_response_example,
+        )
+
+    def build_planning_prompt(self, prompt: str) -> str:
+        """Build the prompt asking the planner to plan a response."""
+        planning_prompt = planning_suffix_template.format(prompt=prompt)
+        log.info('Planning prompt: %s', payload(planning_prompt))
+        return planning_prompt
 
     async def generate_plan(self, prompt: str) -> list[dict[str, Any]]:
         """Generate a plan of subtasks for responding to the given prompt.
@@ -55,19 +76,68 @@ class TaskPlanner:
         Returns:
             A list of subtasks with their details
         """
-        planning_prompt = planning_prompt_template.format(
-            query_example=query_example,
-            task_response_example=task_response_example,
-            prompt=prompt,
-        )
-        log.info(f'Planning prompt: {planning_prompt}')
+        planning_prompt = self.build_planning_prompt(prompt)
 
-        plan = await self.client.generate_plan(
-            prompt=planning_prompt,
-            model=self.model,
-            max_tokens=self.max_tokens,
-            temperature=self.temperature,
-        )
-        log.info(f'Generated plan: {plan}')
+        with span('generate_plan', model=self.model):
+            plan = await self.client.generate_plan(
+                prompt=planning_prompt,
+                model=self.model,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                prefix=self.planning_prefix,
+            )
+            set_attributes(subtasks=len(plan['subtasks']))
+        log.info('Generated plan: %s', payload(plan))
 
         return plan['subtasks']
+
+    async def stream_plan(self, prompt: str) -> AsyncIterator[dict[str, Any]]:
+        """Stream the subtasks of a plan as soon as each one is generated.
+
+        Args:
+            prompt: The initial user prompt
+
+        Yields:
+            Each subtask with its details, in the order they are emitted
+
+        Raises:
+            ValueError: If the stream ends before the subtasks array is
+                complete (e.g. it was cut off by `max_tokens`)
+        """
+        planning_prompt = self.build_planning_prompt(prompt)
+
+        stream_kwargs = {}
+        if self.provider == ModelProvider.ANTHROPIC:
+            stream_kwargs['use_extended_thinking'] = self.use_extended_thinking
+
+        parser = SubtaskStreamParser()
+        chunks = []
+        # not made current: the consumer runs subtasks between the yields
+        with span('stream_plan', activate=False, model=self.model) as trace:
+            subtasks = 0
+            async for chunk in self.client.stream_plan(
+                prompt=planning_prompt,
+                model=self.model,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                prefix=self.planning_prefix,
+                **stream_kwargs,
+            ):
+                chunks.append(chunk)
+                for subtask in parser.feed(chunk):
+                    log.info('Streamed subtask: %s', payload(subtask))
+                    subtasks += 1
+                    if trace is not None:
+                        trace.attributes['subtasks'] = subtasks
+                        if subtasks == 1:
+                            trace.attributes['first_subtask_after'] = (
+                                time.time_ns() - trace.start_time
+                            ) / 1e9
+                    yield subtask
+
+            if not parser.finished:
+                # truncated, or not a plan: the subtasks so far are partial
+                raise ValueError(
+                    f'Incomplete plan stream after {subtasks} subtasks: '
+                    f'{payload("".join(chunks))}'
+                )
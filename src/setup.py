@@ -3,66 +3,214 @@ import logging
 
 from dotenv import load_dotenv
 
+from src.clients.batch_backends import (
+    AnthropicBatchBackend,
+    BatchBackend,
+    LocalBatchBackend,
+    OpenAIBatchBackend,
+)
+from src.clients.cached import CompletionCache
+from src.clients.rate_limiter import rate_limit_stats, set_rate_limit
 from src.models.provider import ModelProvider, ModelClient
+from src.models.response import MultimodalResponse
+from src.models.settings import (
+    HedgingSettings,
+    ModelPrice,
+    RateLimitSettings,
+    TracingSettings,
+)
 from src.orchestration.task_planner import TaskPlanner
 from src.orchestration.task_manager import TaskManager
+from src.utils.image_cache import ImageCache
+from src.utils.tikz_cache import TikzCache
+from src.utils.tikz_compiler import TikzCompiler
+from src.utils.tracing import configure_tracing
+from src.utils.assets import AssetManager
 from src.utils.formatting import (
-    save_response_to_html,  # noqa: F401
-    save_response_to_markdown,  # noqa: F401
+    HtmlWriter,  # noqa: F401
+    MarkdownWriter,
 )
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.INFO)
-log.addHandler(logging.FileHandler('app.log'))
 
 
-async def respond():
+def build_task_manager(hedge: bool = False) -> TaskManager:
+    """
+    Create the task manager with the configured providers and models.
+
+    Parameters
+    ----------
+    hedge : bool, optional
+        Hedge slow text element calls with a duplicate request (at most one
+        call in ten, billed as an extra call), by default False
+
+    Returns
+    -------
+    TaskManager
+        Task manager for generating responses
+    """
     load_dotenv()
 
+    # Spans are not exported by default: set jsonl_path (e.g. to
+    # 'traces.jsonl') to write those of each response to a file, or
+    # otlp_endpoint to send them to a local OpenTelemetry collector
+    configure_tracing(TracingSettings())
+
+    # Client-side rate limits, shared by all clients of a model (set these
+    # to your account's limits)
+    set_rate_limit(
+        ModelProvider.ANTHROPIC,
+        'claude-3-7-sonnet-20250219',
+        RateLimitSettings(requests_per_minute=50, tokens_per_minute=40_000),
+    )
+    set_rate_limit(
+        ModelProvider.OPENAI,
+        'dall-e-3',
+        RateLimitSettings(requests_per_minute=7),
+    )
+
+    # Reuse completions across runs
+    completion_cache = CompletionCache()
+
     # Create clients for each component
     task_planner = TaskPlanner(
         provider=ModelProvider.ANTHROPIC,
         api_key=os.getenv('ANTHROPIC_API_KEY'),
         model='claude-3-7-sonnet-20250219',
         use_extended_thinking=True,
+        cache=completion_cache,
     )
     text_element_client = ModelClient.create_client(
         provider=ModelProvider.ANTHROPIC,
         model='claude-3-7-sonnet-20250219',
         api_key=os.getenv('ANTHROPIC_API_KEY'),
+        cache=completion_cache,
+        hedging=HedgingSettings() if hedge else None,
     )
     image_element_client = ModelClient.create_client(
         provider=ModelProvider.OPENAI,
         model='dall-e-3',
         api_key=os.getenv('OPENAI_API_KEY'),
+        image_cache=ImageCache(),
     )
     tikz_element_client = ModelClient.create_client(
         provider=ModelProvider.ANTHROPIC,
         model='claude-3-7-sonnet-20250219',
         api_key=os.getenv('ANTHROPIC_API_KEY'),
+        cache=completion_cache,
     )
 
+    # Prices in dollars, to report the cost of each response (check them
+    # against the providers' current pricing)
+    prices = {
+        'claude-3-7-sonnet-20250219': ModelPrice(
+            input=3.0, output=15.0, cached_input=0.3, cache_write=3.75
+        ),
+        # standard quality, 1024x1024
+        'dall-e-3': ModelPrice(image=0.04),
+    }
+
     # Initialize the task manager
-    task_manager = TaskManager(
+    return TaskManager(
         text_element_client=text_element_client,
         image_element_client=image_element_client,
         tikz_element_client=tikz_element_client,
         task_planner=task_planner,
         refine_tasks=True,
+        stream_plan=True,
+        tikz_compiler=TikzCompiler(
+            cache=TikzCache(),
+            format_dir='tikz_format',
+        ),
+        prices=prices,
     )
 
+
+def build_batch_backend(kind: str, task_manager: TaskManager) -> BatchBackend:
+    """
+    Create the backend for batched runs.
+
+    Parameters
+    ----------
+    kind : str
+        'anthropic', 'openai' or 'local' (a file-based stand-in processing
+        the requests with the task manager's text client)
+    task_manager : TaskManager
+        The task manager the batches are run for
+
+    Returns
+    -------
+    BatchBackend
+        The batch backend
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown, or a provider batch API is asked to run
+        the models of another provider
+    """
+    if kind in ('anthropic', 'openai'):
+        # the planner and the text and TikZ clients make the batched calls
+        clients = {
+            'planner': task_manager.planner.client,
+            'text': task_manager.text_client,
+            'tikz': task_manager.tikz_client,
+        }
+        for name, client in clients.items():
+            if client.provider != kind:
+                raise ValueError(
+                    f'The {kind} batch API cannot run the {name} model '
+                    f'{client.model} of {client.provider}'
+                )
+
+    if kind == 'anthropic':
+        return AnthropicBatchBackend(api_key=os.getenv('ANTHROPIC_API_KEY'))
+    if kind == 'openai':
+        return OpenAIBatchBackend(api_key=os.getenv('OPENAI_API_KEY'))
+    if kind == 'local':
+        return LocalBatchBackend(task_manager.text_client)
+    raise ValueError(f'Unknown batch backend: {kind}')
+
+
+async def respond(hedge: bool = False):
+    task_manager = build_task_manager(hedge=hedge)
+
     # Get user input
     user_prompt = input('Enter your prompt for a multimodal response: ')
 
     print('\nPlanning and generating response...')
-    response = await task_manager.generate_response(user_prompt)
+    response = MultimodalResponse()
+    # the formats share the images, fetched once, and each converts the
+    # TikZ figures with its own rasterizer (e.g. SVG for HTML)
+    assets = AssetManager('images')
+    tikz_compiler = task_manager.tikz_compiler
+    writers = [
+        MarkdownWriter(
+            'response.md',
+            'Multimodal Response',
+            assets=assets,
+            tikz_compiler=tikz_compiler,
+        ),
+        # HtmlWriter(
+        #     'response.html',
+        #     'Multimodal Response',
+        #     assets=assets,
+        #     tikz_compiler=tikz_compiler,
+        # ),
+    ]
 
-    # Display the response in markdown format
+    # Display and save the response in markdown format as it is generated
     print('\nGenerated Response (Markdown):')
     print('-----------------------------')
-    print(response.to_markdown())
+    async for element in task_manager.stream_response(user_prompt, response):
+        print(f'{element.to_markdown()}\n', flush=True)
+        for writer in writers:
+            await writer.write(element)
     print('-----------------------------')
 
-    # Save response
-    save_response_to_markdown(response, 'response.md', 'Multimodal Response')
-    # save_response_to_html(response, 'response.html', 'Multimodal Response')
+    for writer in writers:
+        await writer.close()
+    await assets.close()
+    log.info('Rate limits: %s', rate_limit_stats())
+    usage = response.metadata.usage
+    log.info('Usage: %s, cost: %s', usage.total, usage.cost)
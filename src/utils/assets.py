@@ -0,0 +1,291 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import mimetypes
+import os
+import shutil
+import uuid
+from collections.abc import Awaitable
+from urllib.parse import unquote_to_bytes, urlparse
+
+from PIL import Image
+from pydantic import BaseModel
+
+from src.models.response import MultimodalResponse
+from src.utils.image_downloader import DownloadFailure, ImageDownloader
+from src.utils.tracing import add_counts
+
+# Extension of downloaded images whose URL doesn't tell their type
+default_extension = '.jpg'
+
+
+class Asset(BaseModel):
+    """An image of a response, stored under the hash of its contents."""
+
+    # URL, local path or data URL the asset was resolved from
+    source: str
+    # stored file, None if the asset could not be resolved
+    path: str | None = None
+    error: str | None = None
+
+    @property
+    def filename(self) -> str | None:
+        """Name of the stored file."""
+        return os.path.basename(self.path) if self.path else None
+
+
+def _content_filename(data_path: str, extension: str) -> str:
+    """Name of a file after the SHA-256 of its contents."""
+    with open(data_path, 'rb') as f:
+        digest = hashlib.file_digest(f, 'sha256').hexdigest()
+    return f'{digest[:20]}{extension.lower()}'
+
+
+def _decode_data_url(url: str) -> tuple[bytes, str]:
+    """Contents and file extension of a `data:` URL."""
+    header, _, data = url[len('data:') :].partition(',')
+    media_type, *params = header.split(';')
+    if 'base64' in params:
+        try:
+            contents = base64.b64decode(data, validate=True)
+        except binascii.Error as e:
+            raise ValueError('Invalid base64 data URL') from e
+    else:
+        contents = unquote_to_bytes(data)
+    extension = mimetypes.guess_extension(media_type or 'image/png')
+    return contents, extension or default_extension
+
+
+def _transform_image(
+    path: str, max_width: int | None, format: str | None
+) -> tuple[bytes, str] | None:
+    """
+    Resize and/or re-encode an image with Pillow.
+
+    Returns None if the image is already narrow enough and in the requested
+    format.
+    """
+    with Image.open(path) as image:
+        target_format = (format or image.format or 'PNG').upper()
+        resize = max_width is not None and image.width > max_width
+        if not resize and target_format == image.format:
+            return None
+        if resize:
+            height = round(image.height * max_width / image.width)
+            image = image.resize((max_width, height), Image.LANCZOS)
+        if target_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format=target_format)
+    extension = mimetypes.guess_extension(
+        Image.MIME.get(target_format, 'image/png')
+    )
+    return output.getvalue(), extension or '.png'
+
+
+class AssetManager:
+    """
+    Resolves the images of a response once, for every output format.
+
+    Each image (a remote URL, a local file such as a compiled TikZ figure,
+    or the raw bytes of a `data:` URL) is stored in `store_dir` under the
+    hash of its contents, so images are never fetched twice and distinct
+    images never overwrite each other. Derived variants (resized or
+    re-encoded) are memoized in the same way. Renderers then `export` the
+    stored files next to their output.
+    """
+
+    def __init__(
+        self, store_dir: str, downloader: ImageDownloader | None = None
+    ) -> None:
+        """
+        Initialize the asset manager.
+
+        Parameters
+        ----------
+        store_dir : str
+            Directory to store the assets in. When the outputs share an
+            images directory, storing the assets there avoids copying them.
+        downloader : ImageDownloader | None, optional
+            Downloader to fetch remote images with, by default one owned by
+            the manager (closed by `close`)
+        """
+        self.store_dir = os.path.abspath(store_dir)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._downloader = downloader or ImageDownloader()
+        self._owns_downloader = downloader is None
+        # resolution of each source, and variant of each (asset, options)
+        self._assets: dict[str, asyncio.Future[Asset]] = {}
+        self._variants: dict[tuple, asyncio.Future[Asset]] = {}
+
+    def resolve(self, source: str) -> Awaitable[Asset]:
+        """
+        Resolve and store an image, once per source.
+
+        Parameters
+        ----------
+        source : str
+            URL, local path or `data:` URL of the image
+
+        Returns
+        -------
+        Awaitable[Asset]
+            The stored asset (with `error` set if the image could not be
+            resolved), shared by every caller for the same source
+        """
+        if source in self._assets:
+            add_counts(asset_reuses=1)
+        else:
+            self._assets[source] = asyncio.ensure_future(self._resolve(source))
+        return self._assets[source]
+
+    def prefetch(self, response: MultimodalResponse) -> None:
+        """Start resolving every image of a response in the background."""
+        for element in response.elements:
+            if element.type == 'image':
+                self.resolve(element.url)
+            elif element.type == 'tikz' and element.image_path:
+                self.resolve(element.image_path)
+
+    async def _resolve(self, source: str) -> Asset:
+        staging_path = os.path.join(
+            self.store_dir, f'.staging-{uuid.uuid4().hex}'
+        )
+        try:
+            if source.startswith('data:'):
+                contents, extension = _decode_data_url(source)
+                await asyncio.to_thread(_write, staging_path, contents)
+            elif os.path.exists(source):
+                extension = os.path.splitext(source)[1] or default_extension
+                await asyncio.to_thread(shutil.copyfile, source, staging_path)
+            else:
+                extension = (
+                    os.path.splitext(urlparse(source).path)[1]
+                    or default_extension
+                )
+                await self._downloader.download(source, staging_path)
+            path = await asyncio.to_thread(
+                self._store, staging_path, extension
+            )
+        except Exception as e:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            return Asset(source=source, error=repr(e))
+        return Asset(source=source, path=path)
+
+    def _store(self, staging_path: str, extension: str) -> str:
+        """Move a staged file to its content-hash name, returning the path."""
+        path = os.path.join(
+            self.store_dir, _content_filename(staging_path, extension)
+        )
+        if os.path.exists(path):
+            # same contents as an asset stored before
+            os.remove(staging_path)
+        else:
+            os.replace(staging_path, path)
+        return path
+
+    def variant(
+        self,
+        asset: Asset,
+        max_width: int | None = None,
+        format: str | None = None,
+    ) -> Awaitable[Asset]:
+        """
+        Derive a resized and/or re-encoded version of an asset, once per
+        asset and options.
+
+        Parameters
+        ----------
+        asset : Asset
+            The original asset
+        max_width : int | None, optional
+            Width in pixels to scale wider images down to, by default None
+        format : str | None, optional
+            Pillow format to re-encode the image as (e.g. 'WEBP'), by
+            default the original format
+
+        Returns
+        -------
+        Awaitable[Asset]
+            The variant, or the asset itself if it is unresolved, a vector
+            image or already as requested
+        """
+        key = (asset.path, max_width, format)
+        if key in self._variants:
+            add_counts(asset_reuses=1)
+        else:
+            self._variants[key] = asyncio.ensure_future(
+                self._variant(asset, max_width, format)
+            )
+        return self._variants[key]
+
+    async def _variant(
+        self, asset: Asset, max_width: int | None, format: str | None
+    ) -> Asset:
+        if asset.path is None or asset.path.endswith('.svg'):
+            return asset
+        try:
+            transformed = await asyncio.to_thread(
+                _transform_image, asset.path, max_width, format
+            )
+        except OSError as e:
+            # not an image Pillow can read, keep the original
+            return asset.model_copy(update={'error': repr(e)})
+        if transformed is None:
+            return asset
+        contents, extension = transformed
+        staging_path = os.path.join(
+            self.store_dir, f'.staging-{uuid.uuid4().hex}'
+        )
+        await asyncio.to_thread(_write, staging_path, contents)
+        path = await asyncio.to_thread(self._store, staging_path, extension)
+        return Asset(source=asset.source, path=path)
+
+    def export(self, asset: Asset, images_dir: str) -> str:
+        """
+        Place a stored asset in an output's images directory.
+
+        Parameters
+        ----------
+        asset : Asset
+            A resolved asset
+        images_dir : str
+            The `images` directory next to the output file
+
+        Returns
+        -------
+        str
+            Path of the asset relative to the output file
+        """
+        target = os.path.join(images_dir, asset.filename)
+        # files are named by their contents, so an existing one is the same
+        if not os.path.exists(target):
+            try:
+                os.link(asset.path, target)
+            except OSError:
+                shutil.copyfile(asset.path, target)
+        return f'images/{asset.filename}'
+
+    @property
+    def failures(self) -> list[DownloadFailure]:
+        """The images that could not be resolved so far."""
+        return [
+            DownloadFailure(url=source, path=self.store_dir, error=asset.error)
+            for source, future in self._assets.items()
+            if future.done() and (asset := future.result()).path is None
+        ]
+
+    async def close(self) -> None:
+        """Wait for pending resolutions and close the owned downloader."""
+        pending = [*self._assets.values(), *self._variants.values()]
+        await asyncio.gather(*pending, return_exceptions=True)
+        if self._owns_downloader:
+            await self._downloader.close()
+
+
+def _write(path: str, contents: bytes) -> None:
+    with open(path, 'wb') as f:
+        f.write(contents)
@@ -0,0 +1,37 @@
+import os
+from pathlib import Path
+
+
+def evict_lru(cache_dir: Path, max_bytes: int, keep: Path) -> None:
+    """
+    Remove the least recently modified files of a cache directory until
+    their total size is under `max_bytes`.
+
+    Parameters
+    ----------
+    cache_dir : Path
+        Directory holding the cached files
+    max_bytes : int
+        Maximum total size of the files
+    keep : Path
+        File that must not be removed (the one just stored)
+    """
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if path == str(keep):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
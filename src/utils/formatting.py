@@ -1,9 +1,16 @@
+import logging
 import re
 import os
-import requests
-from urllib.parse import urlparse
+from abc import ABC, abstractmethod
+from html import escape
 
-from src.models.response import MultimodalResponse
+from src.models.response import MultimodalResponse, ResponseElement
+from src.utils.assets import Asset, AssetManager
+from src.utils.image_downloader import DownloadFailure, ImageDownloader
+from src.utils.rasterizers import rasterizer_for_target
+from src.utils.tikz_compiler import TikzCompiler
+
+log = logging.getLogger(__name__)
 
 
 def extract_code_blocks(text: str) -> str:
@@ -20,77 +27,202 @@ def extract_code_blocks(text: str) -> str:
     return re.sub(pattern, replace_block, text, flags=re.DOTALL)
 
 
-def download_image(url: str, save_path: str) -> bool:
-    """
-    Download an image from a URL and save it locally.
+def read_svg(svg_path: str) -> str:
+    """Read an SVG file for inline embedding, without its XML declaration."""
+    with open(svg_path, encoding='utf-8') as f:
+        svg = f.read()
+    return re.sub(r'^<\?xml[^>]*\?>\s*', '', svg)
 
-    Parameters
-    ----------
-    url : str
-        The image URL
-    save_path : str
-        Path to save the downloaded image
 
-    Returns
-    -------
-    bool
-        True if download succeeded, False otherwise
-    """
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        return True
-    except Exception:
-        # If download fails for any reason, return False
-        return False
-
-
-def save_response_to_html(
-    response: MultimodalResponse, filepath: str, title: str | None = None
-) -> None:
+class ResponseWriter(ABC):
     """
-    Save a multimodal response as an HTML file.
+    Base class for writing a response to a file element by element.
 
-    Parameters
-    ----------
-        response : MultimodalResponse
-            The MultimodalResponse to save
-        filepath : str
-            Path where the HTML file should be saved
-        title : str
-            Optional title for the HTML page. None by default.
+    Each element is appended (and flushed) as soon as it is written, so the
+    file can be followed while the response is still being generated, e.g.
+    from `TaskManager.stream_response`. Its images are stored in an `images`
+    directory next to the file, through an asset manager. Use the writer as
+    an async context manager, or `close` it to finish the file.
     """
-    # Create images directory next to the HTML file
-    html_dir = os.path.dirname(os.path.abspath(filepath))
-    images_dir = os.path.join(html_dir, 'images')
-    os.makedirs(images_dir, exist_ok=True)
-
-    html = ['<!DOCTYPE html>', '<html>', '<head>']
-    html.append("<meta charset='utf-8'>")
-    html.append(
-        "<meta name='viewport' content='width=device-width, initial-scale=1'>"
-    )
-    html.append(f'<title>{title or "Multimodal Response"}</title>')
-    html.append('<style>')
-    html.append(
-        'body { font-family: Arial, sans-serif; line-height: 1.6; max-width: 800px; margin: 0 auto; padding: 20px; }'
-    )
-    html.append('img { max-width: 100%; height: auto; }')
-    html.append(
-        '.caption { font-style: italic; color: #666; margin-top: 5px; }'
-    )
-    html.append('</style>')
-    html.append('</head>')
-    html.append('<body>')
 
-    if title:
-        html.append(f'<h1>{title}</h1>')
-
-    for i, element in enumerate(response.elements):
+    # output format, selecting the rasterizer of TikZ figures
+    target: str
+
+    def __init__(
+        self,
+        filepath: str,
+        title: str | None = None,
+        assets: AssetManager | None = None,
+        downloader: ImageDownloader | None = None,
+        max_image_width: int | None = None,
+        tikz_compiler: TikzCompiler | None = None,
+    ) -> None:
+        """
+        Create the file and write its header.
+
+        Parameters
+        ----------
+        filepath : str
+            Path where the file should be saved
+        title : str | None, optional
+            Title of the document, by default None
+        assets : AssetManager | None, optional
+            Asset manager to get the images from. Pass the same one when
+            writing a response in several formats so that its images are
+            only fetched and processed once. By default, a new one for this
+            file.
+        downloader : ImageDownloader | None, optional
+            Downloader for a new asset manager, by default a new one
+        max_image_width : int | None, optional
+            Width in pixels to scale wider raster images down to, by default
+            None (no scaling)
+        tikz_compiler : TikzCompiler | None, optional
+            Compiler to convert the TikZ figures again with the rasterizer
+            suited to this format (see `rasterizer_for_target`), by default
+            None, which uses the images compiled with the response
+        """
+        output_dir = os.path.dirname(os.path.abspath(filepath))
+        self.images_dir = os.path.join(output_dir, 'images')
+        os.makedirs(self.images_dir, exist_ok=True)
+        self.title = title
+        self.max_image_width = max_image_width
+        self.tikz_compiler = tikz_compiler
+        self._owns_assets = assets is None
+        self.assets = assets or AssetManager(self.images_dir, downloader)
+        self._file = open(filepath, 'w', encoding='utf-8')
+        self._append(self._header())
+
+    def _append(self, text: str) -> None:
+        self._file.write(text)
+        self._file.flush()
+
+    async def _image(self, source: str) -> tuple[str, Asset]:
+        """
+        Resolve an image through the asset manager and export it next to
+        the file.
+
+        Returns
+        -------
+        tuple[str, Asset]
+            Source to reference the image with (the original one if it
+            could not be resolved), and its asset
+        """
+        asset = await self.assets.resolve(source)
+        if asset.path is None:
+            # link the original instead
+            return source, asset
+        if self.max_image_width is not None:
+            asset = await self.assets.variant(
+                asset, max_width=self.max_image_width
+            )
+        return self.assets.export(asset, self.images_dir), asset
+
+    async def _tikz_image(self, element: ResponseElement) -> str | None:
+        """
+        Image of a TikZ figure for this format, falling back to the one
+        compiled with the response (e.g. if the format's rasterizer is not
+        installed), or None if the figure did not compile.
+        """
+        if self.tikz_compiler is not None:
+            image_path = await self.tikz_compiler.compile(
+                element.code, rasterizer_for_target(self.target)
+            )
+            if image_path is not None:
+                return image_path
+        return element.image_path
+
+    @abstractmethod
+    def _header(self) -> str:
+        """Text at the start of the file."""
+        pass
+
+    @abstractmethod
+    async def _render(self, element: ResponseElement) -> str:
+        """Text of an element, including its separator."""
+        pass
+
+    @abstractmethod
+    def _footer(self) -> str:
+        """Text at the end of the file."""
+        pass
+
+    async def write(self, element: ResponseElement) -> None:
+        """Append an element to the file."""
+        self._append(await self._render(element))
+
+    async def write_response(
+        self, response: MultimodalResponse
+    ) -> list[DownloadFailure]:
+        """
+        Write every element of a response and close the file.
+
+        The images are all resolved concurrently while the elements before
+        them are written.
+        """
+        self.assets.prefetch(response)
+        for element in response.elements:
+            await self.write(element)
+        return await self.close()
+
+    async def close(self) -> list[DownloadFailure]:
+        """
+        Finish and close the file.
+
+        Returns
+        -------
+        list[DownloadFailure]
+            The images that could not be downloaded
+        """
+        if self._file.closed:
+            return self.assets.failures
+        self._append(self._footer())
+        self._file.close()
+        failures = self.assets.failures
+        for failure in failures:
+            log.warning(
+                'Could not download image %s: %s', failure.url, failure.error
+            )
+        if self._owns_assets:
+            await self.assets.close()
+        return failures
+
+    async def __aenter__(self) -> 'ResponseWriter':
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+
+class HtmlWriter(ResponseWriter):
+    """Writes a response to an HTML page element by element."""
+
+    target = 'html'
+
+    def _header(self) -> str:
+        html = ['<!DOCTYPE html>', '<html>', '<head>']
+        html.append("<meta charset='utf-8'>")
+        html.append(
+            "<meta name='viewport' content='width=device-width, initial-scale=1'>"
+        )
+        html.append(f'<title>{self.title or "Multimodal Response"}</title>')
+        html.append('<style>')
+        html.append(
+            'body { font-family: Arial, sans-serif; line-height: 1.6; max-width: 800px; margin: 0 auto; padding: 20px; }'
+        )
+        html.append('img { max-width: 100%; height: auto; }')
+        html.append(
+            '.caption { font-style: italic; color: #666; margin-top: 5px; }'
+        )
+        html.append('</style>')
+        html.append('</head>')
+        html.append('<body>')
+
+        if self.title:
+            html.append(f'<h1>{self.title}</h1>')
+        return '\n'.join(html) + '\n'
+
+    async def _render(self, element: ResponseElement) -> str:
+        html = []
         if element.type == 'text':
             # Simple Markdown-like conversion for paragraphs
             paragraphs = element.content.split('\n\n')
@@ -99,23 +231,7 @@ def save_response_to_html(
                     html.append(f'<p>{p}</p>')
         elif element.type == 'image':
             alt = element.alt_text or 'Generated image'
-
-            # Extract filename from URL or create a unique one
-            url_path = urlparse(element.url).path
-            filename = os.path.basename(url_path)
-            if not filename or '.' not in filename:
-                # Create a filename with index and default extension
-                filename = f'image_{i}.jpg'
-
-            # Full path for saving the image
-            image_path = os.path.join(images_dir, filename)
-            # Relative path for HTML reference
-            image_rel_path = f'images/{filename}'
-
-            # Download the image and use local path if successful
-            img_src = element.url
-            if download_image(element.url, image_path):
-                img_src = image_rel_path
+            img_src, _ = await self._image(element.url)
 
             html.append('<figure>')
             html.append(f"<img src='{img_src}' alt='{alt}'>")
@@ -124,72 +240,159 @@ def save_response_to_html(
                     f"<figcaption class='caption'>{element.caption}</figcaption>"
                 )
             html.append('</figure>')
+        elif element.type == 'tikz':
+            alt = element.alt_text or 'Generated diagram'
+
+            html.append('<figure>')
+            image_path = await self._tikz_image(element)
+            if not image_path:
+                # compilation failed, show the source instead
+                html.append(f'<pre><code>{escape(element.code)}</code></pre>')
+            else:
+                img_src, asset = await self._image(image_path)
+                if asset.path is not None and asset.path.endswith('.svg'):
+                    # vector output is embedded directly
+                    html.append(
+                        f"<div role='img' aria-label='{alt}'>"
+                        f'{read_svg(asset.path)}</div>'
+                    )
+                else:
+                    html.append(f"<img src='{img_src}' alt='{alt}'>")
+            if element.caption:
+                html.append(
+                    f"<figcaption class='caption'>{element.caption}</figcaption>"
+                )
+            html.append('</figure>')
+        return ''.join(f'{line}\n' for line in html)
+
+    def _footer(self) -> str:
+        return '</body>\n</html>'
 
-    html.append('</body>')
-    html.append('</html>')
 
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(html))
+class MarkdownWriter(ResponseWriter):
+    """Writes a response to a Markdown document element by element."""
 
+    target = 'markdown'
 
-def save_response_to_markdown(
-    response: MultimodalResponse, filepath: str, title: str | None = None
-) -> None:
+    def _header(self) -> str:
+        # Add title if provided
+        return f'# {self.title}\n\n' if self.title else ''
+
+    async def _render(self, element: ResponseElement) -> str:
+        if element.type == 'text':
+            # Add text content directly
+            return f'{element.content}\n\n'
+
+        if element.type == 'image':
+            alt = element.alt_text or 'Generated image'
+            img_src, _ = await self._image(element.url)
+            # Add image in markdown format
+            image_md = f'![{alt}]({img_src})'
+        else:
+            alt = element.alt_text or 'Generated diagram'
+            if image_path := await self._tikz_image(element):
+                img_src, _ = await self._image(image_path)
+                image_md = f'![{alt}]({img_src})'
+            else:
+                # compilation failed, show the source instead
+                image_md = f'```latex\n{element.code}\n```'
+
+        # Add caption if provided
+        if element.caption:
+            image_md += f'\n\n_{element.caption}_'
+        return f'{image_md}\n\n'
+
+    def _footer(self) -> str:
+        return ''
+
+
+async def save_response_to_html(
+    response: MultimodalResponse,
+    filepath: str,
+    title: str | None = None,
+    assets: AssetManager | None = None,
+    downloader: ImageDownloader | None = None,
+    max_image_width: int | None = None,
+    tikz_compiler: TikzCompiler | None = None,
+) -> list[DownloadFailure]:
     """
-    Save a multimodal response as a Markdown file.
+    Save a multimodal response as an HTML file.
+
+    The images are resolved concurrently while the rest of the page is
+    rendered. Images that could not be downloaded are linked to instead.
 
     Parameters
     ----------
         response : MultimodalResponse
             The MultimodalResponse to save
         filepath : str
-            Path where the Markdown file should be saved
+            Path where the HTML file should be saved
         title : str
-            Optional title for the Markdown document. None by default.
-    """
-    # Create images directory next to the Markdown file
-    md_dir = os.path.dirname(os.path.abspath(filepath))
-    images_dir = os.path.join(md_dir, 'images')
-    os.makedirs(images_dir, exist_ok=True)
-
-    markdown = []
-
-    # Add title if provided
-    if title:
-        markdown.append(f'# {title}\n')
-
-    for i, element in enumerate(response.elements):
-        if element.type == 'text':
-            # Add text content directly
-            markdown.append(f'{element.content}\n')
-        elif element.type == 'image':
-            # Extract filename from URL or create a unique one
-            url_path = urlparse(element.url).path
-            filename = os.path.basename(url_path)
-            if not filename or '.' not in filename:
-                # Create a filename with index and default extension
-                filename = f'image_{i}.jpg'
-
-            # Full path for saving the image
-            image_path = os.path.join(images_dir, filename)
-            # Relative path for Markdown reference
-            image_rel_path = f'images/{filename}'
-
-            # Download the image and use local path if successful
-            img_src = element.url
-            if download_image(element.url, image_path):
-                img_src = image_rel_path
+            Optional title for the HTML page. None by default.
+        assets : AssetManager | None
+            Asset manager to get the images from (see `ResponseWriter`). By
+            default, a new one for this page.
+        downloader : ImageDownloader | None
+            Downloader for a new asset manager. By default, a new one.
+        max_image_width : int | None
+            Width in pixels to scale wider raster images down to. None (no
+            scaling) by default.
+        tikz_compiler : TikzCompiler | None
+            Compiler to convert the TikZ figures again for this format (see
+            `ResponseWriter`). None by default.
 
-            # Add image in markdown format
-            alt = element.alt_text or 'Generated image'
-            image_md = f'![{alt}]({img_src})'
+    Returns
+    -------
+    list[DownloadFailure]
+        The images that could not be downloaded
+    """
+    writer = HtmlWriter(
+        filepath, title, assets, downloader, max_image_width, tikz_compiler
+    )
+    return await writer.write_response(response)
+
+
+async def save_response_to_markdown(
+    response: MultimodalResponse,
+    filepath: str,
+    title: str | None = None,
+    assets: AssetManager | None = None,
+    downloader: ImageDownloader | None = None,
+    max_image_width: int | None = None,
+    tikz_compiler: TikzCompiler | None = None,
+) -> list[DownloadFailure]:
+    """
+    Save a multimodal response as a Markdown file.
 
-            # Add caption if provided
-            if element.caption:
-                image_md += f'\n\n_{element.caption}_'
+    The images are resolved concurrently while the rest of the document is
+    rendered. Images that could not be downloaded are linked to instead.
 
-            markdown.append(f'{image_md}\n')
+    Parameters
+    ----------
+        response : MultimodalResponse
+            The MultimodalResponse to save
+        filepath : str
+            Path where the Markdown file should be saved
+        title : str
+            Optional title for the Markdown document. None by default.
+        assets : AssetManager | None
+            Asset manager to get the images from (see `ResponseWriter`). By
+            default, a new one for this document.
+        downloader : ImageDownloader | None
+            Downloader for a new asset manager. By default, a new one.
+        max_image_width : int | None
+            Width in pixels to scale wider raster images down to. None (no
+            scaling) by default.
+        tikz_compiler : TikzCompiler | None
+            Compiler to convert the TikZ figures again for this format (see
+            `ResponseWriter`). None by default.
 
-    # Write markdown content to file
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(markdown))
+    Returns
+    -------
+    list[DownloadFailure]
+        The images that could not be downloaded
+    """
+    writer = MarkdownWriter(
+        filepath, title, assets, downloader, max_image_width, tikz_compiler
+    )
+    return await writer.write_response(response)
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+
+from src.utils.disk_cache import evict_lru
+
+# File extensions images are stored with
+image_extensions = ('.png', '.jpg', '.jpeg', '.webp', '.gif')
+
+
+class ImageCache:
+    """
+    Disk cache for generated images.
+
+    Images are stored as `<key><extension>`, where the key is a hash of the
+    generation parameters (model, size, quality and prompt). The cache is
+    bounded in total bytes and evicts the least recently used images first
+    (a hit refreshes the file's modification time).
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = 'image_cache',
+        max_bytes: int = 1024 * 1024 * 1024,
+    ) -> None:
+        """
+        Initialize the cache.
+
+        Parameters
+        ----------
+        cache_dir : str, optional
+            Directory holding the cached images, by default 'image_cache'
+        max_bytes : int, optional
+            Maximum total size of the cached images, by default 1 GiB
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(model: str, size: str, quality: str, prompt: str) -> str:
+        """
+        Compute the cache key of a generated image.
+
+        Parameters
+        ----------
+        model : str
+            Image generation model
+        size : str
+            Size specification for the image
+        quality : str
+            Quality specification for the image
+        prompt : str
+            Final (refined) image prompt
+
+        Returns
+        -------
+        str
+            Hex digest identifying the image
+        """
+        payload = json.dumps([model, size, quality, prompt])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """
+        Look up a generated image.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from `key`
+
+        Returns
+        -------
+        str | None
+            Path to the cached image, or None on a miss
+        """
+        for extension in image_extensions:
+            path = self.cache_dir / f'{key}{extension}'
+            try:
+                # mark as recently used
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            self.hits += 1
+            self.bytes_saved += path.stat().st_size
+            return str(path)
+
+        self.misses += 1
+        return None
+
+    def staging_path(self, extension: str = '.png') -> str:
+        """
+        Get a fresh path to download an image to before `put`.
+
+        Staged files are kept in a subdirectory, out of reach of eviction.
+        """
+        staging_dir = self.cache_dir / 'staging'
+        os.makedirs(staging_dir, exist_ok=True)
+        return str(staging_dir / f'{uuid.uuid4().hex}{extension}')
+
+    def put(self, key: str, image_path: str) -> str:
+        """
+        Move a downloaded image into the cache.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from `key`
+        image_path : str
+            Path to the downloaded image, e.g. from `staging_path`
+
+        Returns
+        -------
+        str
+            Path to the image inside the cache
+        """
+        path = self.cache_dir / f'{key}{Path(image_path).suffix}'
+        os.replace(image_path, path)
+        evict_lru(self.cache_dir, self.max_bytes, keep=path)
+        return str(path)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Hit, miss and bytes-saved counters of the cache."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes_saved': self.bytes_saved,
+        }
@@ -0,0 +1,117 @@
+import asyncio
+import importlib.util
+import os
+
+import httpx
+from pydantic import BaseModel
+
+from src.utils.tracing import span
+
+
+class DownloadFailure(BaseModel):
+    """An image that could not be downloaded."""
+
+    url: str
+    path: str
+    error: str
+
+
+class ImageDownloader:
+    """
+    Downloads images concurrently over one pooled HTTP client.
+
+    Connections are kept alive between downloads (and HTTP/2 is used if the
+    `h2` package is installed), at most `concurrency` downloads run at once
+    and each is streamed to disk. Share one downloader across responses to
+    reuse its connections, and `close` it when done.
+    """
+
+    def __init__(self, concurrency: int = 8, timeout: float = 30.0) -> None:
+        """
+        Initialize the downloader.
+
+        Parameters
+        ----------
+        concurrency : int, optional
+            Maximum number of downloads at once, by default 8
+        timeout : float, optional
+            Seconds allowed to connect and between received chunks of each
+            download, by default 30
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The pooled HTTP client, created on first use."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=self.timeout,
+                http2=importlib.util.find_spec('h2') is not None,
+                limits=httpx.Limits(max_connections=self.concurrency),
+            )
+        return self._client
+
+    async def download(self, url: str, path: str) -> None:
+        """
+        Download an image to a file.
+
+        The image is written to a temporary file first, so that `path` only
+        ever holds a complete image.
+
+        Raises
+        ------
+        httpx.HTTPError
+            If the request fails or times out
+        """
+        partial_path = f'{path}.part'
+        async with self._semaphore:
+            with span('image_download') as trace:
+                try:
+                    async with self.client.stream('GET', url) as response:
+                        response.raise_for_status()
+                        with open(partial_path, 'wb') as f:
+                            async for chunk in response.aiter_bytes():
+                                f.write(chunk)
+                except BaseException:
+                    if os.path.exists(partial_path):
+                        os.remove(partial_path)
+                    raise
+                os.replace(partial_path, path)
+                if trace is not None:
+                    trace.attributes['bytes'] = os.path.getsize(path)
+
+    async def download_many(
+        self, downloads: list[tuple[str, str]]
+    ) -> list[DownloadFailure]:
+        """
+        Download images concurrently.
+
+        Parameters
+        ----------
+        downloads : list[tuple[str, str]]
+            URL and destination path of each image
+
+        Returns
+        -------
+        list[DownloadFailure]
+            The downloads that failed
+        """
+        results = await asyncio.gather(
+            *(self.download(url, path) for url, path in downloads),
+            return_exceptions=True,
+        )
+        return [
+            DownloadFailure(url=url, path=path, error=repr(result))
+            for (url, path), result in zip(downloads, results, strict=True)
+            if isinstance(result, Exception)
+        ]
+
+    async def close(self) -> None:
+        """Close the pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
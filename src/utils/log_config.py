@@ -0,0 +1,124 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from collections.abc import Sized
+from typing import Any
+
+from src.models.settings import LoggingSettings
+
+# Logger of the application, which the module loggers propagate to
+app_logger = logging.getLogger('src')
+
+_settings = LoggingSettings()
+_listener: logging.handlers.QueueListener | None = None
+_encoder = json.JSONEncoder(default=str)
+
+
+class Payload:
+    """
+    A prompt, plan or completion to log, rendered only if the record is
+    emitted, and then truncated or left out (see `LoggingSettings`).
+
+    Use it as an argument of a `%`-style message, e.g.
+    `log.info('Plan: %s', payload(plan))`.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+    def _text(self, limit: int | None = None) -> str:
+        """The value as JSON, stopping after `limit` characters if given."""
+        if isinstance(self.value, str):
+            return self.value
+        try:
+            if limit is None:
+                return json.dumps(self.value, default=str)
+            # iterencode renders lazily: only the logged part is serialized
+            chunks = []
+            size = 0
+            for chunk in _encoder.iterencode(self.value):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > limit:
+                    break
+            return ''.join(chunks)
+        except (TypeError, ValueError):
+            return repr(self.value)
+
+    def _size(self) -> str:
+        if isinstance(self.value, str):
+            return f'{len(self.value)} chars'
+        if isinstance(self.value, Sized):
+            return f'{type(self.value).__name__} of length {len(self.value)}'
+        return type(self.value).__name__
+
+    def __str__(self) -> str:
+        if _settings.full_payloads:
+            return self._text()
+        # sampled out payloads are not rendered at all
+        if random.random() >= _settings.payload_sample_rate:
+            return f'<{self._size()}>'
+        limit = _settings.payload_limit
+        text = self._text(limit)
+        if len(text) <= limit:
+            return text
+        if isinstance(self.value, str):
+            return f'{text[:limit]}... <{len(text) - limit} more chars>'
+        return f'{text[:limit]}... <truncated>'
+
+
+def payload(value: Any) -> Payload:
+    """Wrap a potentially large value to log (see `Payload`)."""
+    return Payload(value)
+
+
+def configure_logging(
+    settings: LoggingSettings | None = None,
+) -> logging.handlers.QueueListener:
+    """
+    Send the application's logs to a file from a background thread.
+
+    Records are queued by the logging call and written by a listener
+    thread, so the event loop never waits on the file. Calling it again
+    replaces the previous configuration.
+
+    Parameters
+    ----------
+    settings : LoggingSettings | None, optional
+        File, level and payload policy, by default `LoggingSettings()`
+
+    Returns
+    -------
+    logging.handlers.QueueListener
+        The listener writing the records (stopped by `shutdown_logging`)
+    """
+    global _settings, _listener
+    shutdown_logging()
+    _settings = settings or LoggingSettings()
+
+    file_handler = logging.FileHandler(_settings.path, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(_settings.format))
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, file_handler)
+    _listener.start()
+
+    app_logger.setLevel(_settings.level)
+    app_logger.addHandler(logging.handlers.QueueHandler(records))
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """Write the queued records and detach the log file."""
+    global _listener
+    for handler in list(app_logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            app_logger.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import uuid
+from pathlib import Path
+
+# Worker document: the preamble is processed as soon as the worker starts,
+# then TeX blocks reading the figure body from stdin
+worker_content = (
+    '{preamble}'
+    '\\begin{{document}}\n'
+    '\\csname @@input\\endcsname /dev/stdin \n'
+    '\\end{{document}}\n'
+)
+
+
+class WorkerExitedError(RuntimeError):
+    """
+    The worker taken from the pool had exited while idle, or could not be
+    started.
+    """
+
+
+class _Worker:
+    def __init__(
+        self, process: asyncio.subprocess.Process, pdf_path: Path
+    ) -> None:
+        self.process = process
+        self.pdf_path = pdf_path
+
+
+class PdflatexWorkerPool:
+    """
+    Pool of warm pdflatex processes.
+
+    Each worker is a pdflatex run that has already loaded the preamble and
+    executed `\\begin{document}`, and is blocked reading the figure body
+    from its stdin. A compile takes an idle worker, writes the body and
+    closes stdin, while a replacement worker is started in the background.
+
+    Workers read the body from `/dev/stdin`, so the pool only works on POSIX
+    systems.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        work_dir: str,
+        pdflatex_cmd: str,
+        preamble: str,
+        format_path: str | None = None,
+    ) -> None:
+        """
+        Initialize the pool. Workers are started on first use.
+
+        Parameters
+        ----------
+        size : int
+            Number of warm workers to keep ready
+        work_dir : str
+            Directory for the worker documents and their output
+        pdflatex_cmd : str
+            The pdflatex executable
+        preamble : str
+            LaTeX preamble loaded by every worker (empty if it is part of
+            `format_path`)
+        format_path : str | None, optional
+            Precompiled format to start the workers from, by default None
+        """
+        self.size = size
+        self.work_dir = Path(work_dir)
+        self.pdflatex_cmd = pdflatex_cmd
+        self.preamble = preamble
+        self.format_path = format_path
+        self._idle = asyncio.Queue()
+        self._spawning = set()
+        self._started = False
+        self._closed = False
+
+    async def _spawn(self) -> None:
+        """
+        Start a worker and add it to the idle queue, or the error if it
+        could not be started.
+        """
+        job_name = f'worker-{str(uuid.uuid4())[:8]}'
+        tex_path = self.work_dir / f'{job_name}.tex'
+        args = [self.pdflatex_cmd, '-interaction=nonstopmode']
+        if self.format_path is not None:
+            args.append(f'-fmt={self.format_path}')
+        args += ['-output-directory', str(self.work_dir), str(tex_path)]
+
+        try:
+            with open(tex_path, 'w') as f:
+                f.write(worker_content.format(preamble=self.preamble))
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=asyncio.subprocess.PIPE,
+                # the log file has the details; an idle worker must not
+                # block on a full stdout pipe
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except OSError as e:
+            # e.g. pdflatex is not installed: hand it to a waiting compile
+            self._idle.put_nowait(e)
+            return
+        worker = _Worker(process, self.work_dir / f'{job_name}.pdf')
+        if self._closed:
+            await self._kill(worker)
+        else:
+            self._idle.put_nowait(worker)
+
+    def _spawn_in_background(self) -> None:
+        task = asyncio.create_task(self._spawn())
+        self._spawning.add(task)
+        task.add_done_callback(self._spawning.discard)
+
+    async def _acquire(self) -> _Worker:
+        if not self._started:
+            self._started = True
+            os.makedirs(self.work_dir, exist_ok=True)
+            for _ in range(self.size):
+                self._spawn_in_background()
+
+        worker = await self._idle.get()
+        self._spawn_in_background()
+        if isinstance(worker, OSError):
+            raise WorkerExitedError(
+                f'{self.pdflatex_cmd} worker could not start: {worker!r}'
+            ) from worker
+        if worker.process.returncode is not None:
+            # worker died while idle (e.g. killed, or a broken preamble)
+            raise WorkerExitedError(
+                f'{self.pdflatex_cmd} worker exited with status '
+                f'{worker.process.returncode}'
+            )
+        return worker
+
+    @staticmethod
+    async def _kill(worker: _Worker) -> None:
+        if worker.process.returncode is None:
+            worker.process.kill()
+            await worker.process.wait()
+
+    async def compile(self, tikz_code: str, pdf_path: Path) -> None:
+        """
+        Compile a figure body on a warm worker.
+
+        Parameters
+        ----------
+        tikz_code : str
+            The TikZ code to compile
+        pdf_path : Path
+            Where to move the resulting PDF
+
+        Raises
+        ------
+        WorkerExitedError
+            If the worker exited before it was used or could not be started,
+            so the figure was not compiled
+        subprocess.CalledProcessError
+            If pdflatex exits with a non-zero status
+        """
+        worker = await self._acquire()
+        try:
+            await worker.process.communicate(f'{tikz_code}\n'.encode('utf-8'))
+        except BaseException:
+            # cancelled (or timed out): don't leave the process running
+            await self._kill(worker)
+            raise
+
+        if worker.process.returncode != 0:
+            raise subprocess.CalledProcessError(
+                worker.process.returncode, [self.pdflatex_cmd]
+            )
+        shutil.move(worker.pdf_path, pdf_path)
+
+    async def close(self) -> None:
+        """Stop all idle workers."""
+        self._closed = True
+        for task in list(self._spawning):
+            await task
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            if isinstance(worker, _Worker):
+                await self._kill(worker)
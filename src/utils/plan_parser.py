@@ -0,0 +1,110 @@
+import json
+from typing import Any
+
+
+class SubtaskStreamParser:
+    """
+    Incrementally parse the `subtasks` array of a streamed plan.
+
+    The planner is asked for a JSON object of the form
+    `{"subtasks": [{...}, {...}]}`. Chunks of that text are fed in as they
+    arrive from the provider, and every subtask object is returned as soon
+    as its closing brace has been seen, without waiting for the rest of the
+    plan.
+    """
+
+    def __init__(self, key: str = 'subtasks') -> None:
+        """
+        Initialize the parser.
+
+        Parameters
+        ----------
+        key : str, optional
+            Key of the array holding the subtasks, by default 'subtasks'
+        """
+        self.key = f'"{key}"'
+        self.buffer = ''
+        self.position = 0
+        self.in_array = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+
+    def feed(self, chunk: str) -> list[dict[str, Any]]:
+        """
+        Consume a chunk of plan text.
+
+        Parameters
+        ----------
+        chunk : str
+            Next piece of the streamed plan
+
+        Returns
+        -------
+        list[dict[str, Any]]
+            Subtasks completed by this chunk (possibly empty)
+
+        Raises
+        ------
+        json.JSONDecodeError
+            If a completed subtask object is not valid JSON
+        """
+        self.buffer += chunk
+        subtasks = []
+
+        if not self.in_array and not self.finished:
+            key_index = self.buffer.find(self.key, self.position)
+            if key_index == -1:
+                # keep enough of the tail to match a key split across chunks
+                self.position = max(0, len(self.buffer) - len(self.key))
+                return subtasks
+            array_index = self.buffer.find('[', key_index + len(self.key))
+            if array_index == -1:
+                self.position = key_index
+                return subtasks
+            self.in_array = True
+            self.position = array_index + 1
+
+        while self.in_array and self.position < len(self.buffer):
+            char = self.buffer[self.position]
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                if self.depth == 0:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    subtasks.append(
+                        json.loads(
+                            self.buffer[self.object_start : self.position + 1]
+                        )
+                    )
+                    self.object_start = None
+            elif char == ']' and self.depth == 0:
+                self.in_array = False
+                self.finished = True
+
+            self.position += 1
+
+        # drop text that has already been parsed
+        if self.object_start is None:
+            self.buffer = self.buffer[self.position :]
+            self.position = 0
+        else:
+            self.buffer = self.buffer[self.object_start :]
+            self.position -= self.object_start
+            self.object_start = 0
+
+        return subtasks
@@ -0,0 +1,176 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+
+class Rasterizer(ABC):
+    """Base class for converting a compiled TikZ PDF into an image."""
+
+    extension: str
+
+    @property
+    @abstractmethod
+    def settings(self) -> str:
+        """
+        Description of the backend and its settings.
+
+        Used as part of the cache key of compiled figures, so it must change
+        whenever the output would.
+        """
+        pass
+
+    @abstractmethod
+    def command(
+        self, pdf_path: Path, output_path: Path, page: int = 1
+    ) -> list[str]:
+        """
+        Build the command converting one page of a PDF.
+
+        Parameters
+        ----------
+        pdf_path : Path
+            The compiled PDF
+        output_path : Path
+            Where to write the image (with `extension` as its suffix)
+        page : int, optional
+            Page to convert (1-based), by default 1
+
+        Returns
+        -------
+        list[str]
+            Command and arguments to execute
+        """
+        pass
+
+
+class ImageMagickRasterizer(Rasterizer):
+    """Rasterize with ImageMagick `convert` (through Ghostscript)."""
+
+    def __init__(
+        self, density: int = 300, quality: int = 90, format: str = 'png'
+    ) -> None:
+        self.density = density
+        self.quality = quality
+        self.extension = f'.{format}'
+
+    @property
+    def settings(self) -> str:
+        return (
+            f'convert:{self.extension}:density={self.density}'
+            f':quality={self.quality}'
+        )
+
+    def command(
+        self, pdf_path: Path, output_path: Path, page: int = 1
+    ) -> list[str]:
+        return [
+            'convert',
+            '-density',
+            str(self.density),
+            # ImageMagick page indices start at 0
+            f'{pdf_path}[{page - 1}]',
+            '-quality',
+            str(self.quality),
+            str(output_path),
+        ]
+
+
+class PdftocairoRasterizer(Rasterizer):
+    """Rasterize with poppler's `pdftocairo` (or `pdftoppm`)."""
+
+    def __init__(
+        self,
+        density: int = 300,
+        format: str = 'png',
+        executable: str = 'pdftocairo',
+    ) -> None:
+        """
+        Initialize the rasterizer.
+
+        Parameters
+        ----------
+        density : int, optional
+            Resolution in DPI, by default 300
+        format : str, optional
+            Output format ('png' or 'jpeg'), by default 'png'
+        executable : str, optional
+            'pdftocairo' or 'pdftoppm', which take the same options here,
+            by default 'pdftocairo'
+        """
+        self.density = density
+        self.format = format
+        self.executable = executable
+        self.extension = '.jpg' if format == 'jpeg' else f'.{format}'
+
+    @property
+    def settings(self) -> str:
+        return f'{self.executable}:{self.extension}:density={self.density}'
+
+    def command(
+        self, pdf_path: Path, output_path: Path, page: int = 1
+    ) -> list[str]:
+        # with -singlefile, poppler appends the extension to the output root
+        return [
+            self.executable,
+            f'-{self.format}',
+            '-r',
+            str(self.density),
+            '-f',
+            str(page),
+            '-l',
+            str(page),
+            '-singlefile',
+            str(pdf_path),
+            str(output_path.with_suffix('')),
+        ]
+
+
+class DvisvgmRasterizer(Rasterizer):
+    """
+    Convert to vector SVG with `dvisvgm`.
+
+    Glyphs are converted to paths so that the SVG is self-contained and can
+    be embedded directly in HTML.
+    """
+
+    extension = '.svg'
+
+    @property
+    def settings(self) -> str:
+        return 'dvisvgm:.svg:no-fonts'
+
+    def command(
+        self, pdf_path: Path, output_path: Path, page: int = 1
+    ) -> list[str]:
+        return [
+            'dvisvgm',
+            '--pdf',
+            f'--page={page}',
+            '--no-fonts',
+            f'--output={output_path}',
+            str(pdf_path),
+        ]
+
+
+# Rasterizer to use for each output format
+target_rasterizers = {
+    'markdown': PdftocairoRasterizer(density=150),
+    'html': DvisvgmRasterizer(),
+}
+
+
+def rasterizer_for_target(target: str) -> Rasterizer:
+    """
+    Get the rasterizer suited to an output format.
+
+    Parameters
+    ----------
+    target : str
+        Output format, e.g. 'markdown' or 'html'
+
+    Returns
+    -------
+    Rasterizer
+        The configured rasterizer, or ImageMagick at 300 DPI for unknown
+        targets
+    """
+    return target_rasterizers.get(target, ImageMagickRasterizer())
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+from src.utils.disk_cache import evict_lru
+
+
+class TikzCache:
+    """
+    Content-addressed disk cache for compiled TikZ figures.
+
+    Figures are stored as `<key><extension>` (e.g. `.png`, or `.svg` for
+    vector output), where the key is a hash of the normalized TikZ code,
+    the LaTeX preamble and the rasterization settings.
+    The cache is bounded in total bytes and evicts the least recently used
+    figures first (a hit refreshes the file's modification time).
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = 'tikz_cache',
+        max_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        """
+        Initialize the cache.
+
+        Parameters
+        ----------
+        cache_dir : str, optional
+            Directory holding the cached figures, by default 'tikz_cache'
+        max_bytes : int, optional
+            Maximum total size of the cached figures, by default 256 MiB
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def normalize(tikz_code: str) -> str:
+        """Normalize line endings and surrounding whitespace of TikZ code."""
+        lines = tikz_code.replace('\r\n', '\n').strip().split('\n')
+        return '\n'.join(line.rstrip() for line in lines)
+
+    def key(self, tikz_code: str, preamble: str, raster_settings: str) -> str:
+        """
+        Compute the cache key of a figure.
+
+        Parameters
+        ----------
+        tikz_code : str
+            The TikZ code of the figure
+        preamble : str
+            LaTeX preamble the figure is compiled with
+        raster_settings : str
+            Description of the rasterization settings (backend, density, ...)
+
+        Returns
+        -------
+        str
+            Hex digest identifying the compiled figure
+        """
+        digest = hashlib.sha256()
+        for part in (self.normalize(tikz_code), preamble, raster_settings):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key: str, extension: str) -> Path:
+        return self.cache_dir / f'{key}{extension}'
+
+    def get(self, key: str, extension: str = '.png') -> str | None:
+        """
+        Look up a compiled figure.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from `key`
+        extension : str, optional
+            File extension of the figure, by default '.png'
+
+        Returns
+        -------
+        str | None
+            Path to the cached figure, or None on a miss
+        """
+        path = self._path(key, extension)
+        try:
+            # mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return str(path)
+
+    def put(self, key: str, image_path: str) -> str:
+        """
+        Move a freshly compiled figure into the cache.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from `key`
+        image_path : str
+            Path to the compiled figure
+
+        Returns
+        -------
+        str
+            Path to the figure inside the cache
+        """
+        path = self._path(key, Path(image_path).suffix)
+        shutil.move(image_path, path)
+        evict_lru(self.cache_dir, self.max_bytes, keep=path)
+        return str(path)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Hit and miss counters of the cache."""
+        return {'hits': self.hits, 'misses': self.misses}
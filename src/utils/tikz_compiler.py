@@ -1,13 +1,119 @@
+import asyncio
+import hashlib
+import logging
 import os
+import re
 import subprocess
 import uuid
 import platform
 from pathlib import Path
 
+from src.utils.pdflatex_pool import PdflatexWorkerPool, WorkerExitedError
+from src.utils.rasterizers import ImageMagickRasterizer, Rasterizer
+from src.utils.tikz_cache import TikzCache
+from src.utils.tracing import add_counts, span
 
-def compile_tikz(tikz_code: str, output_dir: str = 'tikz_images') -> str:
+log = logging.getLogger(__name__)
+
+# Preamble shared by every compiled figure
+tex_preamble = (
+    '\\documentclass[border=10pt]{standalone}\n'
+    '\\usepackage{tikz}\n'
+    '\\usepackage{pgfplots}\n'
+    '\\pgfplotsset{compat=1.18}\n'
+    '\\usetikzlibrary{arrows,shapes,positioning,fit,calc,'
+    'decorations.pathreplacing,decorations.markings}\n'
+)
+
+# Put every tikzpicture of a batch document on its own page
+batch_preamble = '\\standaloneenv{tikzpicture}\n'
+
+# Minimal LaTeX document wrapping the TikZ code
+tex_content = (
+    '{preamble}\n\\begin{{document}}\n{tikz_code}\n\\end{{document}}\n'
+)
+
+
+def _pdflatex_command() -> str:
+    """Find the pdflatex executable."""
+    if platform.system() == 'Darwin':  # macOS
+        return '/Library/TeX/texbin/pdflatex'
+    return 'pdflatex'
+
+
+def _job_paths(
+    output_dir: str, extension: str = '.png'
+) -> tuple[Path, Path, Path]:
+    """Create the paths for a new compilation."""
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Create a unique ID for this compilation
+    unique_id = str(uuid.uuid4())[:8]
+
+    # Create paths
+    tex_path = Path(output_dir) / f'{unique_id}.tex'
+    pdf_path = Path(output_dir) / f'{unique_id}.pdf'
+    image_path = Path(output_dir) / f'{unique_id}{extension}'
+
+    return tex_path, pdf_path, image_path
+
+
+def _prepare_job(
+    tikz_code: str,
+    output_dir: str,
+    preamble: str = tex_preamble,
+    extension: str = '.png',
+) -> tuple[Path, Path, Path]:
+    """Write the LaTeX file for a compilation and return its paths."""
+    tex_path, pdf_path, image_path = _job_paths(output_dir, extension)
+
+    # Write the LaTeX file
+    with open(tex_path, 'w') as f:
+        f.write(tex_content.format(preamble=preamble, tikz_code=tikz_code))
+
+    return tex_path, pdf_path, image_path
+
+
+def _pdflatex_args(
+    tex_path: Path, output_dir: str, format_path: str | None = None
+) -> list[str]:
+    args = [_pdflatex_command(), '-interaction=nonstopmode']
+    if format_path is not None:
+        # start from the dumped preamble instead of loading the packages
+        args.append(f'-fmt={format_path}')
+    return args + ['-output-directory', output_dir, str(tex_path)]
+
+
+def _format_name(preamble: str) -> str:
+    """Name of the format file holding a dumped preamble."""
+    digest = hashlib.sha256(preamble.encode('utf-8')).hexdigest()
+    return f'tikz-preamble-{digest[:16]}'
+
+
+def _format_build_args(format_dir: str, name: str) -> list[str]:
+    # '&pdflatex' loads the standard format in initex mode so that the
+    # preamble can be executed and written out with \dump
+    return [
+        _pdflatex_command(),
+        '-ini',
+        '-interaction=nonstopmode',
+        f'-jobname={name}',
+        '-output-directory',
+        format_dir,
+        '&pdflatex',
+        str(Path(format_dir) / f'{name}.tex'),
+    ]
+
+
+def compile_tikz(
+    tikz_code: str,
+    output_dir: str = 'tikz_images',
+    cache: TikzCache | None = None,
+    rasterizer: Rasterizer | None = None,
+) -> str:
     """
-    Compile TikZ code into a PDF then convert to PNG.
+    Compile TikZ code into a PDF then convert to an image.
 
     Parameters
     ----------
@@ -15,81 +121,523 @@ def compile_tikz(tikz_code: str, output_dir: str = 'tikz_images') -> str:
         The TikZ code to compile
     output_dir : str
         Directory to save the output image
+    cache : TikzCache | None
+        Cache of compiled figures to reuse and fill. None by default.
+    rasterizer : Rasterizer | None
+        Backend converting the PDF to an image. ImageMagick at 300 DPI by
+        default.
 
     Returns
     -------
     str
-        Path to the generated PNG image
+        Path to the generated image
     """
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+    rasterizer = rasterizer or ImageMagickRasterizer()
 
-    # Create a unique ID for this compilation
-    unique_id = str(uuid.uuid4())[:8]
+    if cache is not None:
+        key = cache.key(tikz_code, tex_preamble, rasterizer.settings)
+        if cached_path := cache.get(key, rasterizer.extension):
+            return cached_path
 
-    # Create paths
-    tex_path = Path(output_dir) / f'{unique_id}.tex'
-    pdf_path = Path(output_dir) / f'{unique_id}.pdf'
-    png_path = Path(output_dir) / f'{unique_id}.png'
-
-    # Create a minimal LaTeX document with the TikZ code
-    tex_content = (
-        '\\documentclass[border=10pt]{{standalone}}\n'
-        '\\usepackage{{tikz}}\n'
-        '\\usepackage{{pgfplots}}\n'
-        '\\pgfplotsset{{compat=1.18}}\n'
-        '\\usetikzlibrary{{arrows,shapes,positioning,fit,calc,'
-        'decorations.pathreplacing,decorations.markings}}\n'
-        '\n'
-        '\\begin{{document}}\n'
-        '{tikz_code}\n'
-        '\\end{{document}}\n'
+    tex_path, pdf_path, image_path = _prepare_job(
+        tikz_code, output_dir, extension=rasterizer.extension
     )
 
-    # Write the LaTeX file
-    with open(tex_path, 'w') as f:
-        f.write(tex_content.format(tikz_code=tikz_code))
-
     try:
-        # Find the pdflatex executable
-        if platform.system() == 'Darwin':  # macOS
-            pdflatex_cmd = '/Library/TeX/texbin/pdflatex'
-        else:
-            pdflatex_cmd = 'pdflatex'
-
         # Compile with pdflatex
         subprocess.run(
-            [
-                pdflatex_cmd,
-                '-interaction=nonstopmode',
-                '-output-directory',
-                output_dir,
-                tex_path,
-            ],
+            _pdflatex_args(tex_path, output_dir),
             check=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
 
-        # Convert PDF to PNG using convert (from ImageMagick)
+        # Convert the PDF to an image
         subprocess.run(
-            [
-                'convert',
-                '-density',
-                '300',
-                pdf_path,
-                '-quality',
-                '90',
-                png_path,
-            ],
+            rasterizer.command(pdf_path, image_path),
             check=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
 
-        # Return the path to the PNG
-        return str(png_path)
+        # Return the path to the image
+        if cache is not None:
+            return cache.put(key, str(image_path))
+        return str(image_path)
 
     except subprocess.CalledProcessError:
         # If compilation fails, return None
         return None
+
+
+class TikzCompiler:
+    """
+    Asynchronous TikZ compilation service.
+
+    Runs `pdflatex` and the rasterizer as asyncio subprocesses so
+    compilation does not block the event loop, with at most `max_workers`
+    jobs running at once.
+    """
+
+    def __init__(
+        self,
+        output_dir: str = 'tikz_images',
+        max_workers: int | None = None,
+        timeout: float | None = 60.0,
+        cache: TikzCache | None = None,
+        format_dir: str | None = None,
+        warm_workers: int = 0,
+        rasterizer: Rasterizer | None = None,
+    ) -> None:
+        """
+        Initialize the compiler.
+
+        Parameters
+        ----------
+        output_dir : str, optional
+            Directory to save the output images, by default 'tikz_images'
+        max_workers : int | None, optional
+            Maximum number of concurrent compilations, by default the
+            number of CPU cores
+        timeout : float | None, optional
+            Seconds allowed for each compilation (pdflatex and rasterizing)
+            before it is killed, by default 60.0. None disables the timeout.
+        cache : TikzCache | None, optional
+            Cache of compiled figures to reuse and fill, by default None
+        format_dir : str | None, optional
+            Directory for a precompiled format of the preamble. When set,
+            the preamble is dumped to a `.fmt` file once (and again whenever
+            it changes) and every figure is compiled from it. By default
+            None, which loads the preamble on every compile.
+        warm_workers : int, optional
+            Number of pre-started pdflatex processes (with the preamble
+            already loaded) to keep waiting for figures, by default 0. Call
+            `close` to stop them. Ignored on non-POSIX systems.
+        rasterizer : Rasterizer | None, optional
+            Backend converting the PDF to an image, by default ImageMagick
+            at 300 DPI
+        """
+        self.output_dir = output_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.cache = cache
+        self.format_dir = format_dir
+        self._format_path = None
+        self._format_lock = asyncio.Lock()
+        if warm_workers and os.name != 'posix':
+            # the workers read the figure from /dev/stdin
+            log.info('Warm pdflatex workers need a POSIX system, disabled')
+            warm_workers = 0
+        self.warm_workers = warm_workers
+        self._pool = None
+        # PDF (and page) of each compiled figure, by normalized code, so
+        # that converting it again with another rasterizer skips pdflatex
+        self._pdfs: dict[str, tuple[Path, int]] = {}
+        self.rasterizer = rasterizer or ImageMagickRasterizer()
+        self._semaphore = asyncio.Semaphore(self.max_workers)
+
+    async def _run(self, args: list[str]) -> bytes:
+        """
+        Run a command, killing it if it is cancelled.
+
+        Returns
+        -------
+        bytes
+            Standard output of the command
+
+        Raises
+        ------
+        subprocess.CalledProcessError
+            If the command exits with a non-zero status
+        """
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await process.communicate()
+        except BaseException:
+            # cancelled (or timed out): don't leave the process running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(
+                process.returncode, args, stdout, stderr
+            )
+        return stdout
+
+    async def _ensure_format(self) -> str | None:
+        """
+        Build the preamble format if needed.
+
+        Returns
+        -------
+        str | None
+            Path of the format (without `.fmt`), or None if it could not be
+            built and figures should load the preamble themselves
+        """
+        name = _format_name(tex_preamble)
+        format_path = str(Path(self.format_dir).resolve() / name)
+        if self._format_path == format_path:
+            return format_path
+
+        async with self._format_lock:
+            if self._format_path == format_path:
+                return format_path
+
+            if not os.path.exists(f'{format_path}.fmt'):
+                os.makedirs(self.format_dir, exist_ok=True)
+                with open(Path(self.format_dir) / f'{name}.tex', 'w') as f:
+                    f.write(f'{tex_preamble}\\dump\n')
+                try:
+                    await self._run(_format_build_args(self.format_dir, name))
+                except subprocess.CalledProcessError:
+                    log.info('Could not dump the TikZ preamble format')
+                    self.format_dir = None
+                    return None
+
+            self._format_path = format_path
+            return format_path
+
+    async def _compile(self, tikz_code: str, rasterizer: Rasterizer) -> str:
+        pdf = self._pdfs.get(TikzCache.normalize(tikz_code))
+        if pdf is not None and pdf[0].exists():
+            pdf_path, page = pdf
+            _, _, image_path = _job_paths(
+                self.output_dir, rasterizer.extension
+            )
+            with span('rasterize', reused_pdf=True):
+                await self._run(rasterizer.command(pdf_path, image_path, page))
+            return str(image_path)
+
+        format_path = None
+        if self.format_dir is not None:
+            format_path = await self._ensure_format()
+
+        preamble = tex_preamble if format_path is None else ''
+        extension = rasterizer.extension
+
+        warm = bool(self.warm_workers)
+        if warm:
+            if self._pool is None:
+                self._pool = PdflatexWorkerPool(
+                    size=self.warm_workers,
+                    work_dir=str(Path(self.output_dir) / 'workers'),
+                    pdflatex_cmd=_pdflatex_command(),
+                    preamble=preamble,
+                    format_path=format_path,
+                )
+            _, pdf_path, image_path = _job_paths(self.output_dir, extension)
+            try:
+                with span('pdflatex', warm=True):
+                    await self._pool.compile(tikz_code, pdf_path)
+            except WorkerExitedError as e:
+                log.info('%s, compiling without the pool', e)
+                warm = False
+        if not warm:
+            tex_path, pdf_path, image_path = _prepare_job(
+                tikz_code, self.output_dir, preamble, extension
+            )
+            with span('pdflatex', warm=False):
+                await self._run(
+                    _pdflatex_args(tex_path, self.output_dir, format_path)
+                )
+        self._pdfs[TikzCache.normalize(tikz_code)] = (pdf_path, 1)
+        with span('rasterize'):
+            await self._run(rasterizer.command(pdf_path, image_path))
+        return str(image_path)
+
+    async def _compile_uncached(
+        self, tikz_code: str, key: str | None, rasterizer: Rasterizer
+    ) -> str | None:
+        async with self._semaphore:
+            with span('tikz_compile') as trace:
+                try:
+                    image_path = await asyncio.wait_for(
+                        self._compile(tikz_code, rasterizer),
+                        timeout=self.timeout,
+                    )
+                except subprocess.CalledProcessError as e:
+                    log.info(
+                        'TikZ compilation failed: %s exited %d',
+                        e.cmd[0],
+                        e.returncode,
+                    )
+                    if trace is not None:
+                        trace.error = f'{e.cmd[0]} exited {e.returncode}'
+                    return None
+                except TimeoutError:
+                    log.info(
+                        'TikZ compilation timed out after %ss', self.timeout
+                    )
+                    if trace is not None:
+                        trace.error = 'timeout'
+                    return None
+                except OSError as e:
+                    # e.g. the rasterizer's (optional) tool is not installed
+                    log.info('TikZ compilation failed: %r', e)
+                    if trace is not None:
+                        trace.error = repr(e)
+                    return None
+
+        if self.cache is not None:
+            return self.cache.put(key, image_path)
+        return image_path
+
+    def _cache_key(self, tikz_code: str, rasterizer: Rasterizer) -> str | None:
+        if self.cache is None:
+            return None
+        return self.cache.key(tikz_code, tex_preamble, rasterizer.settings)
+
+    async def compile(
+        self, tikz_code: str, rasterizer: Rasterizer | None = None
+    ) -> str | None:
+        """
+        Compile TikZ code into a PDF then convert to an image.
+
+        A figure this compiler already compiled is converted from its PDF,
+        without running pdflatex again.
+
+        Parameters
+        ----------
+        tikz_code : str
+            The TikZ code to compile
+        rasterizer : Rasterizer | None, optional
+            Backend to convert the PDF with, e.g. the one suited to an output
+            format (see `rasterizer_for_target`), by default the compiler's
+
+        Returns
+        -------
+        str | None
+            Path to the generated image, or None if compilation failed or
+            timed out
+        """
+        rasterizer = rasterizer or self.rasterizer
+        key = self._cache_key(tikz_code, rasterizer)
+        if key is not None:
+            if cached_path := self.cache.get(key, rasterizer.extension):
+                add_counts(tikz_cache_hits=1)
+                return cached_path
+
+        return await self._compile_uncached(tikz_code, key, rasterizer)
+
+    async def _compile_batch(self, tikz_codes: list[str]) -> list[str]:
+        """
+        Compile several figures as the pages of one document.
+
+        Raises
+        ------
+        subprocess.CalledProcessError
+            If pdflatex fails or does not produce one page per figure
+        """
+        format_path = None
+        if self.format_dir is not None:
+            format_path = await self._ensure_format()
+
+        preamble = tex_preamble if format_path is None else ''
+        tex_path, pdf_path, image_path = _prepare_job(
+            '\n'.join(tikz_codes),
+            self.output_dir,
+            preamble + batch_preamble,
+            self.rasterizer.extension,
+        )
+        args = _pdflatex_args(tex_path, self.output_dir, format_path)
+        async with self._semaphore:
+            with span('pdflatex', figures=len(tikz_codes)):
+                stdout = await asyncio.wait_for(
+                    self._run(args), timeout=self.timeout
+                )
+
+        # TeX wraps its terminal output at 79 characters
+        pages = re.search(
+            rb'Output written on .*?\((\d+) pages?',
+            stdout.replace(b'\n', b''),
+        )
+        if pages is None or int(pages.group(1)) != len(tikz_codes):
+            raise subprocess.CalledProcessError(0, args, stdout)
+        for page, tikz_code in enumerate(tikz_codes, start=1):
+            self._pdfs[TikzCache.normalize(tikz_code)] = (pdf_path, page)
+
+        async def rasterize(page: int) -> str:
+            page_path = image_path.with_stem(f'{image_path.stem}-{page}')
+            async with self._semaphore:
+                with span('rasterize', page=page):
+                    await asyncio.wait_for(
+                        self._run(
+                            self.rasterizer.command(pdf_path, page_path, page)
+                        ),
+                        timeout=self.timeout,
+                    )
+            return str(page_path)
+
+        return await asyncio.gather(
+            *[rasterize(page) for page in range(1, len(tikz_codes) + 1)]
+        )
+
+    async def compile_many(self, tikz_codes: list[str]) -> list[str | None]:
+        """
+        Compile the TikZ figures of a response in a single pdflatex run.
+
+        The figures are placed on separate pages of one standalone document,
+        which is compiled once and split back into one image per page. If
+        the batch fails, every figure is compiled on its own so that only the
+        broken ones are lost.
+
+        Parameters
+        ----------
+        tikz_codes : list[str]
+            The TikZ code of each figure
+
+        Returns
+        -------
+        list[str | None]
+            Path to the generated image of each figure, or None for figures
+            that failed to compile
+        """
+        results = [None] * len(tikz_codes)
+        keys = [
+            self._cache_key(tikz_code, self.rasterizer)
+            for tikz_code in tikz_codes
+        ]
+        pending = []
+        batch = []
+        for i, tikz_code in enumerate(tikz_codes):
+            if keys[i] is not None:
+                results[i] = self.cache.get(keys[i], self.rasterizer.extension)
+                if results[i] is not None:
+                    add_counts(tikz_cache_hits=1)
+                    continue
+            pending.append(i)
+            # pages are split per tikzpicture, so only single-picture
+            # figures can share a document
+            if tikz_code.count('\\begin{tikzpicture}') == 1:
+                batch.append(i)
+
+        if len(batch) > 1:
+            try:
+                with span('tikz_compile_batch', figures=len(batch)):
+                    image_paths = await self._compile_batch(
+                        [tikz_codes[i] for i in batch]
+                    )
+            except (subprocess.CalledProcessError, TimeoutError, OSError):
+                log.info(
+                    'Batch compilation of %d TikZ figures failed,'
+                    ' compiling them individually',
+                    len(batch),
+                )
+            else:
+                for i, image_path in zip(batch, image_paths):
+                    if keys[i] is not None:
+                        image_path = self.cache.put(keys[i], image_path)
+                    results[i] = image_path
+
+        remaining = [i for i in pending if results[i] is None]
+        image_paths = await asyncio.gather(
+            *[
+                self._compile_uncached(tikz_codes[i], keys[i], self.rasterizer)
+                for i in remaining
+            ]
+        )
+        for i, image_path in zip(remaining, image_paths):
+            results[i] = image_path
+        return results
+
+    async def close(self) -> None:
+        """Stop any warm pdflatex workers."""
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+class TikzBatch:
+    """
+    Collects the TikZ figures of one response and compiles them together.
+
+    A slot is reserved for every TikZ subtask of the plan and the batch is
+    sealed once the plan is complete. When every slot has either submitted
+    its code or been released (e.g. because generation failed), all
+    submitted figures are compiled with `TikzCompiler.compile_many`.
+    """
+
+    def __init__(self, compiler: TikzCompiler) -> None:
+        """
+        Initialize the batch.
+
+        Parameters
+        ----------
+        compiler : TikzCompiler
+            Compiler used for the batch
+        """
+        self.compiler = compiler
+        self._slots = 0
+        self._codes = {}
+        self._released = set()
+        self._sealed = False
+        self._flush_task = None
+        self._results = asyncio.get_running_loop().create_future()
+
+    def reserve(self) -> int:
+        """Reserve a slot for a TikZ subtask."""
+        slot = self._slots
+        self._slots += 1
+        return slot
+
+    def seal(self) -> None:
+        """Mark that no more slots will be reserved."""
+        self._sealed = True
+        self._check()
+
+    def release(self, slot: int) -> None:
+        """Give up a slot that will not submit any code."""
+        if slot not in self._codes:
+            self._released.add(slot)
+            self._check()
+
+    async def compile(self, slot: int, tikz_code: str) -> str | None:
+        """
+        Submit the code of a slot and wait for the batch to compile.
+
+        Parameters
+        ----------
+        slot : int
+            Slot from `reserve`
+        tikz_code : str
+            The TikZ code to compile
+
+        Returns
+        -------
+        str | None
+            Path to the generated image, or None if compilation failed
+        """
+        self._codes[slot] = tikz_code
+        self._check()
+        results = await asyncio.shield(self._results)
+        return results[slot]
+
+    def _check(self) -> None:
+        done = len(self._codes) + len(self._released)
+        if (
+            self._sealed
+            and self._slots
+            and done == self._slots
+            and self._flush_task is None
+        ):
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        slots = sorted(self._codes)
+        try:
+            image_paths = await self.compiler.compile_many(
+                [self._codes[slot] for slot in slots]
+            )
+        except asyncio.CancelledError:
+            self._results.cancel()
+            raise
+        except Exception as e:
+            self._results.set_exception(e)
+            return
+        self._results.set_result(dict(zip(slots, image_paths)))
@@ -0,0 +1,364 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any
+
+import httpx
+from pydantic import BaseModel, Field
+
+if TYPE_CHECKING:
+    from src.models.settings import TracingSettings
+
+log = logging.getLogger(__name__)
+
+
+class Span(BaseModel):
+    """A timed operation, nested in the span that was current when it began."""
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None = None
+    # Unix time in nanoseconds
+    start_time: int
+    end_time: int | None = None
+    attributes: dict[str, Any] = Field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def duration(self) -> float | None:
+        """Duration in seconds, once the span has ended."""
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start_time) / 1e9
+
+
+class SpanExporter(ABC):
+    """Base class for sending finished spans somewhere."""
+
+    @abstractmethod
+    def export(self, span: Span) -> None:
+        """Export a finished span."""
+        pass
+
+    def shutdown(self) -> None:
+        """Flush any buffered spans and release resources."""
+        pass
+
+
+class JsonLinesExporter(SpanExporter):
+    """
+    Appends each finished span to a file as a line of JSON.
+
+    Spans are queued and serialized and written from a background thread,
+    so exporting never blocks the event loop.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def _worker(self) -> None:
+        stopping = False
+        while not stopping:
+            # write whatever has been queued, then flush once
+            spans = [self._queue.get()]
+            while not self._queue.empty():
+                spans.append(self._queue.get_nowait())
+            lines = []
+            for span in spans:
+                if span is None:
+                    stopping = True
+                    continue
+                entry = span.model_dump(exclude_none=True)
+                entry['duration'] = span.duration
+                lines.append(json.dumps(entry, default=str) + '\n')
+            self._file.writelines(lines)
+            self._file.flush()
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_span(span: Span) -> dict[str, Any]:
+    otlp_span = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        # internal
+        'kind': 1,
+        'startTimeUnixNano': str(span.start_time),
+        'endTimeUnixNano': str(span.end_time),
+        'attributes': [
+            {'key': key, 'value': _otlp_value(value)}
+            for key, value in span.attributes.items()
+        ],
+        'status': {'code': 1},
+    }
+    if span.parent_id is not None:
+        otlp_span['parentSpanId'] = span.parent_id
+    if span.error is not None:
+        otlp_span['status'] = {'code': 2, 'message': span.error}
+    return otlp_span
+
+
+class OtlpHttpExporter(SpanExporter):
+    """
+    Sends spans to an OpenTelemetry collector over OTLP/HTTP (JSON).
+
+    Spans are queued and posted in batches from a background thread, so
+    exporting never blocks the event loop. Spans that cannot be delivered
+    are dropped.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = 'http://localhost:4318/v1/traces',
+        service_name: str = 'multimodal-response',
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+    ) -> None:
+        """
+        Initialize the exporter.
+
+        Parameters
+        ----------
+        endpoint : str, optional
+            Traces endpoint of the collector, by default the local default
+        service_name : str, optional
+            Service the spans are reported under, by default
+            'multimodal-response'
+        batch_size : int, optional
+            Maximum number of spans per request, by default 256
+        flush_interval : float, optional
+            Seconds to wait for more spans before sending a partial batch,
+            by default 1
+        """
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def _post(self, client: httpx.Client, spans: list[Span]) -> None:
+        payload = {
+            'resourceSpans': [
+                {
+                    'resource': {
+                        'attributes': [
+                            {
+                                'key': 'service.name',
+                                'value': _otlp_value(self.service_name),
+                            }
+                        ]
+                    },
+                    'scopeSpans': [
+                        {
+                            'scope': {'name': __name__},
+                            'spans': [_otlp_span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        try:
+            client.post(self.endpoint, json=payload).raise_for_status()
+        except httpx.HTTPError as e:
+            log.warning('Dropped %d spans: %r', len(spans), e)
+
+    def _worker(self) -> None:
+        with httpx.Client(timeout=10.0) as client:
+            stopping = False
+            while not stopping:
+                spans = []
+                try:
+                    while len(spans) < self.batch_size:
+                        span = self._queue.get(timeout=self.flush_interval)
+                        if span is None:
+                            stopping = True
+                            break
+                        spans.append(span)
+                except queue.Empty:
+                    pass
+                if spans:
+                    self._post(client, spans)
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+# Exporters of the finished spans (spans are only recorded if there are any)
+_exporters: list[SpanExporter] = []
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    'current_span', default=None
+)
+
+
+def configure_tracing(settings: 'TracingSettings') -> None:
+    """
+    Start exporting spans, replacing any previous exporters.
+
+    Parameters
+    ----------
+    settings : TracingSettings
+        The exporters to use
+    """
+    shutdown_tracing()
+    if settings.jsonl_path is not None:
+        _exporters.append(JsonLinesExporter(settings.jsonl_path))
+    if settings.otlp_endpoint is not None:
+        _exporters.append(
+            OtlpHttpExporter(
+                settings.otlp_endpoint, service_name=settings.service_name
+            )
+        )
+
+
+def shutdown_tracing() -> None:
+    """Flush and remove the exporters."""
+    while _exporters:
+        _exporters.pop().shutdown()
+
+
+def current_span() -> Span | None:
+    """The span of the running operation, if it is traced."""
+    return _current_span.get()
+
+
+@contextmanager
+def span(
+    name: str, activate: bool = True, **attributes: Any
+) -> Iterator[Span | None]:
+    """
+    Trace an operation.
+
+    The span is a child of the current span, or the root of a new trace.
+    Tasks started inside it inherit it as their current span.
+
+    Parameters
+    ----------
+    name : str
+        Name of the operation
+    activate : bool, optional
+        Whether to make the span current while the block runs, by default
+        True. Async generators should not activate spans, as the span would
+        stay current in their consumer between items.
+    **attributes : Any
+        Initial attributes of the span
+
+    Yields
+    ------
+    Span | None
+        The span, or None if tracing is not configured
+    """
+    if not _exporters:
+        yield None
+        return
+
+    parent = _current_span.get()
+    new_span = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else os.urandom(16).hex(),
+        span_id=os.urandom(8).hex(),
+        parent_id=parent.span_id if parent else None,
+        start_time=time.time_ns(),
+        attributes=attributes,
+    )
+    token = _current_span.set(new_span) if activate else None
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = repr(e)
+        raise
+    finally:
+        if token is not None:
+            _current_span.reset(token)
+        new_span.end_time = time.time_ns()
+        for exporter in _exporters:
+            exporter.export(new_span)
+
+
+def set_attributes(**attributes: Any) -> None:
+    """Set attributes of the current span (no-op if there is none)."""
+    if (current := _current_span.get()) is not None:
+        current.attributes.update(attributes)
+
+
+def add_counts(**counts: float) -> None:
+    """
+    Add to numeric attributes of the current span, such as token usage,
+    cache hits or retries (no-op if there is no current span).
+    """
+    if (current := _current_span.get()) is not None:
+        attributes = current.attributes
+        for key, count in counts.items():
+            attributes[key] = attributes.get(key, 0) + count
+
+
+def critical_path(spans: list[Span]) -> list[Span]:
+    """
+    Find the critical path of a trace: from the root, repeatedly the child
+    that ended last.
+
+    Parameters
+    ----------
+    spans : list[Span]
+        The finished spans of one trace
+
+    Returns
+    -------
+    list[Span]
+        The spans on the critical path, outermost first
+    """
+    children = {}
+    for s in spans:
+        children.setdefault(s.parent_id, []).append(s)
+    path = []
+    level = children.get(None, [])
+    while level:
+        last = max(level, key=lambda s: s.end_time or 0)
+        path.append(last)
+        level = children.get(last.span_id, [])
+    return path
+
+
+def read_spans(path: str) -> Iterator[Span]:
+    """Read the spans written by a `JsonLinesExporter`."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entry.pop('duration', None)
+                yield Span.model_validate(entry)
@@ -0,0 +1,128 @@
+"""
+The provider clients must not block the event loop: concurrent calls
+should overlap instead of running one after the other.
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.clients.anthropic import AnthropicClient
+from src.clients.google import GoogleClient
+from src.clients.openai import OpenAIClient
+
+# Simulated latency of each provider call, in seconds
+delay = 0.2
+calls = 5
+
+
+class FakeAnthropicStream:
+    """Stand-in for `AsyncAnthropic.messages.stream(...)`."""
+
+    async def __aenter__(self) -> 'FakeAnthropicStream':
+        await asyncio.sleep(delay)
+        self.text_stream = self._text()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        pass
+
+    async def _text(self):
+        yield 'Hello'
+
+    async def get_final_message(self) -> SimpleNamespace:
+        return SimpleNamespace(
+            usage=SimpleNamespace(
+                input_tokens=10,
+                output_tokens=2,
+                cache_read_input_tokens=0,
+                cache_creation_input_tokens=0,
+            ),
+            content=[SimpleNamespace(type='text', text='Hello')],
+        )
+
+
+def fake_anthropic() -> SimpleNamespace:
+    return SimpleNamespace(
+        messages=SimpleNamespace(stream=lambda **kwargs: FakeAnthropicStream())
+    )
+
+
+def fake_openai() -> SimpleNamespace:
+    async def chunks():
+        yield SimpleNamespace(
+            choices=[SimpleNamespace(delta=SimpleNamespace(content='Hello'))],
+            usage=None,
+        )
+        yield SimpleNamespace(
+            choices=[],
+            usage=SimpleNamespace(
+                prompt_tokens=10,
+                completion_tokens=2,
+                total_tokens=12,
+                prompt_tokens_details=None,
+                completion_tokens_details=None,
+            ),
+        )
+
+    async def create(**kwargs):
+        await asyncio.sleep(delay)
+        return chunks()
+
+    return SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+
+
+def fake_google() -> SimpleNamespace:
+    async def chunks():
+        yield SimpleNamespace(
+            text='Hello',
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=10,
+                candidates_token_count=2,
+                cached_content_token_count=0,
+                total_token_count=12,
+                thoughts_token_count=None,
+            ),
+        )
+
+    async def generate_content_stream(**kwargs):
+        await asyncio.sleep(delay)
+        return chunks()
+
+    return SimpleNamespace(
+        aio=SimpleNamespace(
+            models=SimpleNamespace(
+                generate_content_stream=generate_content_stream
+            )
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    'client_class, fake_sdk',
+    [
+        (AnthropicClient, fake_anthropic),
+        (OpenAIClient, fake_openai),
+        (GoogleClient, fake_google),
+    ],
+)
+def test_concurrent_calls_overlap(client_class, fake_sdk):
+    client = client_class(model='test-model', api_key='test-key')
+    client.client = fake_sdk()
+
+    async def generate_all() -> list[str]:
+        return await asyncio.gather(
+            *(client.generate_text(f'prompt {i}') for i in range(calls))
+        )
+
+    start = time.perf_counter()
+    texts = asyncio.run(generate_all())
+    elapsed = time.perf_counter() - start
+
+    assert texts == ['Hello'] * calls
+    # about one delay, far from the `calls * delay` of serial calls
+    assert elapsed < 2 * delay
@@ -0,0 +1,53 @@
+"""
+A warm pdflatex worker that cannot be started must fail the compile that
+waits for it, instead of leaving it waiting forever.
+"""
+
+import asyncio
+
+import pytest
+
+from src.utils import tikz_compiler
+from src.utils.pdflatex_pool import PdflatexWorkerPool, WorkerExitedError
+from src.utils.tikz_compiler import TikzCompiler
+
+missing_command = 'no-such-pdflatex'
+
+
+def test_spawn_failure_reaches_the_waiter(tmp_path):
+    pool = PdflatexWorkerPool(
+        size=1,
+        work_dir=str(tmp_path),
+        pdflatex_cmd=missing_command,
+        preamble='',
+    )
+
+    async def compile_and_close() -> None:
+        try:
+            await asyncio.wait_for(
+                pool.compile('', tmp_path / 'figure.pdf'), timeout=5
+            )
+        finally:
+            await pool.close()
+
+    with pytest.raises(WorkerExitedError):
+        asyncio.run(compile_and_close())
+
+
+def test_compiler_gives_up_without_pdflatex(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        tikz_compiler, '_pdflatex_command', lambda: missing_command
+    )
+    compiler = TikzCompiler(
+        output_dir=str(tmp_path), timeout=None, warm_workers=1
+    )
+
+    async def compile_and_close() -> str | None:
+        try:
+            return await asyncio.wait_for(
+                compiler.compile('\\draw (0,0) -- (1,1);'), timeout=5
+            )
+        finally:
+            await compiler.close()
+
+    assert asyncio.run(compile_and_close()) is None
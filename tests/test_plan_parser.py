@@ -0,0 +1,70 @@
+"""
+A streamed plan must yield the same subtasks however the provider splits
+its text, whatever the subtasks' strings and nested values hold.
+"""
+
+import json
+
+import pytest
+
+from src.utils.plan_parser import SubtaskStreamParser
+
+subtasks = [
+    {
+        'type': 'text',
+        'description': 'Braces {like} these, [brackets] and "quotes"',
+        'prompt': 'Escaped \\"}]\\\\ text',
+        'order': 1,
+    },
+    {
+        'type': 'tikz',
+        'description': 'Nested values',
+        'prompt': 'Draw it',
+        'order': 2,
+        'depends_on': [[1], []],
+        'style': {'sizes': [1, [2, 3]], 'label': '{]'},
+    },
+]
+
+
+def parse(chunks: list[str]) -> tuple[list[dict], SubtaskStreamParser]:
+    parser = SubtaskStreamParser()
+    parsed = []
+    for chunk in chunks:
+        parsed.extend(parser.feed(chunk))
+    return parsed, parser
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 64])
+def test_chunk_size_does_not_matter(size):
+    text = json.dumps({'subtasks': subtasks, 'notes': ['after']})
+    parsed, parser = parse(
+        [text[i : i + size] for i in range(0, len(text), size)]
+    )
+    assert parsed == subtasks
+    assert parser.finished
+
+
+def test_subtasks_are_returned_as_they_complete():
+    text = json.dumps({'subtasks': subtasks})
+    end = text.index(json.dumps(subtasks[0])) + len(json.dumps(subtasks[0]))
+    parser = SubtaskStreamParser()
+    assert parser.feed(text[: end - 1]) == []
+    assert parser.feed(text[end - 1 : end]) == subtasks[:1]
+    assert not parser.finished
+    assert parser.feed(text[end:]) == subtasks[1:]
+    assert parser.finished
+
+
+def test_fenced_json():
+    text = '```json\n' + json.dumps({'subtasks': subtasks}, indent=2)
+    text += '\n```\n'
+    parsed, parser = parse(list(text))
+    assert parsed == subtasks
+    assert parser.finished
+
+
+def test_empty_plan():
+    parsed, parser = parse(list('{"subtasks": []}'))
+    assert parsed == []
+    assert parser.finished
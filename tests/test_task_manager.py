@@ -0,0 +1,133 @@
+"""
+The subtasks of a response must run as independent chains: a response
+should take about as long as planning plus its slowest refine-and-generate
+chain, not plus the slowest refinement and then the slowest generation.
+Its elements must come out by their planned order, whichever finishes first.
+"""
+
+import asyncio
+import time
+from typing import Any
+
+import pytest
+
+from src.clients.mock_client import MockClient
+from src.models.provider import ModelProvider
+from src.orchestration.task_manager import TaskManager
+from src.orchestration.task_planner import TaskPlanner
+from src.utils.tikz_compiler import TikzCompiler
+
+plan_latency = 0.1
+# refine and generate latencies of each subtask, by its prompt: each chain
+# takes 0.65s, but waiting for every refinement before generating takes 1.2s
+latencies = {'alpha': (0.05, 0.6), 'beta': (0.6, 0.05)}
+plan = {
+    'subtasks': [
+        {
+            'type': 'text',
+            'description': name,
+            'prompt': name,
+            'order': order,
+        }
+        for order, name in enumerate(latencies, start=1)
+    ]
+}
+
+
+class ScriptedClient(MockClient):
+    """Mock client whose text latency depends on the subtask and step."""
+
+    async def generate_text(self, prompt: str, **kwargs: Any) -> str:
+        if prompt.startswith('refined '):
+            name = prompt.removeprefix('refined ')
+            await asyncio.sleep(latencies[name][1])
+            return f'text of {name}'
+        name = next(name for name in latencies if name in prompt)
+        await asyncio.sleep(latencies[name][0])
+        return f'refined {name}'
+
+
+def test_subtasks_run_as_independent_chains(tmp_path):
+    planner = TaskPlanner(ModelProvider.MOCK, api_key=None, model='mock')
+    planner.client = MockClient(latency={'plan': plan_latency}, plan=plan)
+    task_manager = TaskManager(
+        ScriptedClient(),
+        MockClient(),
+        MockClient(),
+        planner,
+        refine_tasks=True,
+        tikz_compiler=TikzCompiler(output_dir=str(tmp_path)),
+    )
+
+    start = time.perf_counter()
+    response = asyncio.run(task_manager.generate_response('A prompt'))
+    elapsed = time.perf_counter() - start
+
+    assert [element.content for element in response.elements] == [
+        'text of alpha',
+        'text of beta',
+    ]
+    slowest_chain = max(
+        refine + generate for refine, generate in latencies.values()
+    )
+    barrier = max(refine for refine, _ in latencies.values()) + max(
+        generate for _, generate in latencies.values()
+    )
+    assert elapsed >= plan_latency + slowest_chain
+    assert elapsed < plan_latency + slowest_chain + 0.25
+    assert elapsed < plan_latency + barrier - 0.25
+
+
+# planned order (from 1) and generate latency of each subtask, by its
+# prompt: listed out of order, with the first element finishing last
+ordered_latencies = {'second': (2, 0.1), 'third': (3, 0.05), 'first': (1, 0.3)}
+
+
+class OrderedClient(MockClient):
+    """Mock client whose text latency depends on the subtask."""
+
+    async def generate_text(self, prompt: str, **kwargs: Any) -> str:
+        name = next(name for name in ordered_latencies if name in prompt)
+        await asyncio.sleep(ordered_latencies[name][1])
+        return f'text of {name}'
+
+
+@pytest.mark.parametrize('stream_plan', [False, True])
+@pytest.mark.parametrize('first_order', [1, 0])
+def test_elements_come_out_in_planned_order(
+    tmp_path, stream_plan, first_order
+):
+    planner = TaskPlanner(ModelProvider.MOCK, api_key=None, model='mock')
+    planner.client = MockClient(
+        plan={
+            'subtasks': [
+                {
+                    'type': 'text',
+                    'description': name,
+                    'prompt': name,
+                    'order': order - 1 + first_order,
+                }
+                for name, (order, _) in ordered_latencies.items()
+            ]
+        }
+    )
+    task_manager = TaskManager(
+        OrderedClient(),
+        MockClient(),
+        MockClient(),
+        planner,
+        stream_plan=stream_plan,
+        tikz_compiler=TikzCompiler(output_dir=str(tmp_path)),
+    )
+
+    async def stream() -> list[str]:
+        return [
+            element.content
+            async for element in task_manager.stream_response('A prompt')
+        ]
+
+    assert asyncio.run(stream()) == [
+        'text of first',
+        'text of second',
+        'text of third',
+    ]
@@ -0,0 +1,97 @@
+"""
+Converting TikZ figures for an output format must not need a second
+pdflatex run, and a missing optional rasterizer must not break the output.
+"""
+
+import asyncio
+import os
+import stat
+from pathlib import Path
+
+from src.models.response import MultimodalResponse, TikzElement
+from src.utils import formatting, tikz_compiler
+from src.utils.rasterizers import PdftocairoRasterizer, Rasterizer
+from src.utils.tikz_compiler import TikzCompiler
+
+tikz_code = '\\begin{tikzpicture}\\draw (0,0) -- (1,1);\\end{tikzpicture}'
+
+
+class CopyRasterizer(Rasterizer):
+    """Stand-in rasterizer copying the PDF to the image path."""
+
+    def __init__(self, extension: str) -> None:
+        self.extension = extension
+
+    @property
+    def settings(self) -> str:
+        return f'copy:{self.extension}'
+
+    def command(
+        self, pdf_path: Path, output_path: Path, page: int = 1
+    ) -> list[str]:
+        return ['cp', str(pdf_path), str(output_path)]
+
+
+def fake_pdflatex(tmp_path: Path) -> tuple[str, Path]:
+    """A pdflatex writing a dummy PDF, and the file counting its runs."""
+    runs = tmp_path / 'runs'
+    script = tmp_path / 'pdflatex'
+    script.write_text(
+        '#!/bin/sh\n'
+        f'echo run >> {runs}\n'
+        'for arg; do tex=$arg; done\n'
+        'echo pdf > "${tex%.tex}.pdf"\n'
+    )
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script), runs
+
+
+def test_other_rasterizer_reuses_the_pdf(tmp_path, monkeypatch):
+    command, runs = fake_pdflatex(tmp_path)
+    monkeypatch.setattr(tikz_compiler, '_pdflatex_command', lambda: command)
+    compiler = TikzCompiler(
+        output_dir=str(tmp_path / 'out'), rasterizer=CopyRasterizer('.png')
+    )
+
+    async def compile_both() -> tuple[str | None, str | None]:
+        png = await compiler.compile(tikz_code)
+        svg = await compiler.compile(tikz_code, CopyRasterizer('.svg'))
+        return png, svg
+
+    png, svg = asyncio.run(compile_both())
+
+    assert png.endswith('.png') and svg.endswith('.svg')
+    assert runs.read_text().count('run') == 1
+
+
+def test_missing_rasterizer_falls_back(tmp_path, monkeypatch):
+    command, _ = fake_pdflatex(tmp_path)
+    monkeypatch.setattr(tikz_compiler, '_pdflatex_command', lambda: command)
+    monkeypatch.setattr(
+        formatting,
+        'rasterizer_for_target',
+        lambda target: PdftocairoRasterizer(executable='no-such-pdftocairo'),
+    )
+    compiler = TikzCompiler(output_dir=str(tmp_path / 'out'))
+    image_path = tmp_path / 'figure.png'
+    image_path.write_bytes(b'png')
+    response = MultimodalResponse(
+        elements=[TikzElement(code=tikz_code, image_path=str(image_path))]
+    )
+
+    assert (
+        asyncio.run(
+            compiler.compile(tikz_code, formatting.rasterizer_for_target(''))
+        )
+        is None
+    )
+    failures = asyncio.run(
+        formatting.save_response_to_markdown(
+            response, str(tmp_path / 'response.md'), tikz_compiler=compiler
+        )
+    )
+
+    assert failures == []
+    markdown = (tmp_path / 'response.md').read_text()
+    assert '](images/' in markdown
+    assert os.listdir(tmp_path / 'images')